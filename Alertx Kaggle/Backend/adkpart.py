@@ -1,16 +1,30 @@
 import asyncio
+import os
+import random
 
 # Import the main customer service agent
 from aagents import root_agent
 from dotenv import load_dotenv
 from google.adk.runners import Runner
-from google.adk.sessions import InMemorySessionService
+from history import HISTORY
+from runnerpool import RunnerPool
+from sessions import make_session_service
 # from utils import add_user_query_to_history, call_agent_async
 from google.genai import types
 from datetime import datetime
 
 load_dotenv()
 
+# 0: no per-request dumps (default); 1: dump state for a sample of requests
+# (ALERTX_DEBUG_SAMPLE, default 1%); 2: dump state and every event for all requests
+DEBUG_LEVEL = int(os.environ.get("ALERTX_DEBUG_LEVEL", 0))
+DEBUG_SAMPLE = float(os.environ.get("ALERTX_DEBUG_SAMPLE", 0.01))
+
+
+def debug_sampled() -> bool:
+    """Whether this request gets verbose state output."""
+    return DEBUG_LEVEL >= 2 or (DEBUG_LEVEL == 1 and random.random() < DEBUG_SAMPLE)
+
 class Colors:
     RESET = "\033[0m"
     BOLD = "\033[1m"
@@ -66,11 +80,12 @@ async def display_state(
         # else:
         #     print("📚 Courses: None")
 
-        # Handle interaction history in a more readable way
-        interaction_history = session.state.get("interaction_history", [])
+        # Handle interaction history in a more readable way (latest entries of the append-only log)
+        log = HISTORY.log(app_name, user_id, session_id)
+        interaction_history = log.tail()
         if interaction_history:
-            print("📝 Interaction History:")
-            for idx, interaction in enumerate(interaction_history, 1):
+            print(f"📝 Interaction History ({len(log)} entries):")
+            for idx, interaction in enumerate(interaction_history, len(log) - len(interaction_history) + 1):
                 # Pretty format dict entries, or just show strings
                 if isinstance(interaction, dict):
                     action = interaction.get("action", "interaction")
@@ -118,10 +133,14 @@ async def display_state(
 
 
 def update_interaction_history(session_service, app_name, user_id, session_id, entry):
-    """Add an entry to the interaction history in state.
+    """Add an entry to the interaction history of a session.
+
+    Entries go to the session's append-only :class:`history.InteractionLog`
+    (amortized O(1)); the session itself is neither read nor re-created.
+    Read them back with ``HISTORY.log(app_name, user_id, session_id).page()``.
 
     Args:
-        session_service: The session service instance
+        session_service: The session service instance (unused; kept for callers)
         app_name: The application name
         user_id: The user ID
         session_id: The session ID
@@ -130,33 +149,11 @@ def update_interaction_history(session_service, app_name, user_id, session_id, e
             - other keys are flexible depending on the action type
     """
     try:
-        # Get current session
-        session = session_service.get_session(
-            app_name=app_name, user_id=user_id, session_id=session_id
-        )
-
-        # Get current interaction history
-        interaction_history = session.state.get("interaction_history", [])
-
         # Add timestamp if not already present
         if "timestamp" not in entry:
             entry["timestamp"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-        print("Updated interaction History", interaction_history)
-        # Add the entry to interaction history
-        interaction_history.append(entry)
-
-        # Create updated state
-        updated_state = session.state.copy()
-        updated_state["interaction_history"] = interaction_history
-
-        # Create a new session with updated state
-        session_service.create_session(
-            app_name=app_name,
-            user_id=user_id,
-            session_id=session_id,
-            state=updated_state,
-        )
+        HISTORY.log(app_name, user_id, session_id).append(entry)
     except Exception as e:
         print(f"Error updating interaction history: {e}")
 
@@ -191,13 +188,14 @@ def add_agent_response_to_history(
         },
     )
 
-async def process_agent_response(event):
+async def process_agent_response(event, verbose=True):
     """Process and display agent response events."""
-    print(f"Event ID: {event.id}, Author: {event.author}")
+    if verbose:
+        print(f"Event ID: {event.id}, Author: {event.author}")
 
     # Check for specific parts first
     has_specific_part = False
-    if event.content and event.content.parts:
+    if verbose and event.content and event.content.parts:
         for part in event.content.parts:
             if hasattr(part, "text") and part.text and not part.text.isspace():
                 print(f"  Text: '{part.text.strip()}'")
@@ -212,6 +210,8 @@ async def process_agent_response(event):
             and event.content.parts[0].text
         ):
             final_response = event.content.parts[0].text.strip()
+            if not verbose:
+                return final_response
             # Use colors and formatting to make the final response stand out
             print(
                 f"\n{Colors.BG_BLUE}{Colors.WHITE}{Colors.BOLD}╔══ AGENT RESPONSE ═════════════════════════════════════════{Colors.RESET}"
@@ -220,36 +220,43 @@ async def process_agent_response(event):
             print(
                 f"{Colors.BG_BLUE}{Colors.WHITE}{Colors.BOLD}╚═════════════════════════════════════════════════════════════{Colors.RESET}\n"
             )
-        else:
+        elif verbose:
             print(
                 f"\n{Colors.BG_RED}{Colors.WHITE}{Colors.BOLD}==> Final Agent Response: [No text content in final event]{Colors.RESET}\n"
             )
 
     return final_response
 
-async def call_agent_async(runner, user_id, session_id, query):
-    """Call the agent asynchronously with the user's query."""
+async def call_agent_async(runner, user_id, session_id, query, verbose=True):
+    """Call the agent asynchronously with the user's query.
+
+    ``verbose`` prints the session state before/after and every event.
+    """
     content = types.Content(role="user", parts=[types.Part(text=query)])
     
     final_response_text = None
     agent_name = None
 
     # Display state before processing the message
-    await display_state(
-        runner.session_service,
-        runner.app_name,
-        user_id,
-        session_id,
-        "State BEFORE processing",
-    )
+    if verbose:
+        await display_state(
+            runner.session_service,
+            runner.app_name,
+            user_id,
+            session_id,
+            "State BEFORE processing",
+        )
+
+    add_user_query_to_history(runner.session_service, runner.app_name, user_id, session_id, query)
 
     try:
         async for event in runner.run_async(
             user_id=user_id, session_id=session_id, new_message=content
         ):
-            response = await process_agent_response(event)
+            response = await process_agent_response(event, verbose)
             if response:
                 final_response_text = response
+                agent_name = event.author
     except Exception as e:
         print(f"{Colors.BG_RED}{Colors.WHITE}ERROR during agent run: {e}{Colors.RESET}")
         print("res")
@@ -266,27 +273,31 @@ async def call_agent_async(runner, user_id, session_id, query):
         )
 
     # Display state after processing the message
-    await display_state(
-        runner.session_service,
-        runner.app_name,
-        user_id,
-        session_id,
-        "State AFTER processing",
-    )
+    if verbose:
+        await display_state(
+            runner.session_service,
+            runner.app_name,
+            user_id,
+            session_id,
+            "State AFTER processing",
+        )
 
 
     return final_response_text
 
-# ===== PART 1: Initialize In-Memory Session Service =====
-# Using in-memory storage for this example (non-persistent)
-session_service = InMemorySessionService()
+# ===== PART 1: Initialize Session Service =====
+# Bounded in-memory storage (idle TTL + size budget), or shared SQLite with ALERTX_SESSION_DB
+session_service = make_session_service()
+
+
+# Release a session's interaction log when the store evicts or prunes the session
+session_service.evict_listeners.append(HISTORY.discard)
 
 
 # ===== PART 2: Define Initial State =====
 # This will be used when creating a new session
 initial_state = {
     "user_name": "Mohamed Fazil",
-    "interaction_history": [],
 }
 
     # "purchased_courses": [],
@@ -337,47 +348,46 @@ async def main_async():
 
     # ===== PART 6: State Examination =====
     # Show final session state
-    final_session = session_service.get_session(
+    final_session = await session_service.get_session(
         app_name=APP_NAME, user_id=USER_ID, session_id=SESSION_ID
     )
     print("\nFinal Session State:")
     for key, value in final_session.state.items():
         print(f"{key}: {value}")
 
+FLASK_APP_NAME = "AURA.ai (AI for Urban Resilience & Adaptation)"
+FLASK_USER_ID = "AURA"
+
+# Built once per process: runners reused by every request
+flask_runner_pool = RunnerPool(root_agent, FLASK_APP_NAME, session_service)
+
+
 async def main_async_Flask(user_input:str):
-    # Setup constants
-    APP_NAME = "AURA.ai (AI for Urban Resilience & Adaptation)"
-    USER_ID = "AURA"
+    verbose = debug_sampled()
 
     # ===== PART 3: Session Creation =====
-    # Create a new session with initial state
+    # A lightweight session per request; the runner comes from the pool
     new_session = await session_service.create_session(
-        app_name=APP_NAME,
-        user_id=USER_ID,
+        app_name=FLASK_APP_NAME,
+        user_id=FLASK_USER_ID,
         state=initial_state,
     )
     SESSION_ID = new_session.id
-    print(f"Created new session: {SESSION_ID}")
+    if verbose:
+        print(f"Created new session: {SESSION_ID}")
 
-    # ===== PART 4: Agent Runner Setup =====
-    # Create a runner with the main customer service agent
-    runner = Runner(
-        agent=root_agent,
-        app_name=APP_NAME,
-        session_service=session_service,
-    )
-
-    
-    call_agent_async_res = await call_agent_async(runner, USER_ID, SESSION_ID, user_input)
+    # ===== PART 4: Agent Runner Checkout =====
+    async with flask_runner_pool.checkout() as runner:
+        call_agent_async_res = await call_agent_async(runner, FLASK_USER_ID, SESSION_ID, user_input, verbose)
 
     # ===== PART 6: State Examination =====
-    # Show final session state
-    final_session = await session_service.get_session(
-        app_name=APP_NAME, user_id=USER_ID, session_id=SESSION_ID
-    )
-    print("\nFinal Session State:")
-    for key, value in final_session.state.items():
-        print(f"{key}: {value}")
+    if verbose:
+        final_session = await session_service.get_session(
+            app_name=FLASK_APP_NAME, user_id=FLASK_USER_ID, session_id=SESSION_ID
+        )
+        print("\nFinal Session State:")
+        for key, value in final_session.state.items():
+            print(f"{key}: {value}")
     return call_agent_async_res
 
 
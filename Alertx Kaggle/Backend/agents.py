@@ -3,51 +3,49 @@ from google.adk.agents.llm_agent import Agent
 from google.adk.runners import Runner
 from google.adk.sessions import InMemorySessionService
 from google.adk.tools.function_tool import FunctionTool
-import requests
 
-def get_nearby_emergency_places(lat: float, lon: float, radius: int = 5000):
+from placequery import find_places_async
+from places import DEFAULT_TAGS, PlaceBatch, record_payload_size
+from ranking import rank_nearest
+from compaction import CONTEXT_COMPACTOR
+from dispatcher import ALERT_DISPATCHER
+from llmcache import LLM_CACHE
+from schemas import SCHEMA_GUARD
+from tracing import instrument
+
+EMERGENCY_AMENITIES = ["hospital", "clinic", "fire_station", "police"]
+EMERGENCY_PER_TYPE = 3  # nearest facilities kept per amenity
+
+
+# Tools are async: ADK calls sync tools directly on the event loop, stalling every other run
+async def get_nearby_emergency_places(lat: float, lon: float, radius: int = 5000):
     """Real hospitals, police, fire stations from OpenStreetMap"""
-    overpass_url = "https://overpass-api.de/api/interpreter"
-    query = f"""
-    [out:json][timeout:10];
-    (
-      node["amenity"~"hospital|clinic|fire_station|police"](around:{radius},{lat},{lon});
-      way["amenity"~"hospital|clinic|fire_station|police"](around:{radius},{lat},{lon});
-      relation["amenity"~"hospital|clinic|fire_station|police"](around:{radius},{lat},{lon});
-    );
-    out center;
-    """
     try:
-        r = requests.post(overpass_url, data={"data": query}, timeout=15)
-        print(r)
-        data = r.json()
-        places = []
-        for el in data.get("elements", []):
-            tags = el.get("tags", {})
-            name = tags.get("name", "Unnamed Facility")
-            amenity = tags.get("amenity", "unknown")
-            latlon = (el.get("lat") or el.get("center", {}).get("lat"), 
-                      el.get("lon") or el.get("center", {}).get("lon"))
-            if latlon[0] and latlon[1]:
-                places.append({"name": name, "type": amenity, "lat": latlon[0], "lon": latlon[1]})
-        return {"nearby_places": places[:10]} if places else {"nearby_places": [], "note": "No facilities found"}
+        places = [
+            {"name": p["name"] or "Unnamed Facility", "type": p["type"], "lat": p["lat"], "lon": p["lon"]}
+            for p in await find_places_async(lat, lon, radius, EMERGENCY_AMENITIES)
+        ]
+        places = rank_nearest(places, lat, lon, EMERGENCY_PER_TYPE, group_key="type")
+        return {"nearby_places": places} if places else {"nearby_places": [], "note": "No facilities found"}
     except Exception as e:
         return {"error": str(e), "nearby_places": []}
     
 
-import requests
-
-def get_nearby_places(
+async def get_nearby_places(
     lat: float, 
     lon: float, 
     radius: int = 5000,
-    amenities: list = None
+    amenities: list = None,
+    tags: list = None
 ):
     """
     Fetches nearby places from OpenStreetMap using Overpass API.
     
     amenities: list of OSM amenity types you want.
                Example: ["hospital", "clinic", "restaurant", "school", "atm"]
+    tags: OSM tags to include per place, e.g. ["phone", "opening_hours"]
+          (default: the address tags).
+    Places come back as columns: name[i], type[i], lat[i], ... describe place i.
     """
 
     if amenities is None:
@@ -63,46 +61,15 @@ def get_nearby_places(
             "bus_station", "train_station"
         ]
 
-    # Convert list → regex string
-    amenity_regex = "|".join(amenities)
-
-    overpass_url = "https://overpass-api.de/api/interpreter"
-
-    query = f"""
-    [out:json][timeout:15];
-    (
-      node["amenity"~"{amenity_regex}"](around:{radius},{lat},{lon});
-      way["amenity"~"{amenity_regex}"](around:{radius},{lat},{lon});
-      relation["amenity"~"{amenity_regex}"](around:{radius},{lat},{lon});
-    );
-    out center;
-    """
-
     try:
-        response = requests.post(overpass_url, data={"data": query}, timeout=20)
-        data = response.json()
-
-        places = []
-        for el in data.get("elements", []):
-            tags = el.get("tags", {})
-
-            places.append({
-                "name": tags.get("name", "Unnamed"),
-                "type": tags.get("amenity", "unknown"),
-                "address": {
-                    "street": tags.get("addr:street"),
-                    "housenumber": tags.get("addr:housenumber"),
-                    "city": tags.get("addr:city"),
-                },
-                "lat": el.get("lat") or el.get("center", {}).get("lat"),
-                "lon": el.get("lon") or el.get("center", {}).get("lon"),
-                "raw_tags": tags   # include full metadata
-            })
-
+        parsed = await find_places_async(lat, lon, radius, amenities)
+        nearest = PlaceBatch.from_parsed(parsed, DEFAULT_TAGS if tags is None else tags).nearest(lat, lon, 50)  # nearest 50 to avoid overload
+        places = nearest.to_columns()
+        record_payload_size("get_nearby_places", places, parsed, [nearest])
         return {
             "query_amenities": amenities,
-            "count": len(places),
-            "places": places[:50]   # return first 50 to avoid overload
+            "count": len(parsed),
+            "places": places,
         }
 
     except Exception as e:
@@ -172,7 +139,7 @@ location_agent = Agent(
         Output format rule:
         - Return only valid JSON
         - Do not add explanations or text outside the JSON
-        - Keep distances realistic (0.5 – 3.0 km)
+        - Use the distance_km returned by the tool; do not estimate distances
     """,
     output_key="location_data"
 )
@@ -186,10 +153,10 @@ final_reporter = Agent(
 
         INPUTS (do not change):
         Event:
-        {event_json}
+        {video_analysis}
 
         Location Info:
-        {loc_json}
+        {location_data}
 
         TASK — produce a single JSON object (strict JSON only; no extra text or markdown) containing these keys:
         1) INFRASTRUCTURE_AND_PEOPLE_IMPACTS: an array of short strings, each "<entity>: <one-line impact>".
@@ -209,7 +176,7 @@ final_reporter = Agent(
         Important rules:
         - Do NOT invent phone numbers or unverifiable contacts. You may suggest roles (e.g., "Local Fire Dept") but not specific personal contact details.
         - Be pragmatic and prioritize human safety and fast actions.
-        - If location shows nearby hospitals/fire stations in loc_json, reference them by name in appropriate items
+        - If location shows nearby hospitals/fire stations in the location info, reference them by name in appropriate items
     Combine video analysis and location data into final emergency report.
    Video ANalyize Report
    {{video_analysis}}
@@ -226,7 +193,7 @@ twillio_call_agent = Agent(
     name="TwillioAgent",
     model="gemini-1.5-pro",
     instruction="""
-you have access to to and from no of twillio you have to collect the data from final_reporter {final_reporter} and then summarize 
+you have access to to and from no of twillio you have to collect the data from final_reporter {final_report} and then summarize 
  You are a voice-based AI Alert Agent named {}.
     Your job is to generate a short spoken message (under 35 words or 2-3 sentences) for a phone call.
 
@@ -239,10 +206,13 @@ you have access to to and from no of twillio you have to collect the data from f
     Do not include extra text, quotes, or formatting.
 
     Content to summarize:
-    {final_reporter}
+    {final_report}
 """,
 description="you have to use twillio to call the correponding covernemt authorities to tell the urgnecy in 1 or 2 lines",
+output_key="call_message",
 )
+# The agent only writes the spoken message; the call itself is queued for the dispatcher
+ALERT_DISPATCHER.install(twillio_call_agent, message_key="call_message")
 
 VideoAnalyzer_Near_LocationSearch_Agent = ParallelAgent(
     sub_agents=[video_analyzer, location_agent],
@@ -274,6 +244,11 @@ root_agent = Agent(
     sub_agents=[emergency_pipeline]
     # AgentTool
 )
+instrument(root_agent)
+# This FinalReporter writes a markdown report, not the final_report JSON schema
+SCHEMA_GUARD.install(root_agent, output_keys=("video_analysis", "location_data"))
+LLM_CACHE.install(root_agent)
+CONTEXT_COMPACTOR.install(root_agent)
 
 
 # print(get_nearby_emergency_places(12.8936556,77.7108574))
@@ -0,0 +1,243 @@
+import asyncio
+import json
+import os
+import time
+
+from dotenv import load_dotenv
+from google.adk.agents.run_config import RunConfig, StreamingMode
+from google.genai.types import Content, Part
+
+from keyframes import extract_keyframes, keyframe_parts, keyframes_available, record_savings
+from prefetch import bind, discard
+from resultcache import RESULT_CACHE
+from tracing import TIMING_EVENTS, current_trace, observe, pop_trace, span
+from upload import delete_remote_file, video_part
+
+load_dotenv()
+
+USER_ID = "alertx"
+
+# State keys the client renders as per-agent cards
+STATE_AGENTS = {"video_analysis": "Video", "location_data": "Location"}
+STREAM_REPORT = os.environ.get("ALERTX_STREAM_REPORT", "1") == "1"
+# Agents whose text is streamed token by token as `report_delta` events
+STREAM_AGENTS = {a.strip() for a in os.environ.get("ALERTX_STREAM_AGENTS", "FinalReporter").split(",") if a.strip()}
+
+
+def sse(event: dict, event_id: int = None) -> str:
+    """One Server-Sent Events frame (with an ``id:`` line when resumable)."""
+    prefix = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{prefix}data: {json.dumps(event)}\n\n"
+
+
+# ==================== REQUEST PREPARATION ====================
+def prepare_video(upload, mime_type: str = "video/mp4", risk_tier: str = None, scope: str = "") -> dict:
+    """Turn a finished upload into model parts, or find a cached result for it.
+
+    ``upload`` is a closed :class:`upload.HashingUpload`; ``scope`` is the
+    request's :func:`resultcache.cache_scope`. Blocking (decodes the
+    video and may upload it to the Files API), so async servers should run it
+    in a worker thread.
+    """
+    token = current_trace.set(upload.path)
+    try:
+        video = _prepare_video(upload, mime_type, risk_tier, scope)
+    finally:
+        current_trace.reset(token)
+    upload_span = []
+    if getattr(upload, "elapsed", None) is not None:
+        upload_span = [{"stage": "upload", "ms": round(upload.elapsed * 1000, 1), "bytes": upload.size}]
+    video["spans"] = upload_span + pop_trace(upload.path)
+    return video
+
+
+def _prepare_video(upload, mime_type, risk_tier, scope):
+    video = {
+        "scope": scope,
+        "path": upload.path,
+        "sha256": upload.sha256,
+        "size": upload.size,
+        "parts": [],
+        "cached": None,
+        "frame_hashes": [],
+        "keyframes": None,
+        "remote_file": None,
+    }
+
+    # Same bytes?
+    video["cached"] = RESULT_CACHE.get(upload.sha256, scope)
+    if video["cached"] is not None:
+        return video
+
+    # One decode pass yields both the compact keyframe set (preferred over the
+    # full clip) and the frame hashes for the near-duplicate lookup
+    frames = None
+    if keyframes_available():
+        try:
+            with span("keyframes") as attrs:
+                frames = extract_keyframes(upload.path, risk_tier)
+                attrs["bytes"] = frames["sent_bytes"]
+            video["frame_hashes"] = frames["hashes"]
+        except Exception as e:
+            print(f"Keyframe extraction failed ({e}); sending full video, exact-match caching only")
+
+    # A re-encoded/trimmed copy of a clip we already analysed?
+    video["cached"] = RESULT_CACHE.get_similar(video["frame_hashes"], scope)
+    if video["cached"] is not None:
+        return video
+
+    if frames is not None:
+        video["parts"] = keyframe_parts(frames)
+        video["keyframes"] = record_savings(frames)
+    else:
+        part, video["remote_file"] = video_part(upload, mime_type)
+        video["parts"] = [part]
+    return video
+
+
+def cleanup_video(video):
+    if not video:
+        return
+    if video["path"] and os.path.exists(video["path"]):
+        os.unlink(video["path"])
+    delete_remote_file(video["remote_file"])
+    video["path"] = video["remote_file"] = None  # safe to call again
+
+
+# ==================== EVENT MAPPING ====================
+def to_client_events(event) -> list:
+    """Map one ADK event onto the client's log/text/state/final/error contract.
+
+    Partial (streamed) text from :data:`STREAM_AGENTS` becomes ``report_delta``
+    events; the complete text and ``final`` still follow once it is done.
+    """
+    out = []
+    if event.partial:
+        if event.author in STREAM_AGENTS and event.content and event.content.parts:
+            for part in event.content.parts:
+                if part.text and not part.thought:
+                    out.append({"type": "report_delta", "delta": part.text, "agent": event.author})
+        return out
+    if event.error_message:
+        out.append({"type": "error", "message": event.error_message, "agent": event.author})
+    if event.content and event.content.parts:
+        for part in event.content.parts:
+            if part.function_call:
+                out.append({"type": "log", "message": f"🔧 {event.author} → {part.function_call.name}"})
+            elif part.text and not part.text.isspace() and not part.thought:
+                out.append({"type": "text", "content": part.text, "agent": event.author})
+    for key, value in (event.actions.state_delta if event.actions else {}).items():
+        if key == "final_report":
+            out.append({"type": "final", "report": value})
+        elif key in STATE_AGENTS:
+            out.append({"type": "state", "agent": STATE_AGENTS[key], "data": value})
+        elif not key.startswith("temp:"):
+            out.append({"type": "state", "data": {key: value}})
+    return out
+
+
+# ==================== RUNNING ====================
+async def analysis_events(runner, text: str, video: dict = None, timing: bool = None,
+                          location: dict = None, pending_location=None, stream_report: bool = None):
+    """Async generator of client events for one /analyze request.
+
+    Replays a cached result when ``video`` has one; otherwise runs ``runner``
+    and caches a successful run. Closing the generator (client gone) cancels
+    the run and still cleans up the upload. With ``timing`` (default
+    ``ALERTX_TIMING_EVENTS``) a last ``timing`` event lists the run's spans.
+    ``location`` (client GPS) goes into session state as ``user_location``
+    together with its already started facility lookup ``pending_location``
+    (see :class:`prefetch.LocationPrefetch`). ``stream_report`` (default
+    ``ALERTX_STREAM_REPORT``) runs the model in SSE mode so the report
+    arrives as ``report_delta`` events before ``final``.
+    """
+    timing = TIMING_EVENTS if timing is None else timing
+    stream_report = STREAM_REPORT if stream_report is None else stream_report
+    spans = list(video.get("spans", [])) if video else []
+    invocation_id = None
+    session = None
+    try:
+        if video and video["cached"]:
+            note = "♻️ This video was analysed recently; replaying the cached result"
+            yield {"type": "log", "message": note, "cached": True}
+            for event in video["cached"]["events"]:
+                yield event
+            if timing:
+                yield {"type": "timing", "spans": spans, "cached": True}
+            return
+
+        yield {"type": "log", "message": "🚨 Analysis started..."}
+        if video and video["keyframes"]:
+            info = video["keyframes"]
+            note = (f"🎞️ Sent {info['frames']} keyframes ({info['sent_bytes']} bytes) "
+                    f"instead of the full video, saving {info['bytes_saved']} bytes")
+            yield {"type": "log", "message": note, "keyframes": info}
+
+        parts = [Part(text=text)] + (video["parts"] if video else [])
+        state = {"user_location": location} if location else None
+        session = await runner.session_service.create_session(app_name=runner.app_name, user_id=USER_ID, state=state)
+        if location and pending_location is not None:
+            bind(session.id, pending_location)
+
+        events = []  # agent output, kept for the result cache
+        results = {}
+        failed = False
+        first_delta = None
+        run_config = RunConfig(streaming_mode=StreamingMode.SSE if stream_report else StreamingMode.NONE)
+        started = time.perf_counter()
+        try:
+            async for adk_event in runner.run_async(
+                user_id=USER_ID, session_id=session.id, new_message=Content(role="user", parts=parts),
+                run_config=run_config,
+            ):
+                invocation_id = invocation_id or adk_event.invocation_id
+                for event in to_client_events(adk_event):
+                    if event["type"] == "report_delta":
+                        if first_delta is None:  # time to the first words of the report
+                            first_delta = time.perf_counter() - started
+                            observe("report.first_delta", first_delta)
+                            spans.append({"stage": "report.first_delta", "ms": round(first_delta * 1000, 1)})
+                        yield event  # not cached: a replay sends the complete report at once
+                        continue
+                    if event["type"] == "final":
+                        results["final_report"] = event["report"]
+                    elif event["type"] == "state" and event.get("agent") == "Video":
+                        results["video_analysis"] = event["data"]
+                    failed = failed or event["type"] == "error"
+                    events.append(event)
+                    yield event
+        except Exception as e:
+            failed = True
+            yield {"type": "error", "message": str(e)}
+        elapsed = time.perf_counter() - started
+        observe("pipeline", elapsed)
+        spans.append({"stage": "pipeline", "ms": round(elapsed * 1000, 1)})
+
+        if video and not failed and "final_report" in results:
+            RESULT_CACHE.put(video["sha256"], video["frame_hashes"], events, results, video["scope"])
+        if timing:
+            yield {"type": "timing", "spans": spans + pop_trace(invocation_id)}
+    finally:
+        if pending_location is not None:
+            if session is not None:
+                discard(session.id)
+            else:
+                pending_location.cancel()
+        if invocation_id:
+            pop_trace(invocation_id)  # drop spans nobody asked for
+        cleanup_video(video)
+
+
+def iterate_blocking(agen):
+    """Drive an async generator from synchronous code (Flask's WSGI generators)."""
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(agen.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        # Runs on normal exit and when the WSGI server closes us (client gone)
+        loop.run_until_complete(agen.aclose())
+        loop.close()
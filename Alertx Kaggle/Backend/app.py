@@ -1,57 +1,100 @@
 # backend/app.py
+import asyncio
 from flask import Flask, request, Response
 from flask_cors import CORS
-import json
 import os
-import tempfile
 from google.adk.agents import LlmAgent, ParallelAgent, SequentialAgent
 from google.adk.agents.llm_agent import Agent
 from google.adk.runners import Runner
-from google.adk.sessions import InMemorySessionService
 
 
-from google.genai.types import Content, Part, Blob
-import requests
 from dotenv import load_dotenv
 
-session_service = InMemorySessionService()
+from placequery import find_places, find_places_async
+from ranking import rank_nearest
+from analysis import analysis_events, iterate_blocking, prepare_video, sse
+from jobs import enqueue, follow_events, get_job, job_record, last_event_id, start_workers
+from incidents import INCIDENTS
+from dispatcher import ALERT_DISPATCHER, start_dispatcher
+from upload import MAX_UPLOAD_BYTES, UploadRequest
+from placecache import PLACE_CACHE
+from resultcache import RESULT_CACHE, cache_scope
+from keyframes import KEYFRAME_STATS
+from tracing import instrument, register_stats, render_metrics
+from callbacks import add_callback
+from prefetch import LocationPrefetch, parse_location
+from router import Router
+from sessions import make_session_service
+from overpass import OVERPASS
+from batchlookup import BATCH_LOOKUP
+from compression import compress_frames, negotiate, stream_headers
+from schemas import SCHEMA_GUARD
+from compaction import CONTEXT_COMPACTOR
+from llmcache import LLM_CACHE
+
+session_service = make_session_service()  # bounded RAM, or shared SQLite with ALERTX_SESSION_DB
 # === PUT YOUR KEY HERE SAFELY ===
 load_dotenv()  # This reads .env file if exists
 os.environ["GEMINI_API_KEY"] = ""
 app = Flask(__name__)
+app.request_class = UploadRequest
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_BYTES + 1024 * 1024  # room for the other form fields
 CORS(app, origins=["http://localhost:5173", "http://127.0.0.1:5173"])  # Your React app
 
 # ==================== REAL TOOL: Nearby Emergency Facilities ====================
 # @Tool
-def get_nearby_emergency_places(lat: float, lon: float, radius: int = 5000):
+EMERGENCY_AMENITIES = ["hospital", "clinic", "fire_station", "police"]
+EMERGENCY_PER_TYPE = 3  # nearest facilities kept per amenity
+
+
+def facility(place: dict) -> dict:
+    facility = {"name": place["name"] or "Unnamed Facility", "type": place["type"], "lat": place["lat"], "lon": place["lon"]}
+    if "distance_km" in place:
+        facility["distance_km"] = place["distance_km"]
+    return facility
+
+
+def emergency_result(parsed, lat: float, lon: float) -> dict:
+    places = rank_nearest([facility(p) for p in parsed], lat, lon, EMERGENCY_PER_TYPE, group_key="type")
+    return {"nearby_places": places} if places else {"nearby_places": [], "note": "No facilities found"}
+
+
+def nearby_emergency_places(lat: float, lon: float, radius: int = 5000):
+    """Blocking twin of :func:`get_nearby_emergency_places` for worker threads (the location prefetch)."""
+    try:
+        return emergency_result(find_places(lat, lon, radius, EMERGENCY_AMENITIES), lat, lon)
+    except Exception as e:
+        return {"error": str(e), "nearby_places": []}
+
+
+# Tools are async: ADK calls sync tools directly on the event loop, stalling every other run
+async def get_nearby_emergency_places(lat: float, lon: float, radius: int = 5000):
     """Real hospitals, police, fire stations from OpenStreetMap"""
-    overpass_url = "https://overpass-api.de/api/interpreter"
-    query = f"""
-    [out:json][timeout:10];
-    (
-      node["amenity"~"hospital|clinic|fire_station|police"](around:{radius},{lat},{lon});
-      way["amenity"~"hospital|clinic|fire_station|police"](around:{radius},{lat},{lon});
-      relation["amenity"~"hospital|clinic|fire_station|police"](around:{radius},{lat},{lon});
-    );
-    out center;
-    """
     try:
-        r = requests.post(overpass_url, data={"data": query}, timeout=15)
-        data = r.json()
-        places = []
-        for el in data.get("elements", []):
-            tags = el.get("tags", {})
-            name = tags.get("name", "Unnamed Facility")
-            amenity = tags.get("amenity", "unknown")
-            latlon = (el.get("lat") or el.get("center", {}).get("lat"), 
-                      el.get("lon") or el.get("center", {}).get("lon"))
-            if latlon[0] and latlon[1]:
-                places.append({"name": name, "type": amenity, "lat": latlon[0], "lon": latlon[1]})
-        return {"nearby_places": places[:10]} if places else {"nearby_places": [], "note": "No facilities found"}
+        return emergency_result(await find_places_async(lat, lon, radius, EMERGENCY_AMENITIES), lat, lon)
     except Exception as e:
         return {"error": str(e), "nearby_places": []}
 
 
+def nearby_emergency_places_batch(incidents, radius: int = 5000):
+    """Nearest facilities for many ``{"id", "lat", "lon"}`` incidents, one Overpass query per area."""
+    results = BATCH_LOOKUP.lookup(incidents, radius, EMERGENCY_AMENITIES, EMERGENCY_PER_TYPE)
+    for result in results:
+        result["nearby_places"] = [facility(p) for p in result["nearby_places"]]
+    return results
+
+
+async def get_nearby_emergency_places_batch(lats: list[float], lons: list[float], radius: int = 5000):
+    """Real hospitals, police, fire stations near several incidents at once (lats[i], lons[i] is incident i)"""
+    try:
+        if len(lats) != len(lons):
+            return {"error": "lats and lons must have the same length", "incidents": []}
+        incidents = [{"id": i, "lat": lat, "lon": lon} for i, (lat, lon) in enumerate(zip(lats, lons))]
+        return {"incidents": await asyncio.to_thread(nearby_emergency_places_batch, incidents, radius)}
+    except Exception as e:
+        return {"error": str(e), "incidents": []}
+
+
 # ==================== AGENTS ====================
 video_analyzer = Agent(
     name="VideoAnalyzer",
@@ -76,14 +119,19 @@ location_agent = Agent(
     model="gemini-1.5-pro",
     tools=[get_nearby_emergency_places],
     instruction="""
-    Estimate location from video (landmarks, signs, etc.).
+    Device GPS location, if the user shared it: {user_location?}
+    If it is given, use it. Otherwise estimate location from video (landmarks, signs, etc.).
     If unclear, use default: lat=12.9716, lon=77.5946 (Bangalore center).
-    Then call get_nearby_emergency_places tool.
+    Then call get_nearby_emergency_places tool and keep its distance_km values as returned.
     Return JSON: { "user_location": {"lat": x, "lon": y}, "nearby_places": [...] }
     """,
     output_key="location_data"
 )
 
+# With client GPS the facility lookup starts with the request and LocationAgent's model turn is skipped
+location_prefetch = LocationPrefetch(nearby_emergency_places)
+add_callback(location_agent, "before_agent_callback", location_prefetch.before_agent, first=True)
+
 final_reporter = Agent(
     name="FinalReporter",
     model="gemini-1.5-pro",
@@ -101,6 +149,8 @@ final_reporter = Agent(
     """,
     output_key="final_report"
 )
+# The alert call is queued for the dispatcher; the pipeline does not wait for Twilio
+ALERT_DISPATCHER.install(final_reporter)
 
 
 p_agent = ParallelAgent(sub_agents=[video_analyzer, location_agent],
@@ -121,16 +171,42 @@ root_agent = Agent(
     model="gemini-1.5-pro",
     instruction="""
     - If user uploads a video → reply exactly: TRIGGER_PIPELINE
+    - If asked for facilities near several incident locations, call get_nearby_emergency_places_batch once with all of them.
     - Otherwise answer normally.
     """,
+    tools=[get_nearby_emergency_places_batch],
     sub_agents=[emergency_pipeline]
     # AgentTool
 )
 
-runner = Runner(agent=root_agent,
+# Per-agent / model / tool spans for /metrics and the optional `timing` event
+instrument(root_agent)
+# Repair agent JSON locally before output_key publishes it; re-ask the model only when that fails
+SCHEMA_GUARD.install(root_agent)
+# Reuse FinalReporter answers for identical (compacted) inputs within a TTL
+LLM_CACHE.install(root_agent)
+# Downstream agents get a compacted, token-budgeted context instead of the whole history
+CONTEXT_COMPACTOR.install(root_agent)
+register_stats("alertx_place_cache", PLACE_CACHE.stats)
+register_stats("alertx_result_cache", RESULT_CACHE.stats)
+register_stats("alertx_keyframes", lambda: dict(KEYFRAME_STATS))
+register_stats("alertx_location_prefetch", location_prefetch.stats)
+
+chat_runner = Runner(agent=root_agent,
     session_service=session_service,
      app_name='APP_NAME',
      )
+# Uploads skip root_agent (it only ever answered TRIGGER_PIPELINE for them)
+pipeline_runner = Runner(agent=emergency_pipeline, session_service=session_service, app_name='APP_NAME')
+runner = Router(chat_runner, pipeline_runner)
+register_stats("alertx_router", runner.stats)
+register_stats("alertx_sessions", session_service.stats)
+register_stats("alertx_overpass", OVERPASS.stats)
+register_stats("alertx_batch_lookup", BATCH_LOOKUP.stats)
+register_stats("alertx_schema", SCHEMA_GUARD.stats)
+register_stats("alertx_llm_cache", LLM_CACHE.stats)
+register_stats("alertx_incidents", INCIDENTS.stats)
+register_stats("alertx_alerts", ALERT_DISPATCHER.stats)
 
 
 # # ==================== STREAMING ENDPOINT ====================
@@ -182,54 +258,231 @@ runner = Runner(agent=root_agent,
 #     return Response(stream(), mimetype="text/event-stream")
 
 
+def received_video():
+    """The uploaded video as ``(upload, mime_type)``, or ``(None, None)``.
+
+    Every other file part was spooled to disk too and is deleted here.
+    """
+    video_file = request.files.get("video")
+    for _, file in request.files.items(multi=True):
+        if file is not video_file and hasattr(file.stream, "discard"):
+            file.stream.discard()
+    if video_file and video_file.filename:
+        # The multipart parser already streamed the video to disk (UploadRequest)
+        upload = video_file.stream
+        upload.close()
+        mime_type = video_file.mimetype if (video_file.mimetype or "").startswith("video/") else "video/mp4"
+        print(f"Received video {video_file.filename}: {upload.size} bytes, sha256={upload.sha256}")
+        return upload, mime_type
+    if video_file is not None:
+        video_file.stream.discard()  # empty file field
+    return None, None
+
+
+def discard_uploads():
+    """Delete the temp files of every uploaded part; for error responses.
+
+    Does nothing before the body was parsed, so an early error does not
+    spool the upload just to delete it.
+    """
+    if "files" not in request.__dict__:
+        return
+    for _, file in request.files.items(multi=True):
+        if hasattr(file.stream, "discard"):
+            file.stream.discard()
+
+
+def timing_requested(form):
+    """``timing=1`` on the form asks for a final `timing` event (None: server default)."""
+    value = form.get("timing")
+    return None if value is None else value.lower() in ("1", "true", "yes")
+
+
+def requested_location(form):
+    """Client GPS from the ``lat``/``lon`` form fields; ValueError when malformed."""
+    return parse_location(form.get("lat"), form.get("lon"))
+
+
+def early_location():
+    """Client GPS sent outside the body (``?lat=&lon=`` or ``X-Latitude``/``X-Longitude``).
+
+    Readable before the upload has arrived, so the facility lookup can run
+    while the video is still streaming in. ValueError when malformed.
+    """
+    return parse_location(request.args.get("lat", request.headers.get("X-Latitude")),
+                          request.args.get("lon", request.headers.get("X-Longitude")))
+
+
 @app.route("/analyze", methods=["POST"])
 def analyze():
+    pending_location = None
+    try:
+        # GPS in the URL or headers starts the facility lookup before the body is read;
+        # form fields only once the whole upload is on disk
+        location = early_location()
+        if location:
+            pending_location = location_prefetch.start(location)
+        text = request.form.get("text", "Analyze this video")
+        if location is None:
+            location = requested_location(request.form)
+            if location:
+                pending_location = location_prefetch.start(location)
+    except ValueError:
+        discard_uploads()
+        return {"error": "Invalid lat/lon"}, 400
+    except Exception:  # e.g. RequestEntityTooLarge while spooling
+        if pending_location is not None:
+            pending_location.cancel()
+        discard_uploads()
+        raise
+    upload, mime_type = received_video()
+
+    video = None
+    if upload is not None:
+        try:
+            video = prepare_video(upload, mime_type, request.form.get("risk_tier"), cache_scope(text, location))
+        except Exception:  # e.g. the Files API and the inline fallback both failed
+            upload.discard()
+            if pending_location is not None:
+                pending_location.cancel()
+            raise
+    timing = timing_requested(request.form)
+
+    encoding = negotiate(request.headers.get("Accept-Encoding"))
+
+    def stream():
+        events = analysis_events(runner, text, video, timing, location, pending_location)
+        for event in iterate_blocking(events):
+            yield sse(event)
+
+    return Response(compress_frames(stream(), encoding), mimetype="text/event-stream", headers=stream_headers(encoding))
+
+# ==================== BACKGROUND JOBS ====================
+@app.route("/jobs", methods=["POST"])
+def submit_job():
+    """Queue an analysis; results are read from /jobs/<id>/events."""
+    try:
+        location = early_location() or requested_location(request.form)
+    except ValueError:
+        discard_uploads()
+        return {"error": "Invalid lat/lon"}, 400
     text = request.form.get("text", "Analyze this video")
-    video_file = request.files.get("video")
+    upload, mime_type = received_video()
+    try:
+        job_id = enqueue(text, upload, mime_type or "video/mp4", request.form.get("risk_tier"), location)
+    except Exception:
+        if upload is not None:
+            upload.discard()
+        raise
+    return {"job_id": job_id, "status": "queued", "events_url": f"/jobs/{job_id}/events"}, 202
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    try:
+        return job_record(job_id)
+    except KeyError:
+        return {"error": "Unknown job"}, 404
 
-    parts = [text]
-    temp_path = None
+@app.route("/incidents", methods=["GET"])
+def incident_stats():
+    return INCIDENTS.stats()
 
-    if video_file and video_file.filename:
-        temp_path = tempfile.NamedTemporaryFile(delete=False, suffix=".mp4").name
-        video_file.save(temp_path)
-        video_bytes = open(temp_path, "rb").read()
-        parts.append(Part(inline_data=Blob(mime_type="video/mp4", data=video_bytes)))
+@app.route("/alerts", methods=["GET"])
+def alert_stats():
+    return ALERT_DISPATCHER.stats()
 
-    message = {"role": "user", "parts": parts}
+@app.route("/jobs/<job_id>/events", methods=["GET"])
+def job_events(job_id):
+    try:
+        get_job(job_id)
+    except KeyError:
+        return {"error": "Unknown job"}, 404
+    after_id = last_event_id(request.headers, request.args)
+
+    encoding = negotiate(request.headers.get("Accept-Encoding"))
 
     def stream():
-        yield "data: " + json.dumps({"type": "log", "message": "🚨 Analysis started..."}) + "\n\n"
+        for event_id, event in follow_events(job_id, after_id):
+            yield sse(event, event_id)
+
+    return Response(compress_frames(stream(), encoding), mimetype="text/event-stream", headers=stream_headers(encoding))
+
+@app.route("/cache/places", methods=["GET"])
+def place_cache_stats():
+    return PLACE_CACHE.stats()
+
+@app.route("/cache/results", methods=["GET"])
+def result_cache_stats():
+    return RESULT_CACHE.stats()
+
+@app.route("/cache/sessions", methods=["GET"])
+def session_stats():
+    return session_service.stats()
+
+@app.route("/prefetch/location", methods=["GET"])
+def location_prefetch_stats():
+    return location_prefetch.stats()
+
+@app.route("/router", methods=["GET"])
+def router_stats():
+    return runner.stats()
+
+def requested_incidents(payload):
+    """Validated ``{"id", "lat", "lon"}`` incidents and radius from a batch request body; ValueError when malformed."""
+    if not isinstance(payload, dict):
+        raise ValueError("expected a JSON object")
+    incidents = []
+    for i, item in enumerate(payload.get("incidents") or []):
+        if not isinstance(item, dict):
+            raise ValueError(f"incident {i} is not an object")
+        location = parse_location(item.get("lat"), item.get("lon"))
+        if location is None:
+            raise ValueError(f"incident {i} has no lat/lon")
+        incidents.append({"id": item.get("id", i), **location})
+    if not incidents:
+        raise ValueError("no incidents given")
+    return incidents, int(payload.get("radius", 5000))
+
+@app.route("/places/batch", methods=["POST"])
+def places_batch():
+    try:
+        incidents, radius = requested_incidents(request.get_json(silent=True) or {})
+        return {"incidents": nearby_emergency_places_batch(incidents, radius)}
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    except Exception as e:
+        return {"error": str(e)}, 502
 
-        try:
-            # NEW CORRECT WAY: root_agent.stream() NOT runner.stream()
-            for chunk in root_agent.stream([message]):
-                if chunk.type == "text":
-                    yield f"data: {json.dumps({'type': 'text', 'content': chunk.text})}\n\n"
-                elif chunk.type == "state":
-                    state = chunk.state or {}
-                    if "final_report" in state:
-                        yield f"data: {json.dumps({'type': 'final', 'report': state['final_report']})}\n\n"
-                    elif "video_analysis" in state:
-                        yield f"data: {json.dumps({'type': 'state', 'agent': 'Video', 'data': state['video_analysis']})}\n\n"
-                    elif "location_data" in state:
-                        yield f"data: {json.dumps({'type': 'state', 'agent': 'Location', 'data': state['location_data']})}\n\n"
-                    else:
-                        yield f"data: {json.dumps({'type': 'state', 'data': state})}\n\n"
-                elif chunk.type == "log":
-                    yield f"data: {json.dumps({'type': 'log', 'message': chunk.message})}\n\n"
-
-        except Exception as e:
-            yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
-
-        # Cleanup
-        if temp_path and os.path.exists(temp_path):
-            os.unlink(temp_path)
-
-    return Response(stream(), mimetype="text/event-stream")
+@app.route("/places/batch/stats", methods=["GET"])
+def places_batch_stats():
+    return BATCH_LOOKUP.stats()
+
+@app.route("/schemas", methods=["GET"])
+def schema_stats():
+    return SCHEMA_GUARD.stats()
+
+@app.route("/cache/llm", methods=["GET"])
+def llm_cache_stats():
+    return LLM_CACHE.stats()
+
+@app.route("/compaction", methods=["GET"])
+def compaction_stats():
+    return CONTEXT_COMPACTOR.stats()
+
+@app.route("/overpass", methods=["GET"])
+def overpass_stats():
+    return OVERPASS.stats()
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
 
 if __name__ == "__main__":
     print("Backend running → http://localhost:5000")
     print("React frontend → http://localhost:5173")
+    # Local job workers; more can run elsewhere with `python jobs.py worker`
+    start_workers(int(os.environ.get("ALERTX_JOB_WORKERS", 1)))
+    # Places queued alert calls; more can run elsewhere with `python dispatcher.py`
+    start_dispatcher()
     # app.run(host="0.0.0.0", threaded=True)
     app.run()
\ No newline at end of file
@@ -0,0 +1,265 @@
+# backend/asgi_app.py — asyncio-native server mode:  python asgi_app.py  (or: uvicorn asgi_app:app)
+import os
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from analysis import analysis_events, cleanup_video, prepare_video, sse
+from app import (location_prefetch, nearby_emergency_places_batch, requested_incidents, requested_location, runner,
+                 session_service, timing_requested)
+from prefetch import parse_location
+from jobs import enqueue, follow_events_async, get_job, job_record, last_event_id
+from incidents import INCIDENTS
+from dispatcher import ALERT_DISPATCHER, start_dispatcher
+from batchlookup import BATCH_LOOKUP
+from compaction import CONTEXT_COMPACTOR
+from llmcache import LLM_CACHE
+from compression import compress_frames_async, negotiate, stream_headers
+from overpass import OVERPASS
+from placecache import PLACE_CACHE
+from resultcache import RESULT_CACHE, cache_scope
+from schemas import SCHEMA_GUARD
+from tracing import render_metrics
+from upload import MAX_UPLOAD_BYTES, receive_form
+
+
+def early_location(request):
+    """Client GPS from ``?lat=&lon=`` or ``X-Latitude``/``X-Longitude``, known before the body arrives."""
+    return parse_location(request.query_params.get("lat", request.headers.get("x-latitude")),
+                          request.query_params.get("lon", request.headers.get("x-longitude")))
+
+
+def too_large(request) -> bool:
+    # A fast path only: chunked bodies have no length, so receive_form enforces the cap as it reads
+    return int(request.headers.get("content-length") or 0) > MAX_UPLOAD_BYTES + 1024 * 1024
+
+
+def release(upload=None, pending_location=None):
+    """Delete a received upload and cancel its facility prefetch (request rejected or failed)."""
+    if upload is not None:
+        upload.discard()
+    if pending_location is not None:
+        pending_location.cancel()
+
+
+def rejected(status_code: int, message: str, upload=None, pending_location=None):
+    release(upload, pending_location)
+    return JSONResponse({"error": message}, status_code=status_code)
+
+
+def upload_mime_type(upload) -> str:
+    return upload.content_type if upload.content_type.startswith("video/") else "video/mp4"
+
+
+async def analyze(request):
+    if too_large(request):
+        return rejected(413, "Video too large")
+    try:
+        location = early_location(request)
+    except ValueError:
+        return rejected(400, "Invalid lat/lon")
+    # With GPS in the URL or headers, the facility lookup overlaps the upload
+    pending_location = location_prefetch.start(location) if location else None
+    try:
+        form, upload = await receive_form(request)
+    except RequestEntityTooLarge:
+        return rejected(413, "Video too large", pending_location=pending_location)
+    except ValueError:
+        return rejected(400, "Malformed form data", pending_location=pending_location)
+    text = form.get("text") or "Analyze this video"
+    if location is None:
+        try:
+            location = requested_location(form)
+        except ValueError:
+            return rejected(400, "Invalid lat/lon", upload)
+        pending_location = location_prefetch.start(location) if location else None
+
+    video = None
+    if upload is not None:
+        print(f"Received video {upload.filename}: {upload.size} bytes, sha256={upload.sha256}")
+        try:
+            # Decoding / Files API upload block, so keep them off the event loop
+            video = await run_in_threadpool(prepare_video, upload, upload_mime_type(upload), form.get("risk_tier"),
+                                            cache_scope(text, location))
+        except Exception:
+            release(upload, pending_location)
+            raise
+
+    timing = timing_requested(form)
+
+    async def stream():
+        # Each frame is sent before the next runner event is pulled, so a slow
+        # client slows its own run instead of buffering events in memory. On
+        # disconnect Starlette cancels this generator, which closes the runner.
+        events = analysis_events(runner, text, video, timing, location, pending_location)
+        try:
+            async for event in events:
+                yield sse(event)
+        finally:
+            await events.aclose()
+            cleanup_video(video)
+
+    encoding = negotiate(request.headers.get("accept-encoding"))
+    return StreamingResponse(compress_frames_async(stream(), encoding), media_type="text/event-stream",
+                             headers=stream_headers(encoding))
+
+
+async def submit_job(request):
+    if too_large(request):
+        return rejected(413, "Video too large")
+    try:
+        location = early_location(request)
+    except ValueError:
+        return rejected(400, "Invalid lat/lon")
+    try:
+        form, upload = await receive_form(request)
+    except RequestEntityTooLarge:
+        return rejected(413, "Video too large")
+    except ValueError:
+        return rejected(400, "Malformed form data")
+    text = form.get("text") or "Analyze this video"
+    if location is None:
+        try:
+            location = requested_location(form)
+        except ValueError:
+            return rejected(400, "Invalid lat/lon", upload)
+    mime_type = upload_mime_type(upload) if upload is not None else "video/mp4"
+    try:
+        job_id = await run_in_threadpool(enqueue, text, upload, mime_type, form.get("risk_tier"), location)
+    except Exception:
+        release(upload)
+        raise
+    return JSONResponse({"job_id": job_id, "status": "queued", "events_url": f"/jobs/{job_id}/events"},
+                        status_code=202)
+
+
+async def job_status(request):
+    try:
+        return JSONResponse(job_record(request.path_params["job_id"]))
+    except KeyError:
+        return JSONResponse({"error": "Unknown job"}, status_code=404)
+
+
+async def job_events(request):
+    job_id = request.path_params["job_id"]
+    try:
+        get_job(job_id)
+    except KeyError:
+        return JSONResponse({"error": "Unknown job"}, status_code=404)
+    after_id = last_event_id(request.headers, request.query_params)
+
+    async def stream():
+        async for event_id, event in follow_events_async(job_id, after_id):
+            yield sse(event, event_id)
+
+    encoding = negotiate(request.headers.get("accept-encoding"))
+    return StreamingResponse(compress_frames_async(stream(), encoding), media_type="text/event-stream",
+                             headers=stream_headers(encoding))
+
+
+async def incident_stats(request):
+    return JSONResponse(INCIDENTS.stats())
+
+
+async def alert_stats(request):
+    return JSONResponse(ALERT_DISPATCHER.stats())
+
+
+async def place_cache_stats(request):
+    return JSONResponse(PLACE_CACHE.stats())
+
+
+async def result_cache_stats(request):
+    return JSONResponse(RESULT_CACHE.stats())
+
+
+async def session_stats(request):
+    return JSONResponse(session_service.stats())
+
+
+async def location_prefetch_stats(request):
+    return JSONResponse(location_prefetch.stats())
+
+
+async def router_stats(request):
+    return JSONResponse(runner.stats())
+
+
+async def places_batch(request):
+    try:
+        payload = await request.json()
+    except ValueError:
+        payload = {}
+    try:
+        incidents, radius = requested_incidents(payload)
+        return JSONResponse({"incidents": await run_in_threadpool(nearby_emergency_places_batch, incidents, radius)})
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=502)
+
+
+async def places_batch_stats(request):
+    return JSONResponse(BATCH_LOOKUP.stats())
+
+
+async def schema_stats(request):
+    return JSONResponse(SCHEMA_GUARD.stats())
+
+
+async def llm_cache_stats(request):
+    return JSONResponse(LLM_CACHE.stats())
+
+
+async def compaction_stats(request):
+    return JSONResponse(CONTEXT_COMPACTOR.stats())
+
+
+async def overpass_stats(request):
+    return JSONResponse(OVERPASS.stats())
+
+
+async def metrics(request):
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+app = Starlette(
+    routes=[
+        Route("/analyze", analyze, methods=["POST"]),
+        Route("/jobs", submit_job, methods=["POST"]),
+        Route("/jobs/{job_id}", job_status, methods=["GET"]),
+        Route("/jobs/{job_id}/events", job_events, methods=["GET"]),
+        Route("/incidents", incident_stats, methods=["GET"]),
+        Route("/alerts", alert_stats, methods=["GET"]),
+        Route("/cache/places", place_cache_stats, methods=["GET"]),
+        Route("/cache/results", result_cache_stats, methods=["GET"]),
+        Route("/cache/sessions", session_stats, methods=["GET"]),
+        Route("/prefetch/location", location_prefetch_stats, methods=["GET"]),
+        Route("/router", router_stats, methods=["GET"]),
+        Route("/places/batch", places_batch, methods=["POST"]),
+        Route("/places/batch/stats", places_batch_stats, methods=["GET"]),
+        Route("/schemas", schema_stats, methods=["GET"]),
+        Route("/cache/llm", llm_cache_stats, methods=["GET"]),
+        Route("/compaction", compaction_stats, methods=["GET"]),
+        Route("/overpass", overpass_stats, methods=["GET"]),
+        Route("/metrics", metrics, methods=["GET"]),
+    ],
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=["http://localhost:5173", "http://127.0.0.1:5173"],
+                   allow_methods=["*"], allow_headers=["*"]),
+    ],
+)
+
+if __name__ == "__main__":
+    print("Async backend running → http://localhost:5000")
+    # One dispatcher in the supervising process; uvicorn workers only enqueue
+    start_dispatcher()
+    uvicorn.run("asgi_app:app", host=os.environ.get("ALERTX_HOST", "127.0.0.1"),
+                port=int(os.environ.get("ALERTX_PORT", 5000)),
+                workers=int(os.environ.get("ALERTX_WORKERS", 1)))
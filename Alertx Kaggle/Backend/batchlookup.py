@@ -0,0 +1,153 @@
+import contextvars
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from dotenv import load_dotenv
+
+from osmindex import get_index
+from placecache import EARTH_RADIUS_KM, haversine_km
+from placequery import find_places, fetch_bbox_elements, parse_elements
+from ranking import haversine_km_batch, rank_nearest
+from tracing import span
+
+load_dotenv()
+
+# Incidents whose bounding box stays within this diagonal share one Overpass query
+CLUSTER_SPAN_KM = float(os.environ.get("ALERTX_BATCH_CLUSTER_KM", 8))
+BATCH_MAX_INCIDENTS = int(os.environ.get("ALERTX_BATCH_MAX_INCIDENTS", 500))
+BATCH_WORKERS = int(os.environ.get("ALERTX_BATCH_WORKERS", 4))
+
+_KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+class Cluster:
+    """Incidents close enough to be served by one bounding-box query."""
+
+    def __init__(self, index: int, lat: float, lon: float):
+        self.members = [index]
+        self.south = self.north = lat
+        self.west = self.east = lon
+
+    def span_with(self, lat: float, lon: float) -> float:
+        """Diagonal (km) of this cluster's box if (lat, lon) joined it."""
+        return haversine_km(min(self.south, lat), min(self.west, lon), max(self.north, lat), max(self.east, lon))
+
+    def add(self, index: int, lat: float, lon: float):
+        self.members.append(index)
+        self.south, self.north = min(self.south, lat), max(self.north, lat)
+        self.west, self.east = min(self.west, lon), max(self.east, lon)
+
+    def bbox(self, radius_m: float):
+        """``(south, west, north, east)`` covering every member's search circle."""
+        dlat = radius_m / 1000 / _KM_PER_DEGREE
+        widest = max(abs(self.south), abs(self.north)) + dlat
+        dlon = dlat / max(math.cos(math.radians(min(widest, 89.0))), 1e-6)
+        return (max(-90.0, self.south - dlat), max(-180.0, self.west - dlon),
+                min(90.0, self.north + dlat), min(180.0, self.east + dlon))
+
+
+def cluster_incidents(incidents, span_km: float = CLUSTER_SPAN_KM):
+    """Greedy leader clustering: each incident joins the first cluster it keeps within ``span_km``.
+
+    Incidents are visited south to north so neighbours tend to meet the same
+    cluster first. O(incidents * clusters), which is fine for a few hundred.
+    """
+    clusters = []
+    for i in sorted(range(len(incidents)), key=lambda i: (incidents[i]["lat"], incidents[i]["lon"])):
+        lat, lon = incidents[i]["lat"], incidents[i]["lon"]
+        for cluster in clusters:
+            if cluster.span_with(lat, lon) <= span_km:
+                cluster.add(i, lat, lon)
+                break
+        else:
+            clusters.append(Cluster(i, lat, lon))
+    return clusters
+
+
+class BatchLookup:
+    """Nearest facilities for many incidents with one upstream query per geographic cluster.
+
+    Incidents are clustered (:func:`cluster_incidents`); each cluster of two
+    or more fetches every matching element in its bounding box once, and the
+    elements are split locally per incident: kept within ``radius`` and
+    ranked nearest-k per amenity. Single incidents use :func:`find_places`
+    (and its tile cache). With an offline index every lookup is local anyway.
+    If a bbox answer was truncated by the element limit, that cluster falls
+    back to per-incident queries so no incident loses its nearest facility.
+    """
+
+    def __init__(self, workers: int = BATCH_WORKERS, span_km: float = CLUSTER_SPAN_KM):
+        self.span_km = span_km
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="alertx-batch")
+        self._lock = threading.Lock()
+        self._stats = {"batches": 0, "incidents": 0, "clusters": 0, "bbox_queries": 0,
+                       "single_queries": 0, "truncated_fallbacks": 0}
+
+    def lookup(self, incidents, radius: int, amenities, per_type: int):
+        """``[{"id", "lat", "lon", "nearby_places": [...]}, ...]`` in the order of ``incidents``."""
+        if len(incidents) > BATCH_MAX_INCIDENTS:
+            raise ValueError(f"At most {BATCH_MAX_INCIDENTS} incidents per batch")
+        results = [None] * len(incidents)
+        with span("batch.lookup", incidents=len(incidents)) as attrs:
+            if get_index() is not None:
+                clusters = [Cluster(i, p["lat"], p["lon"]) for i, p in enumerate(incidents)]
+            else:
+                clusters = cluster_incidents(incidents, self.span_km)
+            attrs["clusters"] = len(clusters)
+            futures = [
+                self._executor.submit(contextvars.copy_context().run, self._serve_cluster,
+                                      cluster, incidents, radius, amenities, per_type, results)
+                for cluster in clusters
+            ]
+            for future in futures:
+                future.result()
+        with self._lock:
+            self._stats["batches"] += 1
+            self._stats["incidents"] += len(incidents)
+            self._stats["clusters"] += len(clusters)
+        return results
+
+    def _serve_cluster(self, cluster, incidents, radius, amenities, per_type, results):
+        if len(cluster.members) > 1 and get_index() is None:
+            elements, truncated = fetch_bbox_elements(cluster.bbox(radius), amenities)
+            with self._lock:
+                self._stats["bbox_queries"] += 1
+                self._stats["truncated_fallbacks"] += truncated
+            if not truncated:
+                self._split(parse_elements(elements), cluster.members, incidents, radius, amenities, per_type, results)
+                return
+            print(f"Bounding-box answer for {len(cluster.members)} incidents was truncated; querying each")
+        for i in cluster.members:
+            incident = incidents[i]
+            places = find_places(incident["lat"], incident["lon"], radius, amenities)
+            with self._lock:
+                self._stats["single_queries"] += get_index() is None
+            results[i] = _result(incident, rank_nearest(places, incident["lat"], incident["lon"], per_type, "type"))
+
+    @staticmethod
+    def _split(places, members, incidents, radius, amenities, per_type, results):
+        wanted = set(amenities)
+        places = [p for p in places if p["type"] in wanted and p["lat"] is not None and p["lon"] is not None]
+        lats = np.fromiter((p["lat"] for p in places), dtype=np.float64, count=len(places))
+        lons = np.fromiter((p["lon"] for p in places), dtype=np.float64, count=len(places))
+        for i in members:
+            incident = incidents[i]
+            within = np.nonzero(haversine_km_batch(incident["lat"], incident["lon"], lats, lons) <= radius / 1000)[0]
+            nearby = rank_nearest([places[j] for j in within], incident["lat"], incident["lon"], per_type, "type")
+            results[i] = _result(incident, nearby)
+
+    def stats(self) -> dict:
+        with self._lock:
+            upstream = self._stats["bbox_queries"] + self._stats["single_queries"]
+            return {**self._stats, "upstream_queries": upstream,
+                    "queries_saved": self._stats["incidents"] - upstream}
+
+
+def _result(incident: dict, places: list) -> dict:
+    return {"id": incident.get("id"), "lat": incident["lat"], "lon": incident["lon"], "nearby_places": places}
+
+
+BATCH_LOOKUP = BatchLookup()
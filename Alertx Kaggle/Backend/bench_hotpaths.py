@@ -0,0 +1,235 @@
+"""Offline micro-benchmarks for the place-lookup and response-shaping hot paths.
+
+    python bench_hotpaths.py                 # run, print, compare with the baseline
+    python bench_hotpaths.py --save          # run and overwrite the baseline
+    python bench_hotpaths.py --record        # re-record fixtures from live Overpass
+    python bench_hotpaths.py --synthesize    # regenerate fixtures without network
+
+Every case runs against Overpass JSON fixtures in ``bench_fixtures/`` (small
+town, dense city centre, very large radius) with Overpass stubbed out, so the
+numbers only cover local work: parse, classify, distance-rank and serialize,
+the three lookup tools end to end, and SSE frame encoding for ``/analyze``.
+A case regresses when its median is more than ``--threshold`` (default 25%)
+slower than in ``bench_baseline.json``; the exit status is then 1.
+"""
+import argparse
+import gzip
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+
+import placequery
+from analysis import sse
+from placequery import AMENITY_CATEGORY, CATEGORY_MAP, compile_query, parse_elements
+from ranking import rank_nearest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_DIR = os.path.join(HERE, "bench_fixtures")
+BASELINE_PATH = os.path.join(HERE, "bench_baseline.json")
+
+# name -> (lat, lon, radius m, synthetic element count)
+FIXTURES = {
+    "small": (12.8936556, 77.7108574, 1500, 60),
+    "dense_city": (12.9716, 77.5946, 5000, 3000),
+    "large_radius": (19.0760, 72.8777, 25000, 15000),
+}
+ALL_AMENITIES = sorted({a for items in CATEGORY_MAP.values() for a in items} | {"fuel", "parking"})
+
+
+# ==================== FIXTURES ====================
+def _fixture_path(name):
+    return os.path.join(FIXTURE_DIR, f"{name}.json.gz")
+
+
+def load_fixture(name):
+    with gzip.open(_fixture_path(name), "rt", encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def _save_fixture(name, data):
+    os.makedirs(FIXTURE_DIR, exist_ok=True)
+    with gzip.open(_fixture_path(name), "wt", encoding="utf-8") as fh:
+        json.dump(data, fh, separators=(",", ":"))
+
+
+def record_fixtures():
+    """Capture real responses for every fixture point (needs network)."""
+    for name, (lat, lon, radius, _) in FIXTURES.items():
+        elements = placequery.fetch_elements(lat, lon, radius, ALL_AMENITIES)
+        _save_fixture(name, {"elements": elements})
+        print(f"recorded {name}: {len(elements)} elements")
+
+
+def synthesize_fixtures(seed=7):
+    """Overpass-shaped responses with a realistic tag mix, for machines without network."""
+    rng = random.Random(seed)
+    for name, (lat, lon, radius, count) in FIXTURES.items():
+        spread = radius / 111_000
+        elements = []
+        for i in range(count):
+            amenity = rng.choice(ALL_AMENITIES)
+            tags = {"amenity": amenity}
+            if rng.random() < 0.85:
+                tags["name"] = f"{amenity.replace('_', ' ').title()} {i}"
+            if rng.random() < 0.6:
+                tags.update({"addr:housenumber": str(rng.randint(1, 400)), "addr:street": f"{rng.randint(1, 90)}th Cross",
+                             "addr:city": "Bengaluru", "addr:postcode": f"560{rng.randint(0, 999):03d}"})
+            for key in ("opening_hours", "phone", "website", "operator", "wheelchair"):
+                if rng.random() < 0.3:
+                    tags[key] = f"{key}-{i}"
+            point = {"lat": round(lat + rng.uniform(-spread, spread), 7),
+                     "lon": round(lon + rng.uniform(-spread, spread), 7)}
+            kind = rng.choices(["node", "way", "relation"], [70, 27, 3])[0]
+            element = {"type": kind, "id": 1_000_000 + i, "tags": tags}
+            if kind == "node":
+                element.update(point)
+            else:
+                element["center"] = point
+            elements.append(element)
+        _save_fixture(name, {"elements": elements})
+        print(f"synthesized {name}: {len(elements)} elements")
+
+
+# ==================== CASES ====================
+def _stub_overpass(elements):
+    """Serve ``elements`` to find_places, filtered to the requested amenities like Overpass would."""
+    by_amenities = {}
+
+    def nearby_elements(lat, lon, radius, amenities, fetch):
+        key = tuple(sorted(amenities))
+        if key not in by_amenities:
+            wanted = set(key)
+            by_amenities[key] = [el for el in elements if el.get("tags", {}).get("amenity") in wanted]
+        return by_amenities[key]
+
+    placequery.nearby_elements = nearby_elements
+
+
+def _cases(lat, lon, radius, elements):
+    from agents import get_nearby_places
+    from app import nearby_emergency_places
+    from nearlocation import get_nearby_places_grouped
+
+    _stub_overpass(elements)
+    places = parse_elements(elements)
+    flat = [{"name": p["name"] or "Unnamed", "type": p["type"], "lat": p["lat"], "lon": p["lon"]} for p in places]
+    emergency = nearby_emergency_places(lat, lon, radius)
+    events = [
+        {"type": "log", "message": "🔧 LocationAgent → get_nearby_emergency_places"},
+        {"type": "text", "content": json.dumps(emergency), "agent": "LocationAgent"},
+        {"type": "state", "agent": "Location", "data": json.dumps(emergency)},
+        {"type": "final", "report": "Severe flood near the junction. " * 20},
+    ]
+
+    def classify():
+        grouped = {category: [] for category in CATEGORY_MAP}
+        for p in places:
+            category = AMENITY_CATEGORY.get(p["type"])
+            if category:
+                grouped[category].append(p)
+        return grouped
+
+    return {
+        "compile_query": lambda: compile_query(lat, lon, radius, ALL_AMENITIES),
+        "parse": lambda: parse_elements(elements),
+        "classify": classify,
+        "rank_top50": lambda: rank_nearest(flat, lat, lon, 50),
+        "rank_per_type3": lambda: rank_nearest(flat, lat, lon, 3, group_key="type"),
+        "serialize_places": lambda: json.dumps(places),
+        "get_nearby_emergency_places": lambda: json.dumps(nearby_emergency_places(lat, lon, radius)),
+        "get_nearby_places": lambda: json.dumps(get_nearby_places(lat, lon, radius)),
+        "get_nearby_places_grouped": lambda: json.dumps(get_nearby_places_grouped(lat, lon, radius)),
+        "sse_encode": lambda: [sse(event) for event in events],
+    }
+
+
+def _measure(fn, min_time, min_repeat):
+    fn()  # warm-up
+    samples = []
+    deadline = time.perf_counter() + min_time
+    while len(samples) < min_repeat or time.perf_counter() < deadline:
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "median_ms": round(statistics.median(samples), 4),
+        "p95_ms": round(samples[min(len(samples) - 1, int(0.95 * len(samples)))], 4),
+        "runs": len(samples),
+    }
+
+
+def run(selected, min_time, min_repeat):
+    results = {}
+    for name in selected:
+        lat, lon, radius, _ = FIXTURES[name]
+        elements = load_fixture(name)["elements"]
+        for case, fn in _cases(lat, lon, radius, elements).items():
+            stats = _measure(fn, min_time, min_repeat)
+            stats["elements"] = len(elements)
+            stats["elements_per_s"] = round(len(elements) / (stats["median_ms"] / 1000)) if stats["median_ms"] else None
+            results[f"{name}/{case}"] = stats
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print a table against ``baseline``; return the keys that regressed."""
+    regressed = []
+    print(f"{'case':<46}{'median ms':>11}{'p95 ms':>10}{'baseline':>10}{'change':>9}")
+    for key, stats in results.items():
+        base = baseline.get(key, {}).get("median_ms")
+        change = ""
+        if base:
+            ratio = stats["median_ms"] / base - 1
+            change = f"{ratio:+.0%}"
+            if ratio > threshold:
+                regressed.append(key)
+                change += " !"
+        print(f"{key:<46}{stats['median_ms']:>11.3f}{stats['p95_ms']:>10.3f}"
+              f"{(f'{base:.3f}' if base else '-'):>10}{change:>9}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("fixtures", nargs="*", help=f"subset of {', '.join(FIXTURES)}")
+    parser.add_argument("--save", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed median slowdown (0.25 = 25%%)")
+    parser.add_argument("--min-time", type=float, default=0.5, help="seconds to spend per case")
+    parser.add_argument("--min-repeat", type=int, default=20)
+    parser.add_argument("--record", action="store_true", help="re-record fixtures from live Overpass")
+    parser.add_argument("--synthesize", action="store_true", help="regenerate synthetic fixtures")
+    args = parser.parse_args()
+    unknown = set(args.fixtures) - set(FIXTURES)
+    if unknown:
+        parser.error(f"unknown fixture(s): {', '.join(sorted(unknown))}")
+
+    if args.record or args.synthesize:
+        record_fixtures() if args.record else synthesize_fixtures()
+        return 0
+
+    results = run(args.fixtures or list(FIXTURES), args.min_time, args.min_repeat)
+    baseline = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH, encoding="utf-8") as fh:
+            baseline = json.load(fh)["results"]
+    regressed = compare(results, baseline, args.threshold)
+
+    if args.save:
+        with open(BASELINE_PATH, "w", encoding="utf-8") as fh:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(),
+                       "saved_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": results}, fh, indent=2)
+        print(f"Baseline written to {BASELINE_PATH}")
+        return 0
+    if regressed:
+        print(f"{len(regressed)} case(s) regressed by more than {args.threshold:.0%}: {', '.join(regressed)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
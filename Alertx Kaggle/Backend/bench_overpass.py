@@ -0,0 +1,64 @@
+"""Tail latency of the Overpass client against local stand-in mirrors.
+
+    python bench_overpass.py [--requests 200] [--concurrency 8]
+
+Starts three stand-ins (a fast one with a heavy tail, a steady one and a
+failing one) and runs the same load with hedging off and on, printing
+p50/p95/p99 and the client's hedge / retry / breaker counters.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from overpass import OverpassClient
+from overpass_standin import start_standin
+
+
+def _pct(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+
+
+async def _load(client, requests, concurrency):
+    latencies, failures = [], 0
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one():
+        nonlocal failures
+        async with sem:
+            start = time.perf_counter()
+            try:
+                await client.query_async('[out:json];node(1);out;')
+                latencies.append(time.perf_counter() - start)
+            except Exception:
+                failures += 1
+
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return latencies, failures
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    mirrors = [
+        start_standin(latency_ms=40, slow_rate=0.08, slow_ms=1500)[1],
+        start_standin(latency_ms=90)[1],
+        start_standin(latency_ms=40, fail_rate=0.9)[1],
+    ]
+    print(f"{'mode':<10}{'ok':>6}{'failed':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}  client")
+    for mode, hedge in (("no hedge", 1e9), ("hedged", 0.9)):
+        client = OverpassClient(mirrors, hedge_percentile=min(hedge, 0.99), hedge_min_delay=0.15 if hedge < 1 else 1e9)
+        latencies, failures = asyncio.run(_load(client, args.requests, args.concurrency))
+        stats = client.stats()
+        print(f"{mode:<10}{len(latencies):>6}{failures:>8}{statistics.median(latencies) * 1000:>9.0f}"
+              f"{_pct(latencies, 0.95):>9.0f}{_pct(latencies, 0.99):>9.0f}  "
+              f"hedges={stats['hedges']} wins={stats['hedge_wins']} retries={stats['retries']} "
+              f"breakers={[m['state'] for m in stats['mirrors']]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Compare today's hand-built Overpass queries with the compiled placequery ones.
+
+    python bench_placequery.py [lat,lon ...] [--radius 5000] [--repeat 20]
+
+For every point both queries are sent to Overpass once; the script reports
+response bytes, round-trip time and the local parse + classify time (median
+of --repeat runs) for the legacy nested-loop parser and placequery.
+"""
+import argparse
+import statistics
+import time
+
+import requests
+
+from placequery import CATEGORY_MAP, OVERPASS_URL, compile_query, parse_elements
+
+DEFAULT_POINTS = ["12.8936556,77.7108574", "12.9716,77.5946", "19.0760,72.8777"]
+
+
+def legacy_query(lat, lon, radius, amenities):
+    amenity_regex = "|".join(amenities)
+    return f"""
+    [out:json][timeout:15];
+    (
+      node["amenity"~"{amenity_regex}"](around:{radius},{lat},{lon});
+      way["amenity"~"{amenity_regex}"](around:{radius},{lat},{lon});
+      relation["amenity"~"{amenity_regex}"](around:{radius},{lat},{lon});
+    );
+    out center;
+    """
+
+
+def legacy_parse(data):
+    grouped = {category: [] for category in CATEGORY_MAP.keys()}
+    for el in data.get("elements", []):
+        tags = el.get("tags", {})
+        amenity = tags.get("amenity")
+        category = None
+        for cat_name, items in CATEGORY_MAP.items():
+            if amenity in items:
+                category = cat_name
+                break
+        if not category:
+            continue
+        grouped[category].append({
+            "name": tags.get("name", "Unnamed"),
+            "type": amenity,
+            "lat": el.get("lat") or el.get("center", {}).get("lat"),
+            "lon": el.get("lon") or el.get("center", {}).get("lon"),
+            "raw_tags": tags,
+        })
+    return grouped
+
+
+def engine_parse(data):
+    grouped = {category: [] for category in CATEGORY_MAP.keys()}
+    for p in parse_elements(data.get("elements", [])):
+        if p["category"]:
+            grouped[p["category"]].append(p)
+    return grouped
+
+
+def _median_ms(fn, arg, repeat):
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(arg)
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples)
+
+
+def _run(query):
+    t0 = time.perf_counter()
+    r = requests.post(OVERPASS_URL, data={"data": query}, timeout=60)
+    elapsed = (time.perf_counter() - t0) * 1000
+    r.raise_for_status()
+    return len(r.content), elapsed, r.json()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("points", nargs="*", default=DEFAULT_POINTS)
+    parser.add_argument("--radius", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    amenities = [a for items in CATEGORY_MAP.values() for a in items]
+    print(f"{'point':<24}{'variant':<10}{'elements':>10}{'bytes':>12}{'rtt ms':>10}{'parse ms':>10}")
+    for point in args.points:
+        lat, lon = (float(v) for v in point.split(","))
+        for variant, query, parse in (
+            ("legacy", legacy_query(lat, lon, args.radius, amenities), legacy_parse),
+            ("compiled", compile_query(lat, lon, args.radius, amenities), engine_parse),
+        ):
+            size, rtt, data = _run(query)
+            parse_ms = _median_ms(parse, data, args.repeat)
+            print(f"{point:<24}{variant:<10}{len(data.get('elements', [])):>10}{size:>12}{rtt:>10.0f}{parse_ms:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+from google.adk.agents import LlmAgent
+
+MODEL_CALLBACKS = ("before_model_callback", "after_model_callback", "before_tool_callback", "after_tool_callback")
+
+
+def walk_agents(agent):
+    """``agent`` and every sub-agent below it, depth first."""
+    yield agent
+    for sub_agent in agent.sub_agents:
+        yield from walk_agents(sub_agent)
+
+
+def add_callback(agent, field: str, callback, first: bool = False):
+    """Chain ``callback`` onto ``agent.<field>`` without dropping existing callbacks.
+
+    ADK accepts a single callable or a list; lists run in order until one
+    returns a value, so observers should return None and overriding
+    callbacks (caches) go ``first``.
+    """
+    if field in MODEL_CALLBACKS and not isinstance(agent, LlmAgent):
+        return
+    current = getattr(agent, field)
+    callbacks = list(current) if isinstance(current, list) else ([current] if current else [])
+    if callback in callbacks:
+        return
+    if first:
+        callbacks.insert(0, callback)
+    else:
+        callbacks.append(callback)
+    setattr(agent, field, callbacks)
@@ -0,0 +1,255 @@
+import json
+import os
+import re
+import threading
+
+from dotenv import load_dotenv
+from google.genai.types import Content, Part
+
+from schemas import SchemaError, parse_json_text
+from tracing import annotate, count
+
+load_dotenv()
+
+
+def _budgets(spec: str) -> dict:
+    budgets = {}
+    for item in spec.split(","):
+        name, _, tokens = item.partition("=")
+        if name.strip() and tokens.strip():
+            budgets[name.strip()] = int(tokens)
+    return budgets
+
+
+# Token budget for the pipeline context each agent receives ("Agent=tokens,...")
+CONTEXT_BUDGETS = _budgets(os.environ.get("ALERTX_CONTEXT_BUDGETS", "FinalReporter=1200,TwillioAgent=400"))
+# State keys each agent works from; everything else in its history is dropped
+CONTEXT_KEYS = {
+    "FinalReporter": ("video_analysis", "location_data"),
+    "TwillioAgent": ("final_report",),
+}
+# "gemini" counts with google-genai's local SentencePiece tokenizer (needs `sentencepiece`
+# and downloads the model once); anything else uses the character estimate
+TOKENIZER = os.environ.get("ALERTX_TOKENIZER", "estimate")
+MEDIA_PART_TOKENS = 258  # Gemini's per-image cost; keyframes and file parts count as one image each
+
+PLACE_FIELDS = ("name", "type", "distance_km")
+# (places kept, list items kept, characters per string), loosest first
+LEVELS = ((10, 8, 400), (6, 5, 240), (4, 3, 160), (3, 2, 100), (2, 1, 60), (1, 1, 40))
+
+_CJK = re.compile(r"[぀-ヿ㐀-鿿가-힯]")
+
+
+# ==================== TOKEN COUNTING ====================
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+
+
+def _local_tokenizer():
+    global _tokenizer, TOKENIZER
+    with _tokenizer_lock:
+        if _tokenizer is None:
+            try:
+                from google.genai.local_tokenizer import LocalTokenizer
+
+                _tokenizer = LocalTokenizer(os.environ.get("ALERTX_TOKENIZER_MODEL", "gemini-1.5-pro"))
+            except Exception as e:  # missing sentencepiece, unknown model, no network
+                print(f"Local tokenizer unavailable ({e}); estimating tokens instead")
+                TOKENIZER = "estimate"
+        return _tokenizer
+
+
+def count_tokens(text: str) -> int:
+    """Tokens in ``text``: ~4 characters per token, one per CJK character (or the local Gemini tokenizer)."""
+    if not text:
+        return 0
+    if TOKENIZER == "gemini" and _local_tokenizer() is not None:
+        return _tokenizer.count_tokens(text).total_tokens
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def request_tokens(llm_request) -> int:
+    """Estimated prompt tokens of an LlmRequest: system instruction, text and media parts."""
+    tokens = count_tokens(_system_text(llm_request))
+    for content in llm_request.contents or []:
+        for part in content.parts or []:
+            if part.text:
+                tokens += count_tokens(part.text)
+            elif part.inline_data or part.file_data:
+                tokens += MEDIA_PART_TOKENS
+            elif part.function_call:
+                tokens += count_tokens(json.dumps(part.function_call.args or {}, default=str))
+            elif part.function_response:
+                tokens += count_tokens(json.dumps(part.function_response.response or {}, default=str))
+    return tokens
+
+
+def _system_text(llm_request) -> str:
+    instruction = llm_request.config.system_instruction if llm_request.config else None
+    if isinstance(instruction, str):
+        return instruction
+    if instruction is not None and getattr(instruction, "parts", None):
+        return "".join(p.text or "" for p in instruction.parts)
+    return ""
+
+
+# ==================== COMPACTION ====================
+def _truncate(text: str, chars: int) -> str:
+    text = " ".join(text.split())
+    if len(text) <= chars:
+        return text
+    cut = text.rfind(" ", 0, chars)
+    return text[:cut if cut > chars // 2 else chars].rstrip(",;:") + "…"
+
+
+def _nearest_places(places: list, k: int) -> list:
+    """The k nearest places, nearest of each type first, with only :data:`PLACE_FIELDS`."""
+    def distance(p):
+        d = p.get("distance_km")
+        return d if isinstance(d, (int, float)) else float("inf")
+
+    ranked = sorted((p for p in places if isinstance(p, dict)), key=distance)
+    seen = {}
+    order = []
+    for position, place in enumerate(ranked):
+        rank = seen[place.get("type")] = seen.get(place.get("type"), -1) + 1
+        order.append((rank, position, place))
+    order.sort(key=lambda item: (item[0], item[1]))  # 1st of every type, then 2nd, ...
+    kept = sorted((item for item in order[:k]), key=lambda item: item[1])
+    return [{f: place[f] for f in PLACE_FIELDS if place.get(f) not in (None, "")} for _, _, place in kept]
+
+
+def _compact(value, level):
+    places_k, items_k, chars = level
+    if isinstance(value, dict):
+        out = {}
+        for key, item in value.items():
+            if key == "nearby_places" and isinstance(item, list):
+                out[key] = _nearest_places(item, places_k)
+                if len(item) > places_k:
+                    out["nearby_places_omitted"] = len(item) - places_k
+            elif key in ("tags", "raw_tags", "address"):
+                continue  # never read by the downstream prompts
+            elif item not in (None, "", [], {}):
+                out[key] = _compact(item, level)
+        return out
+    if isinstance(value, list):
+        kept = [_compact(item, level) for item in value[:items_k]]
+        if len(value) > items_k:
+            kept.append(f"(+{len(value) - items_k} more)")
+        return kept
+    if isinstance(value, str):
+        return _truncate(value, chars)
+    if isinstance(value, float):
+        return round(value, 2)
+    return value
+
+
+def _compact_text(text: str, budget: int) -> str:
+    """Plain / markdown text: blank lines and repeated spaces go, then whole lines until the budget."""
+    lines = [" ".join(line.split()) for line in text.splitlines()]
+    kept, used = [], 0
+    for line in (line for line in lines if line):
+        tokens = count_tokens(line) + 1
+        if used + tokens > budget:
+            room = (budget - used) * 4
+            kept.append(_truncate(line, room) if room > 40 else "…")
+            break
+        kept.append(line)
+        used += tokens
+    return "\n".join(kept)
+
+
+def compact_value(text: str, budget: int) -> str:
+    """Deterministically shrink one state value (JSON or text) to about ``budget`` tokens."""
+    if count_tokens(text) <= budget:
+        return text
+    try:
+        data = parse_json_text(text, [])
+    except SchemaError:
+        return _compact_text(text, budget)
+    compact = text
+    for level in LEVELS:
+        compact = json.dumps(_compact(data, level), ensure_ascii=False, separators=(",", ":"))
+        if count_tokens(compact) <= budget:
+            return compact
+    return compact  # tightest level; still far smaller than the input
+
+
+# ==================== ADK CALLBACK ====================
+class ContextCompactor:
+    """Gives downstream agents a compacted pipeline context within a token budget.
+
+    Installed as a before_model callback on the agents in ``budgets``. The
+    request history (the user's video, sibling agents' tool traffic, ...) is
+    replaced by the user's text plus the agent's :data:`CONTEXT_KEYS` from
+    state, each compacted by :func:`compact_value`. State values already
+    interpolated into the system instruction are compacted in place there
+    instead of being repeated. Tokens before and after are counted per agent.
+    """
+
+    def __init__(self, budgets: dict = None, context_keys: dict = None):
+        self.budgets = CONTEXT_BUDGETS if budgets is None else budgets
+        self.context_keys = CONTEXT_KEYS if context_keys is None else context_keys
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def install(self, root_agent):
+        from callbacks import add_callback, walk_agents
+
+        for agent in walk_agents(root_agent):
+            if agent.name in self.budgets:
+                # first: timing, caching and schema callbacks then see the compacted request
+                add_callback(agent, "before_model_callback", self.before_model, first=True)
+        return root_agent
+
+    def before_model(self, callback_context, llm_request):
+        name = callback_context.agent_name
+        keys = self.context_keys.get(name, ())
+        before = request_tokens(llm_request)
+        values = {key: callback_context.state.get(key) for key in keys}
+        values = {key: value if isinstance(value, str) else json.dumps(value) for key, value in values.items()
+                  if value not in (None, "")}
+        budget = self.budgets[name] // max(1, len(values))
+
+        system = _system_text(llm_request)
+        sections = []
+        for key, value in values.items():
+            compact = compact_value(value, budget)
+            if value in system:
+                system = system.replace(value, compact)
+            else:
+                sections.append(f"{key}:\n{compact}")
+        if system and llm_request.config is not None:
+            llm_request.config.system_instruction = system
+
+        # Only the request text (the first part): the keyframe header and [t=..s]
+        # markers describe images this request no longer carries
+        user_text = ""
+        if callback_context.user_content and callback_context.user_content.parts:
+            user_text = callback_context.user_content.parts[0].text or ""
+        prompt = "\n\n".join(([f"Request: {user_text}"] if user_text else []) + sections) or "Proceed."
+        llm_request.contents = [Content(role="user", parts=[Part(text=prompt)])]
+
+        after = request_tokens(llm_request)
+        with self._lock:
+            stats = self._stats.setdefault(name, {"requests": 0, "tokens_before": 0, "tokens_after": 0})
+            stats["requests"] += 1
+            stats["tokens_before"] += before
+            stats["tokens_after"] += after
+        count("alertx_context_tokens_total", before, agent=name, stage="before")
+        count("alertx_context_tokens_total", after, agent=name, stage="after")
+        annotate(callback_context.invocation_id, f"compaction.{name}", tokens_before=before, tokens_after=after)
+        return None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                name: {**s, "saved_pct": round(100 * (1 - s["tokens_after"] / s["tokens_before"]), 1)
+                       if s["tokens_before"] else 0.0}
+                for name, s in self._stats.items()
+            }
+
+
+CONTEXT_COMPACTOR = ContextCompactor()
@@ -0,0 +1,96 @@
+import os
+import zlib
+from contextlib import aclosing, closing
+
+from dotenv import load_dotenv
+
+try:  # optional: `pip install brotli`; gzip is used without it
+    import brotli
+except ImportError:
+    brotli = None
+
+load_dotenv()
+
+SSE_COMPRESSION = os.environ.get("ALERTX_SSE_COMPRESSION", "1") == "1"
+GZIP_LEVEL = int(os.environ.get("ALERTX_GZIP_LEVEL", 6))
+BROTLI_QUALITY = int(os.environ.get("ALERTX_BROTLI_QUALITY", 5))
+
+
+def negotiate(accept_encoding: str):
+    """``"br"``, ``"gzip"`` or None for an ``Accept-Encoding`` header (q=0 excludes a coding)."""
+    if not SSE_COMPRESSION or not accept_encoding:
+        return None
+    accepted = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding.strip().lower()] = q
+    for coding in (("br",) if brotli is not None else ()) + ("gzip",):
+        if accepted.get(coding, accepted.get("*", 0.0)) > 0:
+            return coding
+    return None
+
+
+class StreamCompressor:
+    """Compresses an event stream frame by frame, flushing after each one.
+
+    The flush ends each frame on a byte boundary the client can decode, so
+    events are not held back waiting for more input, while the dictionary is
+    still shared across frames (repeated keys and agent names compress well).
+    """
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._zlib = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # 31: gzip container
+
+    def compress(self, frame: str) -> bytes:
+        data = frame.encode("utf-8")
+        if self.encoding == "br":
+            return self._brotli.process(data) + self._brotli.flush()
+        return self._zlib.compress(data) + self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._brotli.finish()
+        return self._zlib.flush(zlib.Z_FINISH)
+
+
+def stream_headers(encoding: str) -> dict:
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "Vary": "Accept-Encoding"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return headers
+
+
+def compress_frames(frames, encoding: str):
+    """Compressed chunks of an iterable of SSE frames (the frames as-is without ``encoding``)."""
+    if not encoding:
+        yield from frames
+        return
+    compressor = StreamCompressor(encoding)
+    with closing(frames):  # client gone: close the event source right away
+        for frame in frames:
+            yield compressor.compress(frame)
+    yield compressor.finish()
+
+
+async def compress_frames_async(frames, encoding: str):
+    """:func:`compress_frames` for an async iterable of frames."""
+    if not encoding:
+        async with aclosing(frames):
+            async for frame in frames:
+                yield frame
+        return
+    compressor = StreamCompressor(encoding)
+    async with aclosing(frames):
+        async for frame in frames:
+            yield compressor.compress(frame)
+    yield compressor.finish()
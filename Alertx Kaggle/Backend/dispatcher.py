@@ -0,0 +1,455 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import sys
+import threading
+import time
+from xml.sax.saxutils import escape
+
+import httpx
+from dotenv import load_dotenv
+
+from jobs import JOBS_DIR
+from schemas import SchemaError, parse_json_text
+from tracing import count, observe
+
+load_dotenv()
+
+TWILIO_API = os.environ.get("ALERTX_TWILIO_API", "https://api.twilio.com").rstrip("/")
+TWILIO_ACCOUNT_SID = os.environ.get("TWILIO_ACCOUNT_SID", "")
+TWILIO_AUTH_TOKEN = os.environ.get("TWILIO_AUTH_TOKEN", "")
+TWILIO_FROM_NUMBER = os.environ.get("TWILIO_FROM_NUMBER", "")
+# Who gets called, by the video analysis "department" ("Department=+number,...", "*" for everything else)
+ALERT_ROUTES = os.environ.get("ALERTX_ALERT_ROUTES", "")
+# Alert levels that place a call at all
+ALERT_LEVELS = [l.strip().upper() for l in os.environ.get("ALERTX_ALERT_LEVELS", "RED,ORANGE").split(",") if l.strip()]
+# Durable outbound queue; the leading dot keeps job workers from treating it as a job
+DISPATCH_DB = os.environ.get("ALERTX_DISPATCH_DB", os.path.join(JOBS_DIR, ".alerts.db"))
+# At most N calls per destination per S seconds ("N/S")
+DISPATCH_RATE = os.environ.get("ALERTX_DISPATCH_RATE", "3/300")
+# The same incident is called in at most once per destination within this window
+DISPATCH_DEDUPE_S = float(os.environ.get("ALERTX_DISPATCH_DEDUPE_S", 900))
+DISPATCH_BATCH = int(os.environ.get("ALERTX_DISPATCH_BATCH", 10))
+DISPATCH_MAX_ATTEMPTS = int(os.environ.get("ALERTX_DISPATCH_MAX_ATTEMPTS", 5))
+DISPATCH_BACKOFF_S = float(os.environ.get("ALERTX_DISPATCH_BACKOFF_S", 2))
+DISPATCH_BACKOFF_MAX_S = float(os.environ.get("ALERTX_DISPATCH_BACKOFF_MAX_S", 120))
+# A claimed call not reported back within this long (crashed dispatcher) is claimed again
+DISPATCH_LEASE_S = float(os.environ.get("ALERTX_DISPATCH_LEASE_S", 60))
+POLL_SECONDS = 1.0
+
+LEVEL_PRIORITY = {"RED": 0, "ORANGE": 1, "YELLOW": 2, "GREEN": 3}
+# Fallback when the report has no alert_level (agents.py's markdown FinalReporter)
+RISK_LEVELS = {"severe": "RED", "high": "ORANGE", "medium": "YELLOW", "low": "GREEN"}
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+MAX_MESSAGE_CHARS = 400
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS alerts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    dedupe_key TEXT NOT NULL,
+    destination TEXT NOT NULL,
+    level TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    message TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    lease_until REAL,
+    created_at REAL NOT NULL,
+    sent_at REAL,
+    call_sid TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS alerts_due ON alerts (status, priority, next_attempt_at);
+CREATE INDEX IF NOT EXISTS alerts_destination ON alerts (destination, status, sent_at);
+CREATE INDEX IF NOT EXISTS alerts_dedupe ON alerts (dedupe_key, destination, created_at);
+"""
+
+
+def _routes(spec: str) -> dict:
+    routes = {}
+    for item in spec.split(","):
+        department, _, number = item.partition("=")
+        if department.strip() and number.strip():
+            routes[department.strip().lower()] = number.strip()
+    return routes
+
+
+def _rate(spec: str):
+    calls, _, seconds = spec.partition("/")
+    return int(calls), float(seconds or 60)
+
+
+def _state_json(value):
+    if isinstance(value, str):
+        try:
+            return parse_json_text(value, [])
+        except SchemaError:
+            return None
+    return value if isinstance(value, dict) else None
+
+
+class TwilioError(RuntimeError):
+    def __init__(self, message: str, retryable: bool, retry_after: float = None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+# ==================== QUEUE ====================
+class AlertDispatcher:
+    """Durable, prioritised outbound call queue in front of Twilio.
+
+    The pipeline only :meth:`enqueue`\\ s (one row per destination in a
+    SQLite file shared by every process on the host) and moves on; a
+    dispatcher loop (:func:`start_dispatcher` or ``python dispatcher.py``)
+    claims due calls in batches, RED before ORANGE, oldest first, and places
+    them concurrently over one pooled HTTP client.
+
+    * dedupe: a destination gets at most one call per ``dedupe_key``
+      (incident) within ``dedupe_s``;
+    * rate limit: at most ``rate`` calls per destination per window, counted
+      from the queue itself so several dispatchers share it; calls over the
+      limit stay queued while other destinations' calls go ahead;
+    * retry: 429 / 5xx / network errors come back after exponential backoff
+      with jitter (or the server's ``Retry-After``) up to ``max_attempts``;
+      other 4xx answers fail the call at once;
+    * claims carry a lease, so calls held by a crashed dispatcher are retried.
+    """
+
+    def __init__(self, db_path: str = DISPATCH_DB, routes: dict = None, levels=ALERT_LEVELS,
+                 rate: str = DISPATCH_RATE, dedupe_s: float = DISPATCH_DEDUPE_S, batch: int = DISPATCH_BATCH,
+                 max_attempts: int = DISPATCH_MAX_ATTEMPTS, api: str = TWILIO_API, account_sid: str = TWILIO_ACCOUNT_SID,
+                 auth_token: str = TWILIO_AUTH_TOKEN, from_number: str = TWILIO_FROM_NUMBER):
+        self.db_path = db_path
+        self.routes = _routes(ALERT_ROUTES) if routes is None else routes
+        self.levels = set(levels)
+        self.rate_calls, self.rate_window = _rate(rate)
+        self.dedupe_s = dedupe_s
+        self.batch = batch
+        self.max_attempts = max_attempts
+        self.api = api.rstrip("/")
+        self.account_sid = account_sid
+        self.auth_token = auth_token
+        self.from_number = from_number
+        self._ready = False
+        self._loop = None  # the serving loop and its wake-up event, while serving
+        self._wake = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._stats = {"enqueued": 0, "duplicates": 0, "skipped_level": 0, "unrouted": 0, "sent": 0,
+                       "retried": 0, "failed": 0, "rate_limit_deferrals": 0, "batches": 0}
+
+    def _connect(self):
+        if not self._ready:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            with sqlite3.connect(self.db_path, timeout=10) as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(_SCHEMA)
+            self._ready = True
+        return sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+
+    def _transaction(self, work):
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            result = work(conn)
+            conn.execute("COMMIT")
+            return result
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def destinations(self, department: str = None) -> list:
+        number = self.routes.get((department or "").strip().lower()) or self.routes.get("*")
+        return [number] if number else []
+
+    def enqueue(self, level: str, message: str, destinations, dedupe_key: str) -> list:
+        """Queue one call per destination; returns ``[{"id", "destination", "status"}]`` right away.
+
+        ``status`` is "queued", or "duplicate" when the destination already
+        has a call for ``dedupe_key`` within the dedupe window.
+        """
+        level = (level or "").upper()
+        if level not in LEVEL_PRIORITY:
+            raise ValueError(f"Unknown alert level {level!r}")
+        message = " ".join(message.split())[:MAX_MESSAGE_CHARS]
+        now = time.time()
+
+        def insert(conn):
+            queued = []
+            for destination in destinations:
+                duplicate = conn.execute(
+                    "SELECT id FROM alerts WHERE dedupe_key = ? AND destination = ? AND created_at >= ? "
+                    "AND status != 'failed' LIMIT 1", (dedupe_key, destination, now - self.dedupe_s)).fetchone()
+                if duplicate:
+                    queued.append({"id": duplicate[0], "destination": destination, "status": "duplicate"})
+                    continue
+                row = conn.execute(
+                    "INSERT INTO alerts (dedupe_key, destination, level, priority, message, status, next_attempt_at, "
+                    "created_at) VALUES (?, ?, ?, ?, ?, 'queued', ?, ?)",
+                    (dedupe_key, destination, level, LEVEL_PRIORITY[level], message, now, now))
+                queued.append({"id": row.lastrowid, "destination": destination, "status": "queued"})
+            return queued
+
+        queued = self._transaction(insert)
+        with self._lock:
+            for item in queued:
+                self._stats["enqueued" if item["status"] == "queued" else "duplicates"] += 1
+        for item in queued:
+            count("alertx_alerts_total", level=level, outcome=item["status"])
+        self._notify()
+        return queued
+
+    def _notify(self):
+        loop, wake = self._loop, self._wake
+        if loop is not None and wake is not None:
+            try:
+                loop.call_soon_threadsafe(wake.set)
+            except RuntimeError:  # loop already closed
+                pass
+
+    # ---------- pipeline hook ----------
+    def install(self, agent, message_key: str = None):
+        """Enqueue the incident's alert when ``agent`` finishes (an after_agent callback).
+
+        The spoken message is state ``message_key`` when set (TwillioAgent's
+        output), else built from the final report's summary. The outcome is
+        written to state as ``alert_dispatch``, which clients get as a
+        ``state`` event.
+        """
+        from callbacks import add_callback
+
+        def after_agent(callback_context):
+            self.after_agent(callback_context, message_key)
+
+        add_callback(agent, "after_agent_callback", after_agent)
+        return agent
+
+    def after_agent(self, callback_context, message_key: str = None):
+        state = callback_context.state
+        report = _state_json(state.get("final_report")) or {}
+        analysis = _state_json(state.get("video_analysis")) or {}
+        level = str(report.get("alert_level") or RISK_LEVELS.get(str(analysis.get("risk_level", "")).lower(), "")).upper()
+        if level not in self.levels:
+            with self._lock:
+                self._stats["skipped_level"] += 1
+            state["alert_dispatch"] = {"status": "not_required", "alert_level": level or None}
+            return None
+        destinations = self.destinations(analysis.get("department"))
+        if not destinations:
+            with self._lock:
+                self._stats["unrouted"] += 1
+            print(f"No alert destination for department {analysis.get('department')!r}; set ALERTX_ALERT_ROUTES")
+            state["alert_dispatch"] = {"status": "unrouted", "alert_level": level}
+            return None
+
+        message = state.get(message_key) if message_key else None
+        if not isinstance(message, str) or not message.strip():
+            summary = report.get("summary") or analysis.get("scene_description") or "an incident needs attention"
+            message = f"AlertX {level} alert. {analysis.get('event_type') or 'Incident'}: {summary}"
+        location = _state_json(state.get("user_location")) or (_state_json(state.get("location_data")) or {}).get(
+            "user_location") or {}
+        try:
+            # ~1 km cell: reports of the same event from nearby phones share one call
+            place = f"{round(float(location['lat']), 2)},{round(float(location['lon']), 2)}"
+        except (KeyError, TypeError, ValueError):
+            place = hashlib.sha256(message.encode("utf-8")).hexdigest()[:16]
+        dedupe_key = f"{str(analysis.get('event_type') or 'incident').lower()}@{place}"
+
+        try:
+            queued = self.enqueue(level, message, destinations, dedupe_key)
+        except Exception as e:  # the report still goes out even if the queue is unavailable
+            print(f"Alert enqueue failed ({e})")
+            state["alert_dispatch"] = {"status": "error", "alert_level": level, "error": str(e)}
+            return None
+        state["alert_dispatch"] = {"status": "queued", "alert_level": level, "calls": queued}
+        return None
+
+    # ---------- sending ----------
+    def claim(self, now: float = None) -> list:
+        """Mark up to ``batch`` due calls as sending (highest priority first, within rate limits)."""
+        now = time.time() if now is None else now
+
+        def take(conn):
+            # Every due call is scanned (no LIMIT), so a backlog for one rate-limited
+            # destination never keeps other destinations' calls waiting
+            rows = conn.execute(
+                "SELECT id, destination, level, message, attempts FROM alerts "
+                "WHERE (status = 'queued' AND next_attempt_at <= ?) OR (status = 'sending' AND lease_until < ?) "
+                "ORDER BY priority, id", (now, now))
+            used = {}
+            claimed = []
+            limited = 0
+            for alert_id, destination, level, message, attempts in rows.fetchall():
+                if destination not in used:
+                    used[destination] = conn.execute(
+                        "SELECT COUNT(*) FROM alerts WHERE destination = ? AND ((status = 'sent' AND sent_at >= ?) "
+                        "OR (status = 'sending' AND lease_until >= ?))",
+                        (destination, now - self.rate_window, now)).fetchone()[0]
+                if used[destination] >= self.rate_calls:
+                    limited += 1
+                    continue
+                used[destination] += 1
+                conn.execute("UPDATE alerts SET status = 'sending', lease_until = ?, attempts = attempts + 1 "
+                             "WHERE id = ?", (now + DISPATCH_LEASE_S, alert_id))
+                claimed.append({"id": alert_id, "destination": destination, "level": level, "message": message,
+                                "attempts": attempts + 1})
+                if len(claimed) >= self.batch:
+                    break
+            return claimed, limited
+
+        claimed, limited = self._transaction(take)
+        with self._lock:
+            self._stats["rate_limit_deferrals"] += limited
+            self._stats["batches"] += bool(claimed)
+        return claimed
+
+    async def _place_call(self, http: httpx.AsyncClient, alert: dict) -> str:
+        twiml = f"<Response><Say>{escape(alert['message'])}</Say></Response>"
+        started = time.perf_counter()
+        try:
+            response = await http.post(
+                f"{self.api}/2010-04-01/Accounts/{self.account_sid}/Calls.json",
+                data={"To": alert["destination"], "From": self.from_number, "Twiml": twiml},
+                auth=(self.account_sid, self.auth_token))
+        except httpx.HTTPError as e:
+            raise TwilioError(f"{type(e).__name__}: {e}", retryable=True) from e
+        finally:
+            observe("twilio.call", time.perf_counter() - started)
+        if response.status_code >= 300:
+            retry_after = response.headers.get("Retry-After")
+            raise TwilioError(f"HTTP {response.status_code}: {response.text[:200]}",
+                              retryable=response.status_code in RETRYABLE_STATUS,
+                              retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None)
+        try:
+            data = response.json()
+        except ValueError:  # the call was placed; only its sid is unknown
+            return ""
+        return data.get("sid", "") if isinstance(data, dict) else ""
+
+    async def send_batch(self, http: httpx.AsyncClient, alerts: list):
+        """Place the claimed calls concurrently and record each outcome."""
+        outcomes = await asyncio.gather(*(self._place_call(http, a) for a in alerts), return_exceptions=True)
+        now = time.time()
+        updates = []
+        for alert, outcome in zip(alerts, outcomes):
+            if not isinstance(outcome, BaseException):
+                updates.append(("sent", None, outcome, None, alert))
+                continue
+            retryable = isinstance(outcome, TwilioError) and outcome.retryable
+            if retryable and alert["attempts"] < self.max_attempts:
+                delay = getattr(outcome, "retry_after", None) or min(
+                    DISPATCH_BACKOFF_MAX_S, DISPATCH_BACKOFF_S * 2 ** (alert["attempts"] - 1)) * random.uniform(0.5, 1)
+                updates.append(("queued", now + delay, None, str(outcome), alert))
+            else:
+                updates.append(("failed", None, None, str(outcome), alert))
+
+        def record(conn):
+            for status, next_attempt_at, sid, error, alert in updates:
+                if status == "sent":
+                    conn.execute("UPDATE alerts SET status = 'sent', sent_at = ?, call_sid = ?, lease_until = NULL, "
+                                 "error = NULL WHERE id = ?", (now, sid, alert["id"]))
+                elif status == "queued":
+                    conn.execute("UPDATE alerts SET status = 'queued', next_attempt_at = ?, lease_until = NULL, "
+                                 "error = ? WHERE id = ?", (next_attempt_at, error, alert["id"]))
+                else:
+                    conn.execute("UPDATE alerts SET status = 'failed', lease_until = NULL, error = ? WHERE id = ?",
+                                 (error, alert["id"]))
+
+        self._transaction(record)
+        with self._lock:
+            for status, _, _, error, alert in updates:
+                self._stats[{"sent": "sent", "queued": "retried", "failed": "failed"}[status]] += 1
+                if status == "failed":
+                    print(f"Alert {alert['id']} to {alert['destination']} failed: {error}")
+        for status, _, _, _, alert in updates:
+            count("alertx_alert_calls_total", level=alert["level"], outcome=status if status != "queued" else "retry")
+
+    def _next_due(self) -> float:
+        conn = self._connect()
+        try:
+            due = conn.execute("SELECT MIN(next_attempt_at) FROM alerts WHERE status = 'queued'").fetchone()[0]
+        finally:
+            conn.close()
+        wait = POLL_SECONDS if due is None else due - time.time()
+        return wait if 0 < wait < POLL_SECONDS else POLL_SECONDS  # due now: rate limited, check again later
+
+    async def serve(self, stop: threading.Event = None):
+        """Claim and send batches until ``stop`` is set."""
+        stop = stop or self._stop
+        self._wake = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        limits = httpx.Limits(max_connections=self.batch, max_keepalive_connections=self.batch)
+        try:
+            async with httpx.AsyncClient(limits=limits, timeout=20) as http:
+                while not stop.is_set():
+                    self._wake.clear()
+                    alerts = self.claim()
+                    if alerts:
+                        await self.send_batch(http, alerts)
+                        continue
+                    try:  # until the next retry is due, a new alert arrives or stop()
+                        await asyncio.wait_for(self._wake.wait(), self._next_due())
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            self._loop = self._wake = None
+
+    def start(self):
+        """Run :meth:`serve` on a daemon thread of this process (once)."""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=lambda: asyncio.run(self.serve()), name="alertx-dispatcher",
+                                            daemon=True)
+            self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stop.set()
+        self._notify()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        try:
+            conn = self._connect()
+            try:
+                rows = conn.execute("SELECT status, COUNT(*) FROM alerts GROUP BY status").fetchall()
+            finally:
+                conn.close()
+        except sqlite3.OperationalError:
+            rows = []
+        return {**stats, "queue": dict(rows), "running": bool(self._thread and self._thread.is_alive()),
+                "rate": f"{self.rate_calls}/{self.rate_window:g}", "dedupe_s": self.dedupe_s}
+
+
+ALERT_DISPATCHER = AlertDispatcher()
+
+
+def start_dispatcher():
+    """Start this process's dispatcher when Twilio credentials are configured."""
+    if not (ALERT_DISPATCHER.account_sid and ALERT_DISPATCHER.auth_token and ALERT_DISPATCHER.from_number):
+        print("Twilio credentials not set; alerts are queued but not sent")
+        return None
+    return ALERT_DISPATCHER.start()
+
+
+if __name__ == "__main__":
+    # python dispatcher.py   — run a standalone dispatcher next to (or instead of) the in-process one
+    if start_dispatcher() is None:
+        sys.exit(2)
+    print(f"Alert dispatcher watching {ALERT_DISPATCHER.db_path}")
+    try:
+        while True:
+            time.sleep(60)
+            print(json.dumps(ALERT_DISPATCHER.stats()))
+    except KeyboardInterrupt:
+        ALERT_DISPATCHER.stop()
@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from array import array
+from collections import OrderedDict, deque
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Entries kept in memory per session; older ones are spilled to disk or dropped
+HISTORY_RING_SIZE = int(os.environ.get("ALERTX_HISTORY_RING", 200))
+HISTORY_SPILL = os.environ.get("ALERTX_HISTORY_SPILL", "0") == "1"
+HISTORY_DIR = os.environ.get("ALERTX_HISTORY_DIR", os.path.join(tempfile.gettempdir(), "alertx-history"))
+# Logs kept at once, and how long an unused one is kept; the session store's
+# eviction normally releases them first
+HISTORY_MAX_LOGS = int(os.environ.get("ALERTX_HISTORY_MAX_LOGS", 1000))
+HISTORY_IDLE_TTL = float(os.environ.get("ALERTX_HISTORY_TTL", 1800))
+
+
+class InteractionLog:
+    """Append-only interaction history of one session.
+
+    The newest ``ring_size`` entries live in a ring buffer. When ``spill_path``
+    is set, entries pushed out of the ring are appended to that JSONL file
+    (with their byte offsets kept) instead of being dropped, so every entry
+    stays readable. Appends are O(1); :meth:`page` reads any slice.
+    """
+
+    def __init__(self, ring_size: int = HISTORY_RING_SIZE, spill_path: str = None):
+        self._ring = deque()
+        self.ring_size = ring_size
+        self.spill_path = spill_path
+        self._offsets = array("q")  # byte offset of each spilled entry
+        self._spill = None  # append handle, opened on first spill
+        self.dropped = 0  # entries lost because spilling is off
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.dropped + len(self._offsets) + len(self._ring)
+
+    def append(self, entry: dict):
+        with self._lock:
+            self._ring.append(entry)
+            if len(self._ring) > self.ring_size:
+                self._evict_oldest()
+
+    def _evict_oldest(self):
+        oldest = self._ring.popleft()
+        if not self.spill_path:
+            self.dropped += 1
+            return
+        if self._spill is None:
+            self._spill = open(self.spill_path, "ab")
+        self._offsets.append(self._spill.tell())
+        self._spill.write(json.dumps(oldest).encode("utf-8") + b"\n")
+
+    def page(self, offset: int = 0, limit: int = 50) -> dict:
+        """Entries ``offset`` .. ``offset + limit`` (oldest first) and the total count.
+
+        Dropped entries count towards ``total`` but cannot be returned; the
+        first readable index is ``first``.
+        """
+        with self._lock:
+            total = len(self)
+            first = self.dropped
+            start, stop = max(offset, first), min(offset + limit, total)
+            entries = []
+            spilled = len(self._offsets)
+            if start < first + spilled:
+                self._spill.flush()
+                with open(self.spill_path, "rb") as fh:
+                    fh.seek(self._offsets[start - first])
+                    for _ in range(start, min(stop, first + spilled)):
+                        entries.append(json.loads(fh.readline()))
+            ring_start = max(start, first + spilled) - first - spilled
+            for i in range(ring_start, stop - first - spilled):
+                entries.append(self._ring[i])
+        return {"entries": entries, "offset": offset, "total": total, "first": first}
+
+    def tail(self, n: int = 20) -> list:
+        with self._lock:
+            return list(self._ring)[-n:]
+
+    def close(self):
+        if self._spill is not None:
+            self._spill.close()
+        if self.spill_path and os.path.exists(self.spill_path):
+            os.unlink(self.spill_path)
+
+
+class HistoryStore:
+    """One :class:`InteractionLog` per (app, user, session).
+
+    Logs are released by :meth:`discard` when the session goes away, and
+    otherwise in LRU order: beyond ``max_logs``, or after ``idle_ttl``
+    seconds without use.
+    """
+
+    def __init__(self, ring_size: int = HISTORY_RING_SIZE, spill: bool = HISTORY_SPILL,
+                 spill_dir: str = HISTORY_DIR, max_logs: int = HISTORY_MAX_LOGS, idle_ttl: float = HISTORY_IDLE_TTL):
+        self.ring_size = ring_size
+        self.spill_dir = spill_dir if spill else None
+        self.max_logs = max_logs
+        self.idle_ttl = idle_ttl
+        self._logs = OrderedDict()  # key -> [last_used, log]
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    def log(self, app_name: str, user_id: str, session_id: str) -> InteractionLog:
+        key = (app_name, user_id, session_id)
+        now = time.monotonic()
+        with self._lock:
+            slot = self._logs.get(key)
+            if slot is None:
+                spill_path = None
+                if self.spill_dir:
+                    os.makedirs(self.spill_dir, exist_ok=True)
+                    name = hashlib.sha1("\0".join(key).encode("utf-8")).hexdigest()
+                    spill_path = os.path.join(self.spill_dir, f"{name}.jsonl")
+                slot = self._logs[key] = [now, InteractionLog(self.ring_size, spill_path)]
+            slot[0] = now
+            self._logs.move_to_end(key)
+            victims = self._evict(now)
+        for log in victims:
+            log.close()
+        return slot[1]
+
+    def _evict(self, now: float) -> list:
+        # Caller holds the lock; the newest log (just used) is never evicted
+        victims = []
+        while len(self._logs) > 1:
+            key, (last_used, log) = next(iter(self._logs.items()))
+            if len(self._logs) <= self.max_logs and now - last_used <= self.idle_ttl:
+                break
+            del self._logs[key]
+            victims.append(log)
+        self.evicted += len(victims)
+        return victims
+
+    def discard(self, app_name: str, user_id: str, session_id: str):
+        with self._lock:
+            slot = self._logs.pop((app_name, user_id, session_id), None)
+        if slot is not None:
+            slot[1].close()
+
+
+HISTORY = HistoryStore()
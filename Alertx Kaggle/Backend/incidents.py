@@ -0,0 +1,174 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from dotenv import load_dotenv
+
+from jobs import JOB_LEASE_S, JOBS_DIR
+from placecache import EARTH_RADIUS_KM, haversine_km
+from tracing import count
+
+load_dotenv()
+
+INCIDENT_CLUSTERING = os.environ.get("ALERTX_INCIDENT_CLUSTERING", "1") == "1"
+# Reports within this distance of an open incident's centre are the same event
+INCIDENT_RADIUS_M = float(os.environ.get("ALERTX_INCIDENT_RADIUS_M", 1000))
+# An incident stays open while reports keep arriving at most this far apart
+INCIDENT_WINDOW_S = float(os.environ.get("ALERTX_INCIDENT_WINDOW_S", 1800))
+# A report arriving this long after the incident's run finished runs the pipeline
+# again with the new footage (the updated report goes to later subscribers)
+INCIDENT_REFRESH_S = float(os.environ.get("ALERTX_INCIDENT_REFRESH_S", 600))
+# Shared by every web process on the host; the leading dot keeps job workers from treating it as a job
+INCIDENT_DB = os.environ.get("ALERTX_INCIDENT_DB", os.path.join(JOBS_DIR, ".incidents.db"))
+
+_KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS incidents (
+    id TEXT PRIMARY KEY,
+    cell_y INTEGER NOT NULL,
+    cell_x INTEGER NOT NULL,
+    lat REAL NOT NULL,
+    lon REAL NOT NULL,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    leader TEXT NOT NULL,
+    reports INTEGER NOT NULL,
+    runs INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS incidents_cell ON incidents (cell_y, cell_x);
+"""
+
+
+class IncidentAggregator:
+    """Groups job submissions into incidents by place and time, one pipeline run each.
+
+    Open incidents live in a SQLite grid index: square cells of
+    ``radius_m`` (in degrees of latitude), so a report only compares against
+    incidents in the cells its search circle overlaps. A report within
+    ``radius_m`` of an open incident's centre joins it and follows the
+    incident's current run (its ``leader`` job) instead of starting one; the
+    centre moves to the running mean of its reports. A report also becomes the
+    new leader when that run failed, finished more than ``refresh_s`` ago, or
+    lost its worker (no heartbeat for ``lease_s``).
+    Incidents close ``window_s`` after their last report. Assignment runs in
+    one ``BEGIN IMMEDIATE`` transaction, so concurrent web processes agree on
+    the leader.
+    """
+
+    def __init__(self, db_path: str = INCIDENT_DB, radius_m: float = INCIDENT_RADIUS_M,
+                 window_s: float = INCIDENT_WINDOW_S, refresh_s: float = INCIDENT_REFRESH_S,
+                 lease_s: float = JOB_LEASE_S):
+        self.db_path = db_path
+        self.radius_km = radius_m / 1000
+        self.window_s = window_s
+        self.refresh_s = refresh_s
+        self.lease_s = lease_s
+        self.cell_deg = self.radius_km / _KM_PER_DEGREE
+        self._ready = False
+        self._lock = threading.Lock()
+        self._stats = {"new": 0, "joined": 0, "rerun": 0, "closed": 0}
+
+    def _connect(self):
+        if not self._ready:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            with sqlite3.connect(self.db_path, timeout=10) as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(_SCHEMA)
+            self._ready = True
+        return sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+
+    def _cell(self, lat: float, lon: float):
+        return math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg)
+
+    def _candidates(self, conn, lat: float, lon: float, now: float):
+        dlon = self.cell_deg / max(math.cos(math.radians(min(abs(lat) + self.cell_deg, 89.0))), 1e-6)
+        y0, x0 = self._cell(lat - self.cell_deg, lon - dlon)
+        y1, x1 = self._cell(lat + self.cell_deg, lon + dlon)
+        return conn.execute(
+            "SELECT id, lat, lon, leader, reports FROM incidents "
+            "WHERE cell_y BETWEEN ? AND ? AND cell_x BETWEEN ? AND ? AND last_seen >= ?",
+            (y0, y1, x0, x1, now - self.window_s)).fetchall()
+
+    def assign(self, job_id: str, lat: float, lon: float, leader_state, now: float = None) -> dict:
+        """Put a new job into an incident: ``{"incident", "leader", "reports", "outcome"}``.
+
+        ``leader_state(job_id)`` returns the ``(status, finished_at,
+        heartbeat_age)`` of a leader job, or None while it is still being
+        enqueued. ``leader`` is
+        ``job_id`` itself when this job has to run the pipeline (``outcome``
+        "new" or "rerun"), else the job whose events it shares ("joined").
+        """
+        now = time.time() if now is None else now
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            closed = conn.execute("DELETE FROM incidents WHERE last_seen < ?", (now - self.window_s,)).rowcount
+            nearest = None
+            for row in self._candidates(conn, lat, lon, now):
+                distance = haversine_km(lat, lon, row[1], row[2])
+                if distance <= self.radius_km and (nearest is None or distance < nearest[0]):
+                    nearest = (distance, row)
+            if nearest is None:
+                incident, leader, reports, outcome = uuid.uuid4().hex[:12], job_id, 1, "new"
+                conn.execute("INSERT INTO incidents VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1, 1)",
+                             (incident, *self._cell(lat, lon), lat, lon, now, now, job_id))
+            else:
+                incident, c_lat, c_lon, leader, reports = nearest[1]
+                reports += 1
+                if self._stale(leader_state(leader), now):
+                    leader, outcome = job_id, "rerun"
+                else:
+                    outcome = "joined"
+                c_lat += (lat - c_lat) / reports
+                c_lon += (lon - c_lon) / reports
+                conn.execute(
+                    "UPDATE incidents SET cell_y = ?, cell_x = ?, lat = ?, lon = ?, last_seen = ?, leader = ?, "
+                    "reports = ?, runs = runs + ? WHERE id = ?",
+                    (*self._cell(c_lat, c_lon), c_lat, c_lon, now, leader, reports, int(outcome == "rerun"),
+                     incident))
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        with self._lock:
+            self._stats[outcome] += 1
+            self._stats["closed"] += closed
+        count("alertx_incident_reports_total", outcome=outcome)
+        return {"incident": incident, "leader": leader, "reports": reports, "outcome": outcome}
+
+    def _stale(self, state, now: float) -> bool:
+        if state is None:
+            return False  # leader is being enqueued right now
+        status, finished_at, heartbeat_age = state
+        if status == "failed":
+            return True
+        if status == "running" and heartbeat_age is not None and heartbeat_age > self.lease_s:
+            return True  # its worker died; it would absorb reports forever
+        return status == "done" and now - (finished_at or now) > self.refresh_s
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        try:
+            conn = self._connect()
+            try:
+                open_, reports, runs = conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(reports), 0), COALESCE(SUM(runs), 0) FROM incidents "
+                    "WHERE last_seen >= ?", (time.time() - self.window_s,)).fetchone()
+            finally:
+                conn.close()
+        except sqlite3.OperationalError:
+            open_ = reports = runs = 0
+        return {**stats, "open_incidents": open_, "open_reports": reports, "open_runs": runs,
+                "runs_saved": reports - runs, "radius_m": self.radius_km * 1000, "window_s": self.window_s,
+                "refresh_s": self.refresh_s}
+
+
+INCIDENTS = IncidentAggregator()
@@ -0,0 +1,523 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+import uuid
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# ------------------------------------------
+# Jobs live on disk so web processes and worker processes only have to share
+# a directory:
+#
+#   <JOBS_DIR>/<job_id>/job.json      request + status (rewritten atomically)
+#   <JOBS_DIR>/<job_id>/video         the uploaded clip, if any
+#   <JOBS_DIR>/<job_id>/claim         created (O_EXCL) by the worker that runs it; its
+#                                     mtime is the worker's heartbeat
+#   <JOBS_DIR>/<job_id>/events.jsonl  append-only log, one {"id", "event"} per line
+#   <JOBS_DIR>/<job_id>/followers     ids of the reports that joined this job's run
+#   <JOBS_DIR>/.incidents.db          open incidents (incidents.py); reports of the
+#                                     same incident share one job's run and log
+#   <JOBS_DIR>/.queued/<job_id>       empty markers: what workers poll instead of
+#   <JOBS_DIR>/.running/<job_id>      reading every job.json
+#
+# Job ids start with a millisecond timestamp, so sorting them is FIFO order.
+# ------------------------------------------
+JOBS_DIR = os.environ.get("ALERTX_JOBS_DIR", os.path.join(tempfile.gettempdir(), "alertx-jobs"))
+POLL_SECONDS = 0.25
+FINISHED = ("done", "failed")
+# A running job whose heartbeat is older than this is claimed again by another worker
+JOB_LEASE_S = float(os.environ.get("ALERTX_JOB_LEASE_S", 60))
+JOB_MAX_ATTEMPTS = int(os.environ.get("ALERTX_JOB_MAX_ATTEMPTS", 2))
+# Finished jobs (record, log, leftover video) are deleted this long after they finish
+JOB_RETENTION_S = float(os.environ.get("ALERTX_JOB_RETENTION_S", 24 * 3600))
+# Subscribers stop waiting when an unfinished job shows no progress for this long
+FOLLOW_TIMEOUT_S = float(os.environ.get("ALERTX_JOB_FOLLOW_TIMEOUT_S", 900))
+GC_INTERVAL_S = 600
+# When an incident's run fails it is retried with this many joined reports' footage
+JOB_FAILOVERS = int(os.environ.get("ALERTX_JOB_FAILOVERS", 2))
+QUEUED_DIR = os.path.join(JOBS_DIR, ".queued")
+RUNNING_DIR = os.path.join(JOBS_DIR, ".running")
+
+
+def _job_dir(job_id: str) -> str:
+    if not job_id or os.sep in job_id or job_id.startswith("."):
+        raise KeyError(job_id)
+    return os.path.join(JOBS_DIR, job_id)
+
+
+def _write_job(job_id: str, job: dict):
+    path = os.path.join(_job_dir(job_id), "job.json")
+    with open(path + ".tmp", "w", encoding="utf-8") as fh:
+        json.dump(job, fh)
+    os.replace(path + ".tmp", path)
+
+
+def _mark(directory: str, job_id: str):
+    os.makedirs(directory, exist_ok=True)
+    open(os.path.join(directory, job_id), "a").close()
+
+
+def _unmark(directory: str, job_id: str):
+    try:
+        os.unlink(os.path.join(directory, job_id))
+    except FileNotFoundError:
+        pass
+
+
+def _markers(directory: str) -> list:
+    try:
+        return sorted(os.listdir(directory))
+    except FileNotFoundError:
+        return []
+
+
+def get_job(job_id: str) -> dict:
+    """The job record; raises KeyError for unknown ids."""
+    try:
+        with open(os.path.join(_job_dir(job_id), "job.json"), encoding="utf-8") as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        raise KeyError(job_id) from None
+
+
+def enqueue(text: str, upload=None, mime_type: str = "video/mp4", risk_tier: str = None,
+            location: dict = None) -> str:
+    """Queue an analysis and return its job id.
+
+    ``upload`` is a closed :class:`upload.HashingUpload`; its file is moved
+    into the job directory. ``location`` is the client's GPS, if sent.
+    """
+    job_id = f"{int(time.time() * 1000):013d}-{uuid.uuid4().hex[:8]}"
+    job_dir = _job_dir(job_id)
+    os.makedirs(job_dir)
+    job = {
+        "id": job_id,
+        "status": "queued",
+        "text": text,
+        "video": None,
+        "location": location,
+        "created_at": time.time(),
+    }
+    incident = _assign_incident(job_id, location)
+    if incident is not None:
+        job["incident"] = incident
+        if incident["leader"] != job_id:
+            # Another job already runs the pipeline for this event; share its events
+            job.update(status="joined", leader=incident["leader"])
+    if upload is not None:
+        # Joined reports keep their clip too: it reruns the incident if the leader's run fails
+        job["video"] = {"path": os.path.join(job_dir, "video"), "sha256": upload.sha256, "size": upload.size,
+                        "mime_type": mime_type, "risk_tier": risk_tier}
+        shutil.move(upload.path, job["video"]["path"])
+    open(os.path.join(job_dir, "events.jsonl"), "a").close()
+    _write_job(job_id, job)
+    if job["status"] == "queued":
+        _mark(QUEUED_DIR, job_id)
+    else:
+        try:
+            with open(os.path.join(_job_dir(job["leader"]), "followers"), "a") as fh:
+                fh.write(job_id + "\n")
+        except OSError:
+            pass  # leader already deleted
+    return job_id
+
+
+def _leader_state(job_id: str):
+    try:
+        job = get_job(job_id)
+    except KeyError:
+        return None
+    return job["status"], job.get("finished_at"), heartbeat_age(job_id)
+
+
+def _assign_incident(job_id: str, location: dict):
+    """The job's incident (see :class:`incidents.IncidentAggregator`), None without GPS or clustering."""
+    from incidents import INCIDENT_CLUSTERING, INCIDENTS
+
+    if not location or not INCIDENT_CLUSTERING:
+        return None
+    try:
+        return INCIDENTS.assign(job_id, location["lat"], location["lon"], _leader_state)
+    except Exception as e:  # a broken index must not lose the report
+        print(f"Incident clustering failed ({e}); running job {job_id} on its own")
+        return None
+
+
+def _followers(job_id: str) -> list:
+    try:
+        with open(os.path.join(_job_dir(job_id), "followers"), encoding="utf-8") as fh:
+            ids = fh.read().split()
+    except FileNotFoundError:
+        return []
+    followers = []
+    for follower_id in ids:
+        try:
+            followers.append(get_job(follower_id))
+        except (KeyError, ValueError):
+            continue
+    return followers
+
+
+def _failover_report(job: dict):
+    """A joined report whose clip has not been tried yet, to rerun a failed incident with."""
+    tried = job.get("tried", [])
+    if len(tried) >= JOB_FAILOVERS:
+        return None
+    for follower in _followers(job["id"]):
+        video = follower.get("video")
+        if follower["id"] not in tried and video and video["path"] and os.path.exists(video["path"]):
+            return follower
+    return None
+
+
+def _drop_follower_videos(job_id: str):
+    # The run succeeded; nobody needs the joined reports' clips any more
+    for follower in _followers(job_id):
+        if follower.get("video") and follower["video"]["path"]:
+            try:
+                os.unlink(follower["video"]["path"])
+            except FileNotFoundError:
+                pass
+
+
+def job_record(job_id: str) -> dict:
+    """The job as clients see it: a joined job reports the status of the run it shares."""
+    job = get_job(job_id)
+    if job.get("leader"):
+        try:
+            leader = get_job(job["leader"])
+        except KeyError:
+            return job
+        job = {**job, "status": leader["status"], "shared_run": True}
+        for key in ("started_at", "finished_at"):
+            if key in leader:
+                job[key] = leader[key]
+    return job
+
+
+# ==================== WORKERS ====================
+def _try_claim(job_id: str) -> bool:
+    try:
+        fd = os.open(os.path.join(_job_dir(job_id), "claim"), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        _unmark(QUEUED_DIR, job_id)  # someone else owns it
+        return False
+    except (KeyError, FileNotFoundError):
+        _unmark(QUEUED_DIR, job_id)  # deleted
+        return False
+    os.write(fd, str(os.getpid()).encode())
+    os.close(fd)
+    _mark(RUNNING_DIR, job_id)
+    _unmark(QUEUED_DIR, job_id)
+    return True
+
+
+def heartbeat_age(job_id: str):
+    """Seconds since the worker running ``job_id`` last showed signs of life (None when unclaimed)."""
+    try:
+        return time.time() - os.path.getmtime(os.path.join(_job_dir(job_id), "claim"))
+    except (KeyError, OSError):
+        return None
+
+
+_last_reclaim_scan = 0.0
+
+
+def _reclaim_stale():
+    """Take over one running job whose worker stopped sending heartbeats."""
+    global _last_reclaim_scan
+    if time.monotonic() - _last_reclaim_scan < JOB_LEASE_S / 4:
+        return None
+    _last_reclaim_scan = time.monotonic()
+    for job_id in _markers(RUNNING_DIR):
+        age = heartbeat_age(job_id)
+        if age is None:
+            _unmark(RUNNING_DIR, job_id)  # released or deleted
+            continue
+        if age < JOB_LEASE_S:
+            continue
+        claim = os.path.join(_job_dir(job_id), "claim")
+        stale = f"{claim}.{uuid.uuid4().hex[:8]}.stale"
+        try:
+            os.rename(claim, stale)  # atomic: exactly one worker wins the takeover
+        except FileNotFoundError:
+            continue
+        os.unlink(stale)
+        if _try_claim(job_id):
+            print(f"Reclaimed job {job_id}: its worker stopped sending heartbeats {age:.0f}s ago")
+            return job_id
+    return None
+
+
+def _claim_next():
+    for job_id in _markers(QUEUED_DIR):
+        if _try_claim(job_id):
+            return job_id
+    return _reclaim_stale()
+
+
+def _heartbeat(job_id: str, stop: threading.Event):
+    # A thread, not a task: it keeps beating while the event loop is busy in a blocking call
+    path = os.path.join(_job_dir(job_id), "claim")
+    while not stop.wait(JOB_LEASE_S / 4):
+        try:
+            os.utime(path)
+        except OSError:
+            return
+
+
+def _resume_log(path: str) -> int:
+    """Last event id in a job log, cutting off a line a dead worker left half-written."""
+    last_id, size = 0, 0
+    with open(path, "rb+") as fh:
+        for line in fh:
+            if not line.endswith(b"\n"):
+                break
+            size += len(line)
+            last_id = json.loads(line)["id"]
+        fh.truncate(size)
+    return last_id
+
+
+async def _run_job(runner, job_id: str):
+    from analysis import analysis_events, prepare_video
+    from resultcache import cache_scope
+
+    job = get_job(job_id)
+    attempt = job.get("attempts", 0) + 1
+    job.update(status="running", started_at=time.time(), worker_pid=os.getpid(), attempts=attempt)
+    _write_job(job_id, job)
+    stop = threading.Event()
+    threading.Thread(target=_heartbeat, args=(job_id, stop), daemon=True).start()
+
+    status = "done"
+    failover = None
+    log_path = os.path.join(_job_dir(job_id), "events.jsonl")
+    event_id = _resume_log(log_path)
+    try:
+        with open(log_path, "a", encoding="utf-8") as log:
+
+            def append(event):
+                nonlocal event_id
+                event_id += 1
+                log.write(json.dumps({"id": event_id, "event": event}) + "\n")
+                log.flush()
+
+            if attempt > 1:
+                append({"type": "log", "message": f"♻️ The worker running this job stopped; restarting (attempt {attempt})"})
+            if attempt > JOB_MAX_ATTEMPTS:
+                status = "failed"
+                append({"type": "error", "message": f"Job abandoned after {JOB_MAX_ATTEMPTS} attempts"})
+            else:
+                try:
+                    video = None
+                    if job["video"]:
+                        info = job["video"]
+                        upload = types.SimpleNamespace(path=info["path"], sha256=info["sha256"], size=info["size"])
+                        video = await asyncio.to_thread(prepare_video, upload, info["mime_type"], info["risk_tier"],
+                                                        cache_scope(job["text"], job.get("location")))
+                    async for event in analysis_events(runner, job["text"], video, location=job.get("location")):
+                        append(event)
+                        if event["type"] == "error":
+                            status = "failed"
+                except Exception as e:
+                    status = "failed"
+                    append({"type": "error", "message": str(e)})
+            if status == "failed" and job.get("incident"):
+                failover = _failover_report(job)
+                if failover:
+                    append({"type": "log", "message": f"🔁 Analysis failed; retrying with the footage of report "
+                                                      f"{failover['id']} from the same incident"})
+    finally:
+        stop.set()
+
+    if failover:
+        # Requeue this job rather than the follower, so subscribers keep one log with monotonic ids
+        job.update(status="queued", text=failover["text"] or job["text"], video=failover["video"], attempts=0,
+                   tried=[*job.get("tried", []), failover["id"]])
+        _write_job(job_id, job)
+        os.unlink(os.path.join(_job_dir(job_id), "claim"))
+        _unmark(RUNNING_DIR, job_id)
+        _mark(QUEUED_DIR, job_id)
+        return
+    job.update(status=status, finished_at=time.time())
+    _write_job(job_id, job)
+    _unmark(RUNNING_DIR, job_id)
+    if status == "done":
+        _drop_follower_videos(job_id)
+
+
+def collect_garbage(now: float = None) -> int:
+    """Delete jobs that finished more than :data:`JOB_RETENTION_S` ago; returns how many."""
+    now = time.time() if now is None else now
+    removed = 0
+    for job_id in _markers(JOBS_DIR):
+        if job_id.startswith("."):
+            continue
+        try:
+            job = get_job(job_id)
+        except (KeyError, ValueError):  # never finished enqueueing, or unreadable
+            try:
+                ended = os.path.getmtime(_job_dir(job_id))
+            except OSError:
+                continue
+        else:
+            if job["status"] in FINISHED:
+                ended = job.get("finished_at") or job["created_at"]
+            elif job["status"] == "joined":
+                ended = job["created_at"]
+            else:
+                continue  # queued / running: the lease takes care of lost ones
+        if now - ended > JOB_RETENTION_S:
+            shutil.rmtree(_job_dir(job_id), ignore_errors=True)
+            _unmark(QUEUED_DIR, job_id)
+            _unmark(RUNNING_DIR, job_id)
+            removed += 1
+    return removed
+
+
+def worker_loop(stop_after: int = None):
+    """Claim and run queued jobs forever (or for ``stop_after`` jobs)."""
+    from app import runner  # imported here: worker processes build their own agents
+
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    print(f"Job worker {os.getpid()} watching {JOBS_DIR}")
+    done = 0
+    last_gc = 0.0
+    while stop_after is None or done < stop_after:
+        if time.monotonic() - last_gc > GC_INTERVAL_S:
+            last_gc = time.monotonic()
+            removed = collect_garbage()
+            if removed:
+                print(f"Deleted {removed} finished jobs older than {JOB_RETENTION_S:.0f}s")
+        job_id = _claim_next()
+        if job_id is None:
+            time.sleep(POLL_SECONDS)
+            continue
+        asyncio.run(_run_job(runner, job_id))
+        done += 1
+
+
+def start_workers(count: int):
+    """Start ``count`` local worker processes next to the web server."""
+    ctx = multiprocessing.get_context("spawn")
+    workers = []
+    for _ in range(count):
+        p = ctx.Process(target=worker_loop, daemon=True)
+        p.start()
+        workers.append(p)
+    return workers
+
+
+# ==================== SUBSCRIBING ====================
+def _read_new(job_id: str, offset: int, after_id: int):
+    """New complete log lines past ``offset``: returns (items, new_offset)."""
+    items = []
+    with open(os.path.join(_job_dir(job_id), "events.jsonl"), "rb") as fh:
+        fh.seek(offset)
+        for line in fh:
+            if not line.endswith(b"\n"):
+                break  # the worker is mid-write; pick it up next time
+            offset += len(line)
+            item = json.loads(line)
+            if item["id"] > after_id:
+                items.append(item)
+    return items, offset
+
+
+def _event_source(job_id: str, after_id: int):
+    """The job whose log holds ``job_id``'s events, plus a note to send first (or None)."""
+    job = get_job(job_id)  # KeyError for unknown jobs
+    if not job.get("leader"):
+        return job_id, None
+    note = None
+    if after_id == 0:
+        incident = job["incident"]
+        note = {"type": "log", "incident": incident,
+                "message": f"🧩 {incident['reports']} reports from this area; sharing the analysis already running"}
+    return job["leader"], note
+
+
+def _stalled() -> dict:
+    return {"type": "error", "message": f"No progress for {FOLLOW_TIMEOUT_S:.0f}s; stopped waiting "
+                                        "(reconnect with Last-Event-ID to resume)"}
+
+
+def follow_events(job_id: str, after_id: int = 0):
+    """Yield ``(event_id, event)`` from the job's log, waiting for new ones until it finishes.
+
+    Gives up with an ``error`` event after :data:`FOLLOW_TIMEOUT_S` without
+    progress (e.g. no worker left to pick the job up). Jobs that joined an
+    incident follow the log of the job running it; their first item is a note
+    without an id.
+    """
+    job_id, note = _event_source(job_id, after_id)
+    if note:
+        yield None, note
+    offset = 0
+    progress = time.monotonic()
+    while True:
+        finished = get_job(job_id)["status"] in FINISHED
+        items, offset = _read_new(job_id, offset, after_id)
+        for item in items:
+            after_id = item["id"]
+            yield item["id"], item["event"]
+        if finished and not items:
+            return
+        if items:
+            progress = time.monotonic()
+        elif time.monotonic() - progress > FOLLOW_TIMEOUT_S:
+            yield None, _stalled()
+            return
+        else:
+            time.sleep(POLL_SECONDS)
+
+
+async def follow_events_async(job_id: str, after_id: int = 0):
+    """Async twin of :func:`follow_events` for the ASGI server."""
+    job_id, note = _event_source(job_id, after_id)
+    if note:
+        yield None, note
+    offset = 0
+    progress = time.monotonic()
+    while True:
+        finished = get_job(job_id)["status"] in FINISHED
+        items, offset = _read_new(job_id, offset, after_id)
+        for item in items:
+            after_id = item["id"]
+            yield item["id"], item["event"]
+        if finished and not items:
+            return
+        if items:
+            progress = time.monotonic()
+        elif time.monotonic() - progress > FOLLOW_TIMEOUT_S:
+            yield None, _stalled()
+            return
+        else:
+            await asyncio.sleep(POLL_SECONDS)
+
+
+def last_event_id(headers, args) -> int:
+    """Resume point from the ``Last-Event-ID`` header (or ``?last_event_id=``)."""
+    value = headers.get("Last-Event-ID") or args.get("last_event_id") or 0
+    try:
+        return max(0, int(value))
+    except ValueError:
+        return 0
+
+
+if __name__ == "__main__":
+    # python jobs.py worker   — run a standalone worker (scale these independently of web processes)
+    if sys.argv[1:] != ["worker"]:
+        print("usage: jobs.py worker")
+        sys.exit(2)
+    worker_loop()
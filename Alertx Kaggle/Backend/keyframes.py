@@ -0,0 +1,164 @@
+import os
+import threading
+
+from dotenv import load_dotenv
+from google.genai.types import Blob, Part
+
+try:
+    import cv2
+except ImportError:  # OpenCV is optional; without it the full video is sent
+    cv2 = None
+
+load_dotenv()
+
+KEYFRAMES_ENABLED = os.environ.get("ALERTX_KEYFRAMES", "1") != "0"
+DEFAULT_TIER = os.environ.get("ALERTX_KEYFRAME_TIER", "standard")
+
+# Sampling profile per risk tier: how often to look at the video, how many
+# frames the model may see, how large they are and how different a frame
+# must be from the last kept one (mean absolute difference, 0..1).
+TIER_PROFILES = {
+    "high": {"sample_fps": 4.0, "max_frames": 48, "max_side": 768, "diff_threshold": 0.06, "jpeg_quality": 85},
+    "standard": {"sample_fps": 2.0, "max_frames": 24, "max_side": 640, "diff_threshold": 0.10, "jpeg_quality": 80},
+    "low": {"sample_fps": 1.0, "max_frames": 12, "max_side": 512, "diff_threshold": 0.15, "jpeg_quality": 75},
+}
+
+# The client may send a reported risk level instead of a tier name
+RISK_TIER = {"severe": "high", "high": "high", "medium": "standard", "low": "low"}
+
+_DIFF_SIZE = (64, 36)  # frames are compared as tiny greyscale thumbnails
+HASH_SAMPLES = 16  # evenly spaced frames hashed for near-duplicate lookup
+
+_stats_lock = threading.Lock()
+KEYFRAME_STATS = {"requests": 0, "frames_sent": 0, "source_bytes": 0, "sent_bytes": 0, "bytes_saved": 0}
+
+
+def resolve_tier(value: str = None) -> str:
+    value = (value or DEFAULT_TIER).strip().lower()
+    value = RISK_TIER.get(value, value)
+    return value if value in TIER_PROFILES else "standard"
+
+
+def keyframes_available() -> bool:
+    return KEYFRAMES_ENABLED and cv2 is not None
+
+
+def extract_keyframes(path: str, tier: str = None):
+    """Decode ``path`` and keep frames that differ enough from the previous keyframe.
+
+    Returns a dict with ``frames`` (list of ``(timestamp_s, jpeg_bytes)`` in
+    time order), ``hashes`` (dHashes of :data:`HASH_SAMPLES` evenly spaced
+    frames, taken in the same decode pass), ``duration_s``, ``tier``,
+    ``source_bytes`` and ``sent_bytes``.
+    Raises ``RuntimeError`` if OpenCV is missing, the video cannot be decoded
+    or no frame could be kept.
+    """
+    if cv2 is None:
+        raise RuntimeError("Keyframe extraction requires `pip install opencv-python-headless`")
+    tier = resolve_tier(tier)
+    profile = TIER_PROFILES[tier]
+
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise RuntimeError(f"Could not decode video {path}")
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        step = max(1, int(round(fps / profile["sample_fps"])))
+        encode_params = [int(cv2.IMWRITE_JPEG_QUALITY), profile["jpeg_quality"]]
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) or 0
+        hash_step = max(1, total // HASH_SAMPLES) if total else 15
+
+        candidates = []  # (score, timestamp, jpeg)
+        hashes = []
+        previous = None
+        index = 0
+        while True:
+            # grab() skips decoding to an image; retrieve() only on sampled or hashed frames
+            if not cap.grab():
+                break
+            sampled = index % step == 0
+            hashed = index % hash_step == 0 and len(hashes) < HASH_SAMPLES
+            ok, frame = cap.retrieve() if sampled or hashed else (False, None)
+            if ok and hashed:
+                hashes.append(_dhash(frame))
+            if ok and sampled:
+                thumb = cv2.cvtColor(cv2.resize(frame, _DIFF_SIZE, interpolation=cv2.INTER_AREA),
+                                     cv2.COLOR_BGR2GRAY)
+                score = 1.0 if previous is None else float(cv2.absdiff(thumb, previous).mean()) / 255
+                if score >= profile["diff_threshold"]:
+                    previous = thumb
+                    ok, jpeg = cv2.imencode(".jpg", _downscale(frame, profile["max_side"]), encode_params)
+                    if ok:
+                        candidates.append((score, index / fps, jpeg.tobytes()))
+            index += 1
+        duration = index / fps
+    finally:
+        cap.release()
+    if not candidates:
+        # Opens but yields no frame: callers fall back to sending the full video
+        raise RuntimeError(f"No decodable frames in video {path}")
+
+    if len(candidates) > profile["max_frames"]:
+        # Keep the opening frame plus the biggest scene changes, back in time order
+        first, rest = candidates[0], candidates[1:]
+        rest = sorted(rest, key=lambda c: c[0], reverse=True)[:profile["max_frames"] - 1]
+        candidates = [first] + sorted(rest, key=lambda c: c[1])
+
+    frames = [(ts, jpeg) for _, ts, jpeg in candidates]
+    return {
+        "frames": frames,
+        "hashes": hashes,
+        "duration_s": duration,
+        "tier": tier,
+        "source_bytes": os.path.getsize(path),
+        "sent_bytes": sum(len(jpeg) for _, jpeg in frames),
+    }
+
+
+def _downscale(frame, max_side: int):
+    h, w = frame.shape[:2]
+    scale = max_side / max(h, w)
+    if scale >= 1:
+        return frame
+    return cv2.resize(frame, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+
+
+def keyframe_parts(keyframes):
+    """Model parts for a keyframe set: a header, then a timestamp + JPEG per frame."""
+    parts = [Part(text=(
+        f"The video ({keyframes['duration_s']:.0f}s) is provided as {len(keyframes['frames'])} "
+        "keyframes in time order, each preceded by its timestamp. Treat them as one clip."
+    ))]
+    for ts, jpeg in keyframes["frames"]:
+        parts.append(Part(text=f"[t={ts:.1f}s]"))
+        parts.append(Part(inline_data=Blob(mime_type="image/jpeg", data=jpeg)))
+    return parts
+
+
+def record_savings(keyframes) -> dict:
+    """Add one request's savings to :data:`KEYFRAME_STATS` and return them."""
+    saved = max(0, keyframes["source_bytes"] - keyframes["sent_bytes"])
+    with _stats_lock:
+        KEYFRAME_STATS["requests"] += 1
+        KEYFRAME_STATS["frames_sent"] += len(keyframes["frames"])
+        KEYFRAME_STATS["source_bytes"] += keyframes["source_bytes"]
+        KEYFRAME_STATS["sent_bytes"] += keyframes["sent_bytes"]
+        KEYFRAME_STATS["bytes_saved"] += saved
+    return {
+        "tier": keyframes["tier"],
+        "frames": len(keyframes["frames"]),
+        "source_bytes": keyframes["source_bytes"],
+        "sent_bytes": keyframes["sent_bytes"],
+        "bytes_saved": saved,
+    }
+
+
+def _dhash(frame) -> int:
+    """64-bit difference hash (dHash) of a frame.
+
+    Robust to re-encoding, resizing and mild compression, which is what a
+    re-shared copy of the same clip usually differs by.
+    """
+    grey = cv2.cvtColor(cv2.resize(frame, (9, 8), interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+    bits = (grey[:, 1:] > grey[:, :-1]).flatten()
+    return int("".join("1" if b else "0" for b in bits), 2)
@@ -0,0 +1,276 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+from google.adk.models.llm_response import LlmResponse
+
+from compaction import _budgets
+from schemas import SchemaError, parse_json_text
+from tracing import count
+
+load_dotenv()
+
+# Seconds a cached answer stays valid, per agent ("Agent=seconds,..."); unlisted agents are never cached
+LLM_CACHE_TTLS = _budgets(os.environ.get("ALERTX_LLM_CACHE_TTLS", "FinalReporter=900"))
+LLM_CACHE_ENTRIES = int(os.environ.get("ALERTX_LLM_CACHE_ENTRIES", 512))
+# Optional second tier shared across restarts / workers on the host; empty disables it
+LLM_CACHE_DIR = os.environ.get("ALERTX_LLM_CACHE_DIR", "")
+# Never cached even when listed in the TTLs: the alert agent writes the text of a
+# phone call about a live incident, and a replayed one would describe an older call
+NEVER_CACHE = {a.strip() for a in os.environ.get("ALERTX_LLM_CACHE_NEVER", "TwillioAgent").split(",") if a.strip()}
+# Expired disk entries are swept (in the background) every this many stores
+DISK_PRUNE_EVERY = 100
+# Incidents at these risk levels always get a fresh answer
+BYPASS_RISK = {r.strip().lower() for r in os.environ.get("ALERTX_LLM_CACHE_BYPASS_RISK", "Severe").split(",")
+               if r.strip()}
+
+
+def _canonical_text(text: str) -> str:
+    """Whitespace-insensitive text with every one-line JSON value re-serialised with sorted keys."""
+    lines = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line[:1] in "{[":
+            try:
+                line = json.dumps(json.loads(line), sort_keys=True, separators=(",", ":"))
+            except ValueError:
+                pass
+        if line:
+            lines.append(" ".join(line.split()))
+    return "\n".join(lines)
+
+
+def request_key(agent_name: str, llm_request):
+    """Cache key of a model request, or None when it must not be cached (media, tool traffic)."""
+    config = llm_request.config
+    instruction = config.system_instruction if config else None
+    if instruction is not None and not isinstance(instruction, str):
+        instruction = "".join(p.text or "" for p in (instruction.parts or []))
+    contents = []
+    for content in llm_request.contents or []:
+        for part in content.parts or []:
+            if part.inline_data or part.file_data or part.function_call or part.function_response:
+                return None
+            if part.text and not part.thought:
+                contents.append([content.role, _canonical_text(part.text)])
+    generation = {}
+    if config is not None:
+        generation = config.model_dump(mode="json", exclude_none=True,
+                                       exclude={"system_instruction", "tools", "http_options", "labels"})
+    tools = sorted(getattr(llm_request, "tools_dict", {}) or {})
+    instruction_hash = hashlib.sha256(_canonical_text(instruction or "").encode("utf-8")).hexdigest()
+    payload = json.dumps([agent_name, llm_request.model, instruction_hash, contents, generation, tools],
+                         sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LlmResponseCache:
+    """Response cache in front of model calls: in-process LRU, optional on-disk tier.
+
+    The key (:func:`request_key`) covers agent, model id, a hash of the
+    interpolated instruction and the canonicalised request text, so install
+    it after any callback that rewrites the request (e.g. context
+    compaction). A hit returns the stored final response from before_model,
+    skipping the model; misses are stored from after_model once the
+    response is final (after schema repair). Agents in :data:`NEVER_CACHE`,
+    requests carrying media or tool traffic and incidents whose
+    ``video_analysis`` risk level is in :data:`BYPASS_RISK` always go to
+    the model. The disk tier is best-effort: I/O errors are counted and the
+    request goes on as a miss.
+    """
+
+    def __init__(self, ttls: dict = None, max_entries: int = LLM_CACHE_ENTRIES, directory: str = LLM_CACHE_DIR):
+        self.ttls = LLM_CACHE_TTLS if ttls is None else ttls
+        self.max_entries = max_entries
+        self.directory = directory
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._entries = OrderedDict()  # key -> (expires_at, response json, generation seconds, tokens)
+        self._pending = {}  # (invocation id, agent name) -> (key, started_at)
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._pruning = False
+        self._stats = {"hits": 0, "disk_hits": 0, "misses": 0, "bypassed": 0, "stores": 0,
+                       "evictions": 0, "expirations": 0, "disk_errors": 0, "latency_saved_s": 0.0,
+                       "tokens_saved": 0}
+
+    def install(self, root_agent):
+        from callbacks import add_callback, walk_agents
+
+        for agent in walk_agents(root_agent):
+            if agent.name in self.ttls and agent.name not in NEVER_CACHE:
+                # before_model goes first so a hit skips the other callbacks' bookkeeping;
+                # install compaction afterwards (also first) so it still runs before us
+                add_callback(agent, "before_model_callback", self.before_model, first=True)
+                add_callback(agent, "after_model_callback", self.after_model)
+        return root_agent
+
+    # ---------- callbacks ----------
+    def before_model(self, callback_context, llm_request):
+        name = callback_context.agent_name
+        key = None if self._bypass(callback_context) else request_key(name, llm_request)
+        if key is None:
+            with self._lock:
+                self._stats["bypassed"] += 1
+            count("alertx_llm_cache_requests_total", agent=name, outcome="bypass")
+            return None
+        entry = self._get(key)
+        if entry is not None:
+            _, response, seconds, tokens = entry
+            with self._lock:
+                self._stats["hits"] += 1
+                self._stats["latency_saved_s"] += seconds
+                self._stats["tokens_saved"] += tokens
+            count("alertx_llm_cache_requests_total", agent=name, outcome="hit")
+            count("alertx_llm_cache_seconds_saved_total", seconds, agent=name)
+            cached = LlmResponse.model_validate_json(response)
+            cached.custom_metadata = {**(cached.custom_metadata or {}), "alertx_cache": "hit"}
+            return cached
+        with self._lock:
+            self._stats["misses"] += 1
+            self._pending[(callback_context.invocation_id, name)] = (key, time.perf_counter())
+        count("alertx_llm_cache_requests_total", agent=name, outcome="miss")
+        return None
+
+    def after_model(self, callback_context, llm_response):
+        if llm_response.partial:
+            return None
+        name = callback_context.agent_name
+        with self._lock:
+            pending = self._pending.pop((callback_context.invocation_id, name), None)
+        if pending is None or llm_response.error_code or not llm_response.content or not llm_response.content.parts:
+            return None
+        if any(p.function_call for p in llm_response.content.parts):
+            return None
+        key, started = pending
+        usage = llm_response.usage_metadata
+        tokens = (usage.total_token_count or 0) if usage else 0
+        stored = llm_response.model_copy(update={"usage_metadata": None})
+        self._put(key, time.time() + self.ttls[name], stored.model_dump_json(exclude_none=True),
+                  time.perf_counter() - started, tokens)
+        return None
+
+    def _bypass(self, callback_context) -> bool:
+        if not BYPASS_RISK:
+            return False
+        analysis = callback_context.state.get("video_analysis")
+        if isinstance(analysis, str):
+            try:
+                analysis = parse_json_text(analysis, [])
+            except SchemaError:
+                return False
+        risk = analysis.get("risk_level") if isinstance(analysis, dict) else None
+        return isinstance(risk, str) and risk.lower() in BYPASS_RISK
+
+    # ---------- tiers ----------
+    def _get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    return entry
+                del self._entries[key]
+                self._stats["expirations"] += 1
+        if not self.directory:
+            return None
+        path = os.path.join(self.directory, f"{key}.json")
+        try:
+            with open(path, "r", encoding="utf-8") as fh:
+                data = json.load(fh)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            self._disk_error()
+            return None
+        if data["expires_at"] <= now:
+            self._unlink(path)
+            return None
+        entry = (data["expires_at"], data["response"], data["seconds"], data["tokens"])
+        with self._lock:
+            self._stats["disk_hits"] += 1
+            self._remember(key, entry)
+        return entry
+
+    def _put(self, key, expires_at, response, seconds, tokens):
+        entry = (expires_at, response, seconds, tokens)
+        with self._lock:
+            self._stats["stores"] += 1
+            self._remember(key, entry)
+            self._writes += 1
+            prune = self.directory and self._writes % DISK_PRUNE_EVERY == 0 and not self._pruning
+            self._pruning = self._pruning or bool(prune)
+        if not self.directory:
+            return
+        path = os.path.join(self.directory, f"{key}.json")
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as fh:
+                json.dump({"expires_at": expires_at, "response": response, "seconds": seconds, "tokens": tokens}, fh)
+            os.utime(tmp, (expires_at, expires_at))  # mtime = expiry, so pruning needs no reads
+            os.replace(tmp, path)  # atomic: readers in other processes never see half a file
+        except OSError as e:
+            self._unlink(tmp)
+            self._disk_error(e)
+        if prune:
+            threading.Thread(target=self._prune_disk, name="alertx-llm-cache-prune", daemon=True).start()
+
+    def _disk_error(self, error=None):
+        with self._lock:
+            self._stats["disk_errors"] += 1
+            first = self._stats["disk_errors"] == 1
+        count("alertx_llm_cache_disk_errors_total")
+        if first and error is not None:
+            print(f"LLM cache disk tier failed ({error}); continuing with memory only until it recovers")
+
+    def _remember(self, key, entry):
+        # caller holds the lock
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def _prune_disk(self):
+        # Runs on its own thread; entries carry their expiry as mtime
+        now = time.time()
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    try:
+                        expired = entry.name.endswith(".json") and entry.stat().st_mtime <= now
+                    except FileNotFoundError:  # replaced or pruned by another process
+                        continue
+                    if expired:
+                        self._unlink(entry.path)
+        except OSError as e:
+            self._disk_error(e)
+        finally:
+            with self._lock:
+                self._pruning = False
+
+    @staticmethod
+    def _unlink(path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {**self._stats, "latency_saved_s": round(self._stats["latency_saved_s"], 3),
+                    "hit_rate": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+                    "entries": len(self._entries), "max_entries": self.max_entries}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+LLM_CACHE = LlmResponseCache()
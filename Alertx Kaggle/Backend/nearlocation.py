@@ -1,83 +1,48 @@
-import requests
+from placequery import CATEGORY_MAP, find_places
+from places import DEFAULT_TAGS, PlaceBatch, record_payload_size
 
 # ------------------------------------------
-# 1. Define your categories + their amenities
+# 1. Categories + their amenities live in placequery.CATEGORY_MAP
 # ------------------------------------------
-CATEGORY_MAP = {
-    "food": ["restaurant", "fast_food", "cafe", "bar"],
-    "healthcare": ["hospital", "clinic", "pharmacy"],
-    "emergency": ["police", "fire_station", "ambulance_station"],
-    "finance": ["bank", "atm"],
-    "education": ["school", "college", "university"],
-    "transport": ["bus_station", "train_station", "airport"],
-    "shopping": ["supermarket", "convenience", "mall"],
-}
+GROUP_TOP_K = 10
 
-def get_nearby_places_grouped(lat: float, lon: float, radius: int = 5000):
-    """Return nearby places grouped by categories."""
+def get_nearby_places_grouped(lat: float, lon: float, radius: int = 5000, tags: list = None):
+    """Return nearby places grouped by categories, each as compact columns.
 
-    # Build regex from all amenities across categories
+    Only the ``tags`` asked for (default: the address tags) are kept per place;
+    a sample of calls records the bytes saved against full raw tags in /metrics.
+    """
+
+    # All amenities across categories
     all_amenities = []
     for a_list in CATEGORY_MAP.values():
         all_amenities.extend(a_list)
 
-    amenity_regex = "|".join(all_amenities)
-    overpass_url = "https://overpass-api.de/api/interpreter"
-
-    query = f"""
-    [out:json][timeout:15];
-    (
-      node["amenity"~"{amenity_regex}"](around:{radius},{lat},{lon});
-      way["amenity"~"{amenity_regex}"](around:{radius},{lat},{lon});
-      relation["amenity"~"{amenity_regex}"](around:{radius},{lat},{lon});
-    );
-    out center;
-    """
-
     try:
-        res = requests.post(overpass_url, data={"data": query}, timeout=20)
-        data = res.json()
-
-        # Category-wise result container
+        # Category-wise positions into the parsed list
         grouped = {category: [] for category in CATEGORY_MAP.keys()}
 
-        for el in data.get("elements", []):
-            tags = el.get("tags", {})
-            amenity = tags.get("amenity")
-
-            # Determine which category this amenity belongs to
-            category = None
-            for cat_name, items in CATEGORY_MAP.items():
-                if amenity in items:
-                    category = cat_name
-                    break
+        parsed = find_places(lat, lon, radius, all_amenities)
+        batch = PlaceBatch.from_parsed(parsed, DEFAULT_TAGS if tags is None else tags)
+        for i, source in enumerate(batch.source):
+            # Category comes from the precomputed amenity → category map
+            category = parsed[source]["category"]
             if not category:
                 continue  # ignore unmatched
+            grouped[category].append(i)
 
-            # Extract coordinates
-            lat_val = el.get("lat") or el.get("center", {}).get("lat")
-            lon_val = el.get("lon") or el.get("center", {}).get("lon")
-
-            # Build place object
-            place = {
-                "name": tags.get("name", "Unnamed"),
-                "type": amenity,
-                "lat": lat_val,
-                "lon": lon_val,
-                "address": {
-                    "street": tags.get("addr:street"),
-                    "housenumber": tags.get("addr:housenumber"),
-                    "city": tags.get("addr:city"),
-                },
-                "raw_tags": tags
-            }
-
-            grouped[category].append(place)
-
-        return grouped
+        # Keep the nearest few per category, each with its real distance
+        nearest = {
+            category: batch.take(members).nearest(lat, lon, GROUP_TOP_K)
+            for category, members in grouped.items()
+        }
+        result = {category: places.to_columns() for category, places in nearest.items()}
+        record_payload_size("get_nearby_places_grouped", result, parsed, nearest.values())
+        return result
 
     except Exception as e:
         return {"error": str(e)}
 
 
-print(get_nearby_places_grouped(12.8936556,77.7108574))
\ No newline at end of file
+if __name__ == "__main__":
+    print(get_nearby_places_grouped(12.8936556,77.7108574))
\ No newline at end of file
@@ -0,0 +1,371 @@
+import heapq
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+import threading
+
+import requests
+from dotenv import load_dotenv
+
+from placecache import EARTH_RADIUS_KM, PLACE_CACHE, element_latlon
+
+load_dotenv()
+
+# ------------------------------------------
+# File layout (little endian, every block 8-byte aligned)
+#
+#   header        8s magic | I version | I reserved | Q count | Q amenity_table_len
+#   amenity table JSON array of amenity strings, code = position
+#   coords        count * 3 float64   unit-sphere x, y, z in KD-tree order
+#   codes         count * uint16      amenity code of each point
+#   offsets       (count + 1) uint64  byte offsets into the element blob
+#   elements      one compact JSON Overpass element per point
+#
+# Points are stored as a packed (implicit) KD-tree: the node of the range
+# [lo, hi) sits at (lo + hi) // 2 and splits on axis depth % 3. Working on
+# unit vectors makes the Euclidean chord monotonic with great-circle
+# distance, so the tree needs no special handling near the poles or the
+# antimeridian.
+# ------------------------------------------
+MAGIC = b"ALXKDT01"
+VERSION = 1
+_HEADER = struct.Struct("<8sIIQQ")
+
+# With nothing inside the requested radius, the index answers with the nearest
+# few facilities up to this far away instead of an empty list
+FALLBACK_K = int(os.environ.get("ALERTX_OSM_FALLBACK_K", 5))
+FALLBACK_RADIUS_M = int(os.environ.get("ALERTX_OSM_FALLBACK_RADIUS", 50000))
+
+
+def _pad8(n: int) -> int:
+    return (n + 7) & ~7
+
+
+def _unit_vector(lat: float, lon: float):
+    phi, lam = math.radians(lat), math.radians(lon)
+    cos_phi = math.cos(phi)
+    return (cos_phi * math.cos(lam), cos_phi * math.sin(lam), math.sin(phi))
+
+
+def _chord_for_km(distance_km: float) -> float:
+    angle = min(math.pi, distance_km / EARTH_RADIUS_KM)
+    return 2 * math.sin(angle / 2)
+
+
+def _km_for_chord(chord: float) -> float:
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, chord / 2))
+
+
+# ------------------------------------------
+# Loading OSM data
+# ------------------------------------------
+def load_overpass_json(path: str):
+    """Read the elements of a saved Overpass ``[out:json]`` response."""
+    with open(path, "r", encoding="utf-8") as fh:
+        return json.load(fh).get("elements", [])
+
+
+def load_pbf(path: str):
+    """Read amenity nodes/ways/relations from an ``.osm.pbf`` extract.
+
+    Requires the optional ``osmium`` package (pyosmium). Ways and relations are
+    reduced to the centre of their node locations, mirroring ``out center``.
+    """
+    try:
+        import osmium
+    except ImportError as e:
+        raise ImportError("Reading .osm.pbf extracts requires `pip install osmium`") from e
+
+    elements = []
+
+    def _centre(locations):
+        locations = [l for l in locations if l.valid()]
+        if not locations:
+            return None
+        return {
+            "lat": sum(l.lat for l in locations) / len(locations),
+            "lon": sum(l.lon for l in locations) / len(locations),
+        }
+
+    class _Handler(osmium.SimpleHandler):
+        def node(self, n):
+            if "amenity" in n.tags and n.location.valid():
+                elements.append({"type": "node", "id": n.id, "lat": n.location.lat,
+                                 "lon": n.location.lon, "tags": dict(n.tags)})
+
+        def way(self, w):
+            if "amenity" in w.tags:
+                centre = _centre([nd.location for nd in w.nodes])
+                if centre:
+                    elements.append({"type": "way", "id": w.id, "center": centre, "tags": dict(w.tags)})
+
+        def area(self, a):
+            # Multipolygon relations only; closed ways were handled in way()
+            if "amenity" in a.tags and not a.from_way():
+                locations = [nd.location for ring in a.outer_rings() for nd in ring]
+                centre = _centre(locations)
+                if centre:
+                    elements.append({"type": "relation", "id": a.orig_id(), "center": centre,
+                                     "tags": dict(a.tags)})
+
+    _Handler().apply_file(path, locations=True)
+    return elements
+
+
+def load_elements(path: str):
+    """Load amenity elements from a ``.pbf`` extract or an Overpass JSON dump."""
+    if path.endswith(".pbf"):
+        return load_pbf(path)
+    return load_overpass_json(path)
+
+
+# ------------------------------------------
+# Building
+# ------------------------------------------
+def build_index(elements, index_path: str) -> int:
+    """Write ``elements`` (Overpass-shaped dicts) to a packed KD-tree file.
+
+    The file is written next to ``index_path`` and swapped in atomically so a
+    running process can keep serving from the old one until it reopens.
+    Returns the number of indexed points.
+    """
+    points = []
+    for el in elements:
+        amenity = el.get("tags", {}).get("amenity")
+        lat, lon = element_latlon(el)
+        if amenity and lat is not None and lon is not None:
+            points.append((_unit_vector(lat, lon), el))
+
+    order = [None] * len(points)
+
+    def _place(items, lo, hi, depth):
+        if lo >= hi:
+            return
+        axis = depth % 3
+        items.sort(key=lambda p: p[0][axis])
+        mid = (lo + hi) // 2
+        split = mid - lo
+        order[mid] = items[split]
+        _place(items[:split], lo, mid, depth + 1)
+        _place(items[split + 1:], mid + 1, hi, depth + 1)
+
+    _place(points, 0, len(points), 0)
+
+    amenities = sorted({el["tags"]["amenity"] for _, el in order})
+    codes = {a: i for i, a in enumerate(amenities)}
+    table = json.dumps(amenities, separators=(",", ":")).encode("utf-8")
+
+    blobs = [json.dumps(el, separators=(",", ":"), ensure_ascii=False).encode("utf-8") for _, el in order]
+    offsets = [0]
+    for blob in blobs:
+        offsets.append(offsets[-1] + len(blob))
+
+    n = len(order)
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, "wb") as fh:
+        fh.write(_HEADER.pack(MAGIC, VERSION, 0, n, len(table)))
+        fh.write(table.ljust(_pad8(len(table)), b" "))
+        fh.write(struct.pack(f"<{3 * n}d", *(c for xyz, _ in order for c in xyz)))
+        codes_block = struct.pack(f"<{n}H", *(codes[el["tags"]["amenity"]] for _, el in order))
+        fh.write(codes_block.ljust(_pad8(len(codes_block)), b"\0"))
+        fh.write(struct.pack(f"<{n + 1}Q", *offsets))
+        for blob in blobs:
+            fh.write(blob)
+    os.replace(tmp_path, index_path)
+    return n
+
+
+def refresh_from_overpass(bbox, index_path: str, timeout: int = 180) -> int:
+    """Rebuild the index from Overpass for ``bbox`` = (south, west, north, east).
+
+    This is the only place the offline index touches the network.
+    """
+    south, west, north, east = bbox
+    query = f"""
+    [out:json][timeout:{timeout}];
+    (
+      node["amenity"]({south},{west},{north},{east});
+      way["amenity"]({south},{west},{north},{east});
+      relation["amenity"]({south},{west},{north},{east});
+    );
+    out center;
+    """
+    r = requests.post("https://overpass-api.de/api/interpreter", data={"data": query}, timeout=timeout + 20)
+    return build_index(r.json().get("elements", []), index_path)
+
+
+# ------------------------------------------
+# Querying
+# ------------------------------------------
+class FacilityIndex:
+    """Read-only, memory-mapped view of an index written by :func:`build_index`."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+        self._fh = open(path, "rb")
+        self._mm = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, n, table_len = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{path} is not an AlertX facility index")
+        self.count = n
+
+        pos = _HEADER.size
+        self.amenities = json.loads(bytes(self._mm[pos:pos + table_len]))
+        self._codes_by_amenity = {a: i for i, a in enumerate(self.amenities)}
+        pos += _pad8(table_len)
+
+        view = memoryview(self._mm)
+        self._coords = view[pos:pos + 24 * n].cast("d")
+        pos += 24 * n
+        self._codes = view[pos:pos + 2 * n].cast("H")
+        pos += _pad8(2 * n)
+        self._offsets = view[pos:pos + 8 * (n + 1)].cast("Q")
+        pos += 8 * (n + 1)
+        self._blob_start = pos
+
+    def close(self):
+        for attr in ("_coords", "_codes", "_offsets"):
+            view = getattr(self, attr, None)
+            if view is not None:
+                view.release()
+        self._mm.close()
+        self._fh.close()
+
+    def element(self, i: int) -> dict:
+        start = self._blob_start + self._offsets[i]
+        end = self._blob_start + self._offsets[i + 1]
+        return json.loads(self._mm[start:end])
+
+    def _wanted_codes(self, amenities):
+        if amenities is None:
+            return None
+        return {self._codes_by_amenity[a] for a in amenities if a in self._codes_by_amenity}
+
+    def query_radius(self, lat: float, lon: float, radius: int, amenities=None):
+        """Elements within ``radius`` metres of (lat, lon), optionally filtered by amenity."""
+        wanted = self._wanted_codes(amenities)
+        if wanted is not None and not wanted:
+            return []
+        q = _unit_vector(lat, lon)
+        r = _chord_for_km(radius / 1000)
+        r2 = r * r
+        coords, codes = self._coords, self._codes
+        hits = []
+        stack = [(0, self.count, 0)]
+        while stack:
+            lo, hi, depth = stack.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            base = 3 * mid
+            dx = q[0] - coords[base]
+            dy = q[1] - coords[base + 1]
+            dz = q[2] - coords[base + 2]
+            if dx * dx + dy * dy + dz * dz <= r2 and (wanted is None or codes[mid] in wanted):
+                hits.append(mid)
+            axis = depth % 3
+            diff = (dx, dy, dz)[axis]
+            near, far = ((mid + 1, hi), (lo, mid)) if diff > 0 else ((lo, mid), (mid + 1, hi))
+            if diff * diff <= r2:
+                stack.append((far[0], far[1], depth + 1))
+            stack.append((near[0], near[1], depth + 1))
+        return [self.element(i) for i in hits]
+
+    def nearest(self, lat: float, lon: float, k: int = 10, amenities=None, max_radius: int = None):
+        """The ``k`` nearest elements to (lat, lon) as ``(distance_km, element)`` pairs."""
+        wanted = self._wanted_codes(amenities)
+        if k <= 0 or (wanted is not None and not wanted):
+            return []
+        q = _unit_vector(lat, lon)
+        bound = _chord_for_km(max_radius / 1000) ** 2 if max_radius else float("inf")
+        coords, codes = self._coords, self._codes
+        best = []  # max-heap of (-d2, index)
+        stack = [(0, self.count, 0)]
+        while stack:
+            lo, hi, depth = stack.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            base = 3 * mid
+            dx = q[0] - coords[base]
+            dy = q[1] - coords[base + 1]
+            dz = q[2] - coords[base + 2]
+            d2 = dx * dx + dy * dy + dz * dz
+            if d2 <= bound and (wanted is None or codes[mid] in wanted):
+                if len(best) < k:
+                    heapq.heappush(best, (-d2, mid))
+                elif d2 < -best[0][0]:
+                    heapq.heapreplace(best, (-d2, mid))
+                if len(best) == k:
+                    bound = -best[0][0]
+            axis = depth % 3
+            diff = (dx, dy, dz)[axis]
+            near, far = ((mid + 1, hi), (lo, mid)) if diff > 0 else ((lo, mid), (mid + 1, hi))
+            # Push far first so the near side is explored (and tightens the bound) first
+            if diff * diff <= bound:
+                stack.append((far[0], far[1], depth + 1))
+            stack.append((near[0], near[1], depth + 1))
+        return [(_km_for_chord(math.sqrt(-neg)), self.element(i)) for neg, i in sorted(best, reverse=True)]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """The index named by ``ALERTX_OSM_INDEX``, reopened when the file changes; None if unset."""
+    global _index
+    path = os.environ.get("ALERTX_OSM_INDEX")
+    if not path or not os.path.exists(path):
+        return None
+    with _index_lock:
+        if _index is None or _index.path != path or _index.mtime != os.path.getmtime(path):
+            # The old mapping is left for the garbage collector: a concurrent
+            # query may still be reading from it.
+            _index = FacilityIndex(path)
+        return _index
+
+
+def _from_index(index, lat, lon, radius, amenities):
+    elements = index.query_radius(lat, lon, radius, amenities)
+    if elements or FALLBACK_K <= 0:
+        return elements
+    fallback = index.nearest(lat, lon, FALLBACK_K, amenities, max(radius, FALLBACK_RADIUS_M))
+    return [el for _, el in fallback]
+
+
+def nearby_elements(lat: float, lon: float, radius: int, amenities, fetch):
+    """Elements around (lat, lon) from the offline index, or via the Overpass cache without one.
+
+    The index falls back to the nearest ``FALLBACK_K`` facilities when none is within ``radius``.
+    """
+    index = get_index()
+    if index is not None:
+        return _from_index(index, lat, lon, radius, amenities)
+    return PLACE_CACHE.lookup(lat, lon, radius, amenities, fetch)
+
+
+async def nearby_elements_async(lat: float, lon: float, radius: int, amenities, fetch):
+    """:func:`nearby_elements` with an async ``fetch`` (the index itself is a quick in-memory search)."""
+    index = get_index()
+    if index is not None:
+        return _from_index(index, lat, lon, radius, amenities)
+    return await PLACE_CACHE.lookup_async(lat, lon, radius, amenities, fetch)
+
+
+if __name__ == "__main__":
+    # python osmindex.py build <extract.osm.pbf | overpass.json> <index.bin>
+    # python osmindex.py refresh <south,west,north,east> <index.bin>
+    if len(sys.argv) != 4 or sys.argv[1] not in ("build", "refresh"):
+        print("usage: osmindex.py build <extract.osm.pbf|overpass.json> <index> | refresh <s,w,n,e> <index>")
+        sys.exit(2)
+    if sys.argv[1] == "build":
+        count = build_index(load_elements(sys.argv[2]), sys.argv[3])
+    else:
+        count = refresh_from_overpass([float(v) for v in sys.argv[2].split(",")], sys.argv[3])
+    print(f"Indexed {count} facilities → {sys.argv[3]}")
@@ -0,0 +1,288 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DEFAULT_MIRRORS = (
+    "https://overpass-api.de/api/interpreter,"
+    "https://overpass.kumi.systems/api/interpreter,"
+    "https://overpass.private.coffee/api/interpreter"
+)
+OVERPASS_MIRRORS = [u.strip() for u in os.environ.get("ALERTX_OVERPASS_MIRRORS", DEFAULT_MIRRORS).split(",") if u.strip()]
+# Hedge to another mirror once the primary is slower than this percentile of its recent latencies
+HEDGE_PERCENTILE = float(os.environ.get("ALERTX_OVERPASS_HEDGE_PERCENTILE", 0.9))
+HEDGE_MIN_DELAY = float(os.environ.get("ALERTX_OVERPASS_HEDGE_MIN_S", 0.3))
+REQUEST_TIMEOUT = float(os.environ.get("ALERTX_OVERPASS_TIMEOUT_S", 20))
+MAX_CONNECTIONS = int(os.environ.get("ALERTX_OVERPASS_MAX_CONNECTIONS", 20))
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class OverpassError(RuntimeError):
+    pass
+
+
+class QueryRejected(ValueError):
+    """Overpass refused the query itself (4xx); retrying elsewhere will not help."""
+
+
+class CircuitBreaker:
+    """Closed → open after ``failure_threshold`` consecutive failures; one trial request after ``reset_after``."""
+
+    def __init__(self, failure_threshold: int = 5, reset_after: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.reset_after else "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._trial:
+            self._trial = True  # exactly one probe until it reports back
+            return True
+        return False
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+
+    def release(self):
+        """A probe was abandoned (cancelled) without an outcome."""
+        self._trial = False
+
+    def failure(self):
+        self.failures += 1
+        self._trial = False
+        if self.failures >= self.failure_threshold or self.opened_at is not None:
+            self.opened_at = time.monotonic()
+
+
+class RetryBudget:
+    """Retries (and hedges) may add at most ``ratio`` extra load on top of first attempts.
+
+    Every first attempt deposits ``ratio`` tokens, every retry or hedge
+    withdraws one; ``min_tokens`` are there from the start so a cold process
+    can still retry.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_tokens: float = 3.0, max_tokens: float = 20.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = min_tokens
+
+    def deposit(self):
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class Mirror:
+    def __init__(self, url: str, breaker: CircuitBreaker):
+        self.url = url
+        self.breaker = breaker
+        self.latencies = deque(maxlen=200)
+        self.requests = self.failures = 0
+        self.error_rate = 0.0  # EWMA of failed attempts
+
+    def record(self, failed: bool):
+        self.error_rate = 0.8 * self.error_rate + (0.2 if failed else 0.0)
+
+    def percentile(self, q: float, default: float) -> float:
+        if len(self.latencies) < 10:
+            return default
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class OverpassClient:
+    """Shared async Overpass client: keep-alive pool, mirrors, hedging, breakers, retry budget.
+
+    A request goes to the healthiest mirror. If it has not answered after the
+    mirror's ``hedge_percentile`` latency, the same query goes to the next
+    mirror and the first good answer wins. Failures (timeouts, 429/5xx,
+    answers carrying a runtime-error remark) retry on another mirror while the retry budget allows. All I/O runs on
+    one background event loop, so the connection pool survives the
+    short-lived loops of sync callers; use :meth:`query_sync` from threads.
+    """
+
+    def __init__(self, mirrors=None, hedge_percentile: float = HEDGE_PERCENTILE,
+                 hedge_min_delay: float = HEDGE_MIN_DELAY, timeout: float = REQUEST_TIMEOUT,
+                 max_connections: int = MAX_CONNECTIONS, failure_threshold: int = 5, reset_after: float = 30.0):
+        self.mirrors = [Mirror(url, CircuitBreaker(failure_threshold, reset_after)) for url in (mirrors or OVERPASS_MIRRORS)]
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.budget = RetryBudget()
+        self._stats = {"queries": 0, "hedges": 0, "hedge_wins": 0, "retries": 0, "budget_exhausted": 0, "failed": 0}
+        self._loop = None
+        self._client = None
+        self._start_lock = threading.Lock()
+
+    # ---------- event loop ----------
+    def _ensure_loop(self):
+        with self._start_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="alertx-overpass", daemon=True).start()
+                self._loop = loop
+        return self._loop
+
+    def _http(self) -> httpx.AsyncClient:
+        if self._client is None:
+            limits = httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections,
+                                  keepalive_expiry=60)
+            self._client = httpx.AsyncClient(limits=limits, timeout=self.timeout, http2=False)
+        return self._client
+
+    def query_sync(self, ql: str) -> dict:
+        """Blocking :meth:`query` for worker threads and sync tools."""
+        return asyncio.run_coroutine_threadsafe(self.query(ql), self._ensure_loop()).result()
+
+    async def query_async(self, ql: str) -> dict:
+        """:meth:`query` from any event loop (always executed on the client's own loop)."""
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self.query(ql), self._ensure_loop()))
+
+    # ---------- requests ----------
+    def _candidates(self):
+        usable = [m for m in self.mirrors if m.breaker.state != "open"]
+        # Prefer closed breakers, then mirrors that rarely fail, then the fastest lately
+        return sorted(usable, key=lambda m: (m.breaker.state != "closed", round(m.error_rate, 1), m.percentile(0.5, 0.0)))
+
+    async def _attempt(self, mirror: Mirror, ql: str):
+        mirror.requests += 1
+        start = time.perf_counter()
+        try:
+            r = await self._http().post(mirror.url, data={"data": ql})
+        except asyncio.CancelledError:
+            # Lost a hedge race: it was at least this slow, which the hedge delay should know
+            mirror.latencies.append(time.perf_counter() - start)
+            mirror.breaker.release()
+            raise
+        except httpx.HTTPError as e:
+            self._failed(mirror)
+            raise OverpassError(f"{type(e).__name__}: {e}") from e
+        if r.status_code in RETRYABLE_STATUS:
+            self._failed(mirror)
+            raise OverpassError(f"HTTP {r.status_code}")
+        if r.status_code >= 400:
+            mirror.breaker.success()  # the mirror is fine; the query is not
+            raise QueryRejected(f"Overpass rejected the query ({r.status_code}): {r.text[:200]}")
+        try:
+            data = r.json()
+        except ValueError:
+            self._failed(mirror)
+            raise OverpassError("invalid JSON") from None
+        # A query that times out or runs out of memory mid-way still answers 200,
+        # with whatever it had so far and a remark; that partial set must not be used
+        remark = data.get("remark") or ""
+        if "runtime error" in remark:
+            self._failed(mirror)
+            raise OverpassError(remark[:200])
+        mirror.latencies.append(time.perf_counter() - start)
+        mirror.record(False)
+        mirror.breaker.success()
+        return data, len(r.content)
+
+    @staticmethod
+    def _failed(mirror: Mirror):
+        mirror.failures += 1
+        mirror.record(True)
+        mirror.breaker.failure()
+
+    async def query(self, ql: str) -> dict:
+        """Run ``ql`` and return ``{"elements": [...], "_bytes": n, "_mirror": url}``."""
+        self._stats["queries"] += 1
+        self.budget.deposit()
+        pending = {}  # task -> mirror
+        tried = set()
+        hedges = set()
+        errors = []
+
+        def launch():
+            for mirror in self._candidates():
+                if mirror.url not in tried and mirror.breaker.allow():
+                    tried.add(mirror.url)
+                    pending[asyncio.ensure_future(self._attempt(mirror, ql))] = mirror
+                    return mirror
+            return None
+
+        primary = launch()
+        if primary is None:
+            raise OverpassError("All Overpass mirrors are unavailable (circuit open)")
+        hedge_at = time.monotonic() + max(self.hedge_min_delay,
+                                          primary.percentile(self.hedge_percentile, self.hedge_min_delay * 4))
+        try:
+            while pending:
+                wait = hedge_at - time.monotonic() if hedge_at else None
+                done, _ = await asyncio.wait(pending, timeout=max(0, wait) if wait is not None else None,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:  # primary is slow: hedge once, if the budget allows
+                    hedge_at = None
+                    if not self.budget.withdraw():
+                        self._stats["budget_exhausted"] += 1
+                    else:
+                        hedge = launch()
+                        if hedge is not None:
+                            hedges.add(hedge.url)
+                            self._stats["hedges"] += 1
+                    continue
+                for task in done:
+                    mirror = pending.pop(task)
+                    try:
+                        data, size = task.result()
+                    except QueryRejected:
+                        raise
+                    except OverpassError as e:
+                        errors.append(f"{mirror.url}: {e}")
+                        if not pending:  # nothing else in flight: retry elsewhere
+                            if not self.budget.withdraw():
+                                self._stats["budget_exhausted"] += 1
+                            elif launch():
+                                self._stats["retries"] += 1
+                        continue
+                    if mirror.url in hedges:
+                        self._stats["hedge_wins"] += 1
+                    data["_bytes"] = size
+                    data["_mirror"] = mirror.url
+                    return data
+        finally:
+            for task in pending:
+                task.cancel()
+        self._stats["failed"] += 1
+        raise OverpassError("Overpass query failed: " + "; ".join(errors))
+
+    def stats(self) -> dict:
+        return {
+            **self._stats,
+            "retry_tokens": round(self.budget.tokens, 2),
+            "mirrors": [
+                {"url": m.url, "state": m.breaker.state, "requests": m.requests, "failures": m.failures,
+                 "error_rate": round(m.error_rate, 3),
+                 "p50_ms": round(m.percentile(0.5, 0) * 1000, 1), "p95_ms": round(m.percentile(0.95, 0) * 1000, 1)}
+                for m in self.mirrors
+            ],
+        }
+
+
+OVERPASS = OverpassClient()
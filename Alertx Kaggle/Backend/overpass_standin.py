@@ -0,0 +1,99 @@
+"""Local stand-in for an Overpass mirror, with injectable latency and failures.
+
+    python overpass_standin.py --port 8101 --latency-ms 80 --slow-rate 0.1 --slow-ms 3000 --fail-rate 0.05
+
+Answers every POST with the elements of a bench fixture (``--fixture``), so
+the client, hedging and circuit breakers can be exercised without network:
+
+    ALERTX_OVERPASS_MIRRORS=http://127.0.0.1:8101,http://127.0.0.1:8102 python app.py
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_fixtures")
+
+
+class Behaviour:
+    def __init__(self, latency_ms=50.0, slow_rate=0.0, slow_ms=2000.0, fail_rate=0.0, fail_status=503, remark=None):
+        self.latency_ms = latency_ms
+        self.slow_rate = slow_rate
+        self.slow_ms = slow_ms
+        self.fail_rate = fail_rate
+        self.fail_status = fail_status
+        self.remark = remark  # e.g. "runtime error: Query timed out" on an otherwise good 200
+        self.requests = 0
+
+
+def _handler(body: bytes, behaviour: Behaviour):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, like the real mirrors
+        disable_nagle_algorithm = True
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            behaviour.requests += 1
+            delay = behaviour.latency_ms * random.uniform(0.8, 1.2)
+            if random.random() < behaviour.slow_rate:
+                delay += behaviour.slow_ms
+            time.sleep(delay / 1000)
+            if random.random() < behaviour.fail_rate:
+                payload, status = b'{"error": "injected failure"}', behaviour.fail_status
+            elif behaviour.remark:
+                payload, status = body[:-1] + b', "remark": ' + json.dumps(behaviour.remark).encode() + b"}", 200
+            else:
+                payload, status = body, 200
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            try:
+                self.wfile.write(payload)
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # the client hedged and hung up
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def start_standin(port: int = 0, fixture: str = "small", **behaviour):
+    """Serve in a daemon thread; returns ``(server, url, behaviour)``. ``port=0`` picks a free port."""
+    with gzip.open(os.path.join(FIXTURE_DIR, f"{fixture}.json.gz"), "rb") as fh:
+        body = json.dumps({"version": 0.6, "generator": "alertx-standin", **json.load(fh)}).encode("utf-8")
+    state = Behaviour(**behaviour)
+    server = ThreadingHTTPServer(("127.0.0.1", port), _handler(body, state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/api/interpreter", state
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8101)
+    parser.add_argument("--fixture", default="small")
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="share of requests that get --slow-ms extra")
+    parser.add_argument("--slow-ms", type=float, default=2000)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--fail-status", type=int, default=503)
+    parser.add_argument("--remark", help="remark added to every answer, e.g. 'runtime error: Query timed out'")
+    args = parser.parse_args()
+    server, url, _ = start_standin(args.port, args.fixture, latency_ms=args.latency_ms, slow_rate=args.slow_rate,
+                                   slow_ms=args.slow_ms, fail_rate=args.fail_rate, fail_status=args.fail_status,
+                                   remark=args.remark)
+    print(f"Overpass stand-in on {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+import asyncio
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import CancelledError, Future
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# ------------------------------------------
+# Geohash helpers
+# ------------------------------------------
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+EARTH_RADIUS_KM = 6371.0088
+
+
+def geohash_encode(lat: float, lon: float, precision: int = 6) -> str:
+    """Encode a coordinate into a geohash string of the given precision."""
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    chars = []
+    bit, ch, even = 0, 0, True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_lo + lon_hi) / 2
+            if lon >= mid:
+                ch = (ch << 1) | 1
+                lon_lo = mid
+            else:
+                ch <<= 1
+                lon_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if lat >= mid:
+                ch = (ch << 1) | 1
+                lat_lo = mid
+            else:
+                ch <<= 1
+                lat_hi = mid
+        even = not even
+        bit += 1
+        if bit == 5:
+            chars.append(_BASE32[ch])
+            bit, ch = 0, 0
+    return "".join(chars)
+
+
+def geohash_bbox(geohash: str):
+    """Return (lat_min, lat_max, lon_min, lon_max) of a geohash cell."""
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    even = True
+    for c in geohash:
+        cd = _BASE32.index(c)
+        for mask in (16, 8, 4, 2, 1):
+            if even:
+                mid = (lon_lo + lon_hi) / 2
+                if cd & mask:
+                    lon_lo = mid
+                else:
+                    lon_hi = mid
+            else:
+                mid = (lat_lo + lat_hi) / 2
+                if cd & mask:
+                    lat_lo = mid
+                else:
+                    lat_hi = mid
+            even = not even
+    return lat_lo, lat_hi, lon_lo, lon_hi
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance between two coordinates in kilometres."""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def element_latlon(el: dict):
+    """Coordinates of an Overpass element (nodes carry lat/lon, ways/relations a center)."""
+    center = el.get("center", {})
+    return (el.get("lat") or center.get("lat"), el.get("lon") or center.get("lon"))
+
+
+# ------------------------------------------
+# Tile cache
+# ------------------------------------------
+class PlaceTileCache:
+    """TTL + LRU cache of Overpass elements keyed by geohash tile, radius and amenity set.
+
+    A miss fetches every element within ``radius`` of the *tile centre* plus the
+    tile's half-diagonal, so any later query whose point lies in (or near) that
+    tile and whose circle fits inside the fetched one is answered by filtering
+    the cached elements locally instead of calling Overpass again.
+
+    Concurrent misses for the same tile share one fetch, and empty answers are
+    only kept for ``negative_ttl`` so a flaky mirror cannot blank a tile for long.
+    """
+
+    def __init__(self, ttl: float = 900, max_bytes: int = 32 * 1024 * 1024, precision: int = 6,
+                 negative_ttl: float = 60):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_bytes = max_bytes
+        self.precision = precision
+        # key -> (expires_at, center_lat, center_lon, radius_m, amenities, elements, size)
+        self._entries = OrderedDict()
+        self._by_tile = {}
+        self._inflight = {}  # (tile, radius, amenities) -> Future of the entry being fetched
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.coalesced = 0
+
+    def lookup(self, lat: float, lon: float, radius: int, amenities, fetch):
+        """Return the elements within ``radius`` metres of (lat, lon) matching ``amenities``.
+
+        Args:
+            lat, lon: Query point.
+            radius: Query radius in metres.
+            amenities: Iterable of OSM amenity values the caller wants.
+            fetch: ``fetch(lat, lon, radius, amenities) -> list[element]`` used on a miss.
+        """
+        wanted = frozenset(amenities)
+        tile, entry = self._probe(lat, lon, radius, wanted)
+        while entry is None:
+            c_lat, c_lon, fetch_radius = self._fetch_circle(tile, radius)
+            key = (tile, fetch_radius, wanted)
+            future, leader = self._claim(key)
+            if not leader:
+                try:
+                    entry = future.result()
+                except CancelledError:
+                    pass  # the fetching caller gave up; try again ourselves
+                continue
+            try:
+                elements = fetch(c_lat, c_lon, fetch_radius, sorted(wanted))
+                entry = self._store(tile, c_lat, c_lon, fetch_radius, wanted, elements)
+            except BaseException as e:
+                self._settle(key, future, error=e)
+                raise
+            self._settle(key, future, entry)
+        return self._filter(entry, lat, lon, radius, wanted)
+
+    async def lookup_async(self, lat: float, lon: float, radius: int, amenities, fetch):
+        """:meth:`lookup` for event loops: ``fetch`` is a coroutine function with the same arguments."""
+        wanted = frozenset(amenities)
+        tile, entry = self._probe(lat, lon, radius, wanted)
+        while entry is None:
+            c_lat, c_lon, fetch_radius = self._fetch_circle(tile, radius)
+            key = (tile, fetch_radius, wanted)
+            future, leader = self._claim(key)
+            if not leader:
+                try:
+                    # shield: our own cancellation must not cancel the shared fetch
+                    entry = await asyncio.shield(asyncio.wrap_future(future))
+                except asyncio.CancelledError:
+                    if not future.cancelled():
+                        raise
+                continue
+            try:
+                elements = await fetch(c_lat, c_lon, fetch_radius, sorted(wanted))
+                entry = self._store(tile, c_lat, c_lon, fetch_radius, wanted, elements)
+            except BaseException as e:
+                self._settle(key, future, error=e)
+                raise
+            self._settle(key, future, entry)
+        return self._filter(entry, lat, lon, radius, wanted)
+
+    def stats(self) -> dict:
+        """Counters for monitoring."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "coalesced": self.coalesced,
+                "inflight": len(self._inflight),
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_tile.clear()
+            self._bytes = 0
+
+    # -- internals (caller holds the lock unless noted) --------------------
+
+    def _probe(self, lat, lon, radius, wanted):
+        # Takes the lock itself
+        tile = geohash_encode(lat, lon, self.precision)
+        with self._lock:
+            entry = self._find(tile, lat, lon, radius, wanted)
+            if entry is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return tile, entry
+
+    def _claim(self, key):
+        # Takes the lock itself; returns (future, True) when the caller must fetch
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = self._inflight[key] = Future()
+            return future, True
+
+    def _settle(self, key, future, entry=None, error=None):
+        # Takes the lock itself; a cancelled fetch cancels the future so waiters retry
+        with self._lock:
+            self._inflight.pop(key, None)
+        if error is None:
+            future.set_result(entry)
+        elif isinstance(error, Exception):
+            future.set_exception(error)
+        else:
+            future.cancel()
+
+    @staticmethod
+    def _fetch_circle(tile, radius):
+        # The tile centre, and a radius covering ``radius`` around any point of the tile
+        lat_lo, lat_hi, lon_lo, lon_hi = geohash_bbox(tile)
+        half_diag_m = haversine_km(lat_lo, lon_lo, lat_hi, lon_hi) * 500
+        return (lat_lo + lat_hi) / 2, (lon_lo + lon_hi) / 2, int(math.ceil(radius + half_diag_m))
+
+    def _find(self, tile, lat, lon, radius, wanted):
+        now = time.monotonic()
+        radius_km = radius / 1000
+        for key in list(self._by_tile.get(tile, ())):
+            entry = self._entries[key]
+            expires_at, c_lat, c_lon, fetched_m, fetched_amenities = entry[:5]
+            if expires_at <= now:
+                self._drop(key)
+                self.expirations += 1
+                continue
+            if not wanted <= fetched_amenities:
+                continue
+            if haversine_km(c_lat, c_lon, lat, lon) + radius_km <= fetched_m / 1000:
+                self._entries.move_to_end(key)
+                return entry
+        return None
+
+    def _store(self, tile, c_lat, c_lon, radius, wanted, elements):
+        # Called without the lock held; the size estimate is the serialized payload.
+        size = len(json.dumps(elements, separators=(",", ":")))
+        ttl = self.ttl if elements else self.negative_ttl
+        entry = (time.monotonic() + ttl, c_lat, c_lon, radius, wanted, elements, size)
+        key = (tile, radius, wanted)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            if size > self.max_bytes:
+                return entry
+            self._entries[key] = entry
+            self._by_tile.setdefault(tile, set()).add(key)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                old_key = next(iter(self._entries))
+                self._drop(old_key)
+                self.evictions += 1
+        return entry
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry[6]
+        keys = self._by_tile.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_tile[key[0]]
+
+    @staticmethod
+    def _filter(entry, lat, lon, radius, wanted):
+        radius_km = radius / 1000
+        result = []
+        for el in entry[5]:
+            if el.get("tags", {}).get("amenity") not in wanted:
+                continue
+            el_lat, el_lon = element_latlon(el)
+            if el_lat is None or el_lon is None:
+                continue
+            if haversine_km(lat, lon, el_lat, el_lon) <= radius_km:
+                result.append(el)
+        return result
+
+
+# Shared by every Overpass lookup in the backend
+PLACE_CACHE = PlaceTileCache(
+    ttl=float(os.environ.get("ALERTX_PLACE_CACHE_TTL", 900)),
+    max_bytes=int(os.environ.get("ALERTX_PLACE_CACHE_MAX_BYTES", 32 * 1024 * 1024)),
+    precision=int(os.environ.get("ALERTX_PLACE_CACHE_PRECISION", 6)),
+    negative_ttl=float(os.environ.get("ALERTX_PLACE_CACHE_NEGATIVE_TTL", 60)),
+)
@@ -0,0 +1,149 @@
+import re
+from functools import lru_cache
+
+from osmindex import nearby_elements, nearby_elements_async
+from overpass import OVERPASS, OVERPASS_MIRRORS
+from placecache import element_latlon
+from tracing import span
+
+# ------------------------------------------
+# Categories + their amenities
+# ------------------------------------------
+CATEGORY_MAP = {
+    "food": ["restaurant", "fast_food", "cafe", "bar"],
+    "healthcare": ["hospital", "clinic", "pharmacy"],
+    "emergency": ["police", "fire_station", "ambulance_station"],
+    "finance": ["bank", "atm"],
+    "education": ["school", "college", "university"],
+    "transport": ["bus_station", "train_station", "airport"],
+    "shopping": ["supermarket", "convenience", "mall"],
+}
+
+# amenity -> category, so classification is a single dict lookup
+AMENITY_CATEGORY = {amenity: category for category, items in CATEGORY_MAP.items() for amenity in items}
+
+OVERPASS_URL = OVERPASS_MIRRORS[0]
+OVERPASS_TIMEOUT = 15
+# Safety cap on elements per output statement of a bounding-box query, whose
+# caller detects the cut and falls back. Radius queries are never capped: Overpass
+# cuts in quadtile order, not by distance, and the tile cache would keep the
+# partial set as complete (a dense city centre has ~2k matching nodes).
+OVERPASS_ELEMENT_LIMIT = 1000
+
+
+# ------------------------------------------
+# Query compilation
+# ------------------------------------------
+# Spatial filter of each query shape; filled in by str.format
+_SPATIAL_FILTERS = {
+    "around": "around:{radius},{lat},{lon}",
+    "bbox": "{south},{west},{north},{east}",
+}
+
+
+@lru_cache(maxsize=64)
+def _compile_template(amenities: tuple, limit, timeout: int, spatial: str = "around") -> str:
+    if len(amenities) == 1:
+        tag_filter = f'["amenity"="{amenities[0]}"]'
+    else:
+        tag_filter = '["amenity"~"^(' + "|".join(re.escape(a) for a in amenities) + ')$"]'
+    cap = f" {limit}" if limit else ""
+    # Nodes already carry lat/lon; ways and relations only need tags + centre,
+    # not their member/node lists.
+    return (
+        f"[out:json][timeout:{timeout}];"
+        f"nwr{tag_filter}({_SPATIAL_FILTERS[spatial]})->.hits;"
+        f"node.hits;out qt{cap};"
+        f"(way.hits;relation.hits;);out tags center qt{cap};"
+    )
+
+
+def compile_query(lat: float, lon: float, radius: int, amenities, limit: int = None,
+                  timeout: int = OVERPASS_TIMEOUT) -> str:
+    """Minimal Overpass QL for an exact amenity set around a point (uncapped unless ``limit``)."""
+    template = _compile_template(tuple(sorted(set(amenities))), limit, timeout)
+    return template.format(radius=int(radius), lat=lat, lon=lon)
+
+
+def compile_bbox_query(bbox, amenities, limit: int = OVERPASS_ELEMENT_LIMIT, timeout: int = OVERPASS_TIMEOUT) -> str:
+    """Same query shape for a ``(south, west, north, east)`` bounding box."""
+    template = _compile_template(tuple(sorted(set(amenities))), limit, timeout, "bbox")
+    south, west, north, east = bbox
+    return template.format(south=south, west=west, north=north, east=east)
+
+
+def fetch_elements(lat: float, lon: float, radius: int, amenities):
+    """Run the compiled query through the shared Overpass client and return its raw elements."""
+    query = compile_query(lat, lon, radius, amenities)
+    with span("http.overpass") as attrs:
+        data = OVERPASS.query_sync(query)
+        attrs["bytes"] = data["_bytes"]
+    return data.get("elements", [])
+
+
+async def fetch_elements_async(lat: float, lon: float, radius: int, amenities):
+    """:func:`fetch_elements` without blocking the caller's event loop."""
+    query = compile_query(lat, lon, radius, amenities)
+    with span("http.overpass") as attrs:
+        data = await OVERPASS.query_async(query)
+        attrs["bytes"] = data["_bytes"]
+    return data.get("elements", [])
+
+
+def fetch_bbox_elements(bbox, amenities, limit: int = OVERPASS_ELEMENT_LIMIT):
+    """Raw elements inside ``bbox``, and whether an output statement hit ``limit`` (truncated)."""
+    query = compile_bbox_query(bbox, amenities, limit)
+    with span("http.overpass", shape="bbox") as attrs:
+        data = OVERPASS.query_sync(query)
+        attrs["bytes"] = data["_bytes"]
+    elements = data.get("elements", [])
+    nodes = sum(1 for el in elements if el.get("type") == "node")
+    return elements, max(nodes, len(elements) - nodes) >= limit
+
+
+# ------------------------------------------
+# Parsing
+# ------------------------------------------
+def parse_elements(elements):
+    """Turn Overpass elements into place dicts in one pass.
+
+    Each place has ``name`` (None when untagged), ``type`` (the amenity),
+    ``category`` (from :data:`AMENITY_CATEGORY`, None when unmapped),
+    ``lat``/``lon`` and the element's ``tags``.
+    """
+    places = []
+    for el in elements:
+        tags = el.get("tags", {})
+        amenity = tags.get("amenity")
+        lat, lon = element_latlon(el)
+        places.append({
+            "name": tags.get("name"),
+            "type": amenity,
+            "category": AMENITY_CATEGORY.get(amenity),
+            "lat": lat,
+            "lon": lon,
+            "tags": tags,
+        })
+    return places
+
+
+def address(tags: dict) -> dict:
+    return {
+        "street": tags.get("addr:street"),
+        "housenumber": tags.get("addr:housenumber"),
+        "city": tags.get("addr:city"),
+    }
+
+
+def find_places(lat: float, lon: float, radius: int, amenities):
+    """Parsed places of the given amenities within ``radius`` metres of (lat, lon).
+
+    Served from the offline index when one is configured, otherwise from the
+    Overpass tile cache (which calls :func:`fetch_elements` on a miss).
+    """
+    return parse_elements(nearby_elements(lat, lon, radius, amenities, fetch_elements))
+
+
+async def find_places_async(lat: float, lon: float, radius: int, amenities):
+    """:func:`find_places` for async tools: ADK runs sync tools on the event loop, blocking every run."""
+    return parse_elements(await nearby_elements_async(lat, lon, radius, amenities, fetch_elements_async))
@@ -0,0 +1,153 @@
+import json
+import os
+import random
+
+import numpy as np
+from dotenv import load_dotenv
+
+from placequery import address
+from ranking import haversine_km_batch, nearest_indices
+from tracing import count
+
+load_dotenv()
+
+# OSM tags kept on each place unless the caller asks for others (comma separated)
+DEFAULT_TAGS = tuple(t.strip() for t in os.environ.get(
+    "ALERTX_PLACE_TAGS", "addr:street,addr:housenumber,addr:city").split(",") if t.strip())
+# Share of tool calls whose payload sizes are measured for /metrics
+SIZE_SAMPLE_RATE = float(os.environ.get("ALERTX_PLACE_SIZE_SAMPLE_RATE", 0.05))
+
+class Place:
+    """One facility with only the fields the agents use and the requested tags."""
+
+    __slots__ = ("name", "type", "lat", "lon", "distance_km", "tags")
+
+    def __init__(self, name, type, lat, lon, distance_km=None, tags=None):
+        self.name = name
+        self.type = type
+        self.lat = lat
+        self.lon = lon
+        self.distance_km = distance_km
+        self.tags = tags or {}
+
+    def to_dict(self) -> dict:
+        place = {"name": self.name, "type": self.type, "lat": self.lat, "lon": self.lon}
+        if self.distance_km is not None:
+            place["distance_km"] = self.distance_km
+        if self.tags:
+            place["tags"] = self.tags
+        return place
+
+
+class PlaceBatch:
+    """Struct-of-arrays set of places: parallel columns instead of one dict per place.
+
+    Built from :func:`placequery.parse_elements` output, keeping only the
+    tag keys in ``tags``; the parsed dicts (and their full tag dicts) are not
+    referenced afterwards, only their positions (``source``). :meth:`nearest`
+    ranks on the coordinate arrays and :meth:`to_columns` is the compact
+    wire / prompt form.
+    """
+
+    __slots__ = ("names", "types", "lats", "lons", "distances", "tag_keys", "tag_columns", "source")
+
+    def __init__(self, names, types, lats, lons, distances=None, tag_keys=(), tag_columns=None, source=None):
+        self.source = np.arange(len(names)) if source is None else source
+        self.names = names
+        self.types = types
+        self.lats = lats
+        self.lons = lons
+        self.distances = distances
+        self.tag_keys = tuple(tag_keys)
+        self.tag_columns = tag_columns or {key: [None] * len(names) for key in self.tag_keys}
+
+    @classmethod
+    def from_parsed(cls, parsed, tags=DEFAULT_TAGS, default_name: str = "Unnamed"):
+        source = np.asarray([i for i, p in enumerate(parsed) if p["lat"] is not None and p["lon"] is not None],
+                            dtype=np.intp)
+        parsed = [parsed[i] for i in source]
+        tags = tuple(tags)
+        return cls(
+            source=source,
+            names=[p["name"] or default_name for p in parsed],
+            types=[p["type"] or "unknown" for p in parsed],
+            lats=np.fromiter((p["lat"] for p in parsed), dtype=np.float64, count=len(parsed)),
+            lons=np.fromiter((p["lon"] for p in parsed), dtype=np.float64, count=len(parsed)),
+            tag_keys=tags,
+            tag_columns={key: [p["tags"].get(key) for p in parsed] for key in tags},
+        )
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, i) -> Place:
+        tags = {key: self.tag_columns[key][i] for key in self.tag_keys if self.tag_columns[key][i] is not None}
+        distance = None if self.distances is None else round(float(self.distances[i]), 2)
+        return Place(self.names[i], self.types[i], float(self.lats[i]), float(self.lons[i]), distance, tags)
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def take(self, indices):
+        indices = np.asarray(indices, dtype=np.intp)
+        return PlaceBatch(
+            names=[self.names[i] for i in indices],
+            types=[self.types[i] for i in indices],
+            lats=self.lats[indices],
+            lons=self.lons[indices],
+            distances=None if self.distances is None else self.distances[indices],
+            tag_keys=self.tag_keys,
+            tag_columns={key: [column[i] for i in indices] for key, column in self.tag_columns.items()},
+            source=self.source[indices],
+        )
+
+    def nearest(self, lat: float, lon: float, k: int, per_type: bool = False):
+        """The k nearest places (per amenity type with ``per_type``), with distances, nearest first."""
+        if not len(self) or k <= 0:
+            return self.take([])
+        distances = haversine_km_batch(lat, lon, self.lats, self.lons)
+        selected = nearest_indices(distances, k, self.types if per_type else None)
+        batch = self.take(selected)
+        batch.distances = distances[selected]
+        return batch
+
+    def to_columns(self) -> dict:
+        """``{"count", "name": [...], "type": [...], "lat": [...], "lon": [...], "distance_km": [...], "tags": {key: [...]}}``.
+
+        Tag columns that are empty for every place are left out.
+        """
+        columns = {
+            "count": len(self),
+            "name": self.names,
+            "type": self.types,
+            "lat": [round(float(v), 6) for v in self.lats],
+            "lon": [round(float(v), 6) for v in self.lons],
+        }
+        if self.distances is not None:
+            columns["distance_km"] = [round(float(v), 2) for v in self.distances]
+        tags = {key: column for key, column in self.tag_columns.items() if any(v is not None for v in column)}
+        if tags:
+            columns["tags"] = tags
+        return columns
+
+
+def record_payload_size(tool: str, compact, parsed, batches):
+    """Count bytes of the compact payload vs the previous one-dict-per-place form with all raw tags.
+
+    ``parsed`` is the list the ``batches`` were built from; only the places
+    that made it into the answer are counted for the previous form. Only a
+    ``SIZE_SAMPLE_RATE`` share of calls is serialised; the sizes go to /metrics
+    as ``alertx_place_payload_bytes_total`` and never back to the model.
+    """
+    if random.random() >= SIZE_SAMPLE_RATE:
+        return
+    count("alertx_place_payload_samples_total", tool=tool)
+    previous = []
+    for batch in batches:
+        for i, distance in zip(batch.source, batch.distances if batch.distances is not None else [None] * len(batch)):
+            p = parsed[i]
+            previous.append({"name": p["name"] or "Unnamed", "type": p["type"] or "unknown",
+                             "address": address(p["tags"]), "lat": p["lat"], "lon": p["lon"],
+                             "raw_tags": p["tags"], "distance_km": distance and round(float(distance), 2)})
+    count("alertx_place_payload_bytes_total", len(json.dumps(compact)), tool=tool, form="compact")
+    count("alertx_place_payload_bytes_total", len(json.dumps(previous)), tool=tool, form="full")
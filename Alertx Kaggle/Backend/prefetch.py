@@ -0,0 +1,92 @@
+import asyncio
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+from google.genai.types import Content, Part
+
+from tracing import span
+
+load_dotenv()
+
+PREFETCH_WORKERS = int(os.environ.get("ALERTX_PREFETCH_WORKERS", 8))
+PREFETCH_TIMEOUT = float(os.environ.get("ALERTX_PREFETCH_TIMEOUT", 20))
+
+# session id -> Future of a lookup started before the session existed
+_pending = {}
+_pending_lock = threading.Lock()
+
+
+def parse_location(lat, lon):
+    """``{"lat", "lon"}`` from request fields, None when absent; ValueError when invalid."""
+    if lat in (None, "") and lon in (None, ""):
+        return None
+    lat, lon = float(lat), float(lon)
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError("lat/lon out of range")
+    return {"lat": lat, "lon": lon}
+
+
+class LocationPrefetch:
+    """Looks up facilities for client-supplied GPS so LocationAgent needs no LLM turn.
+
+    ``start()`` runs ``lookup(lat, lon)`` on a thread pool as soon as the
+    coordinates are known, overlapping video preparation and analysis.
+    :func:`bind` ties the pending lookup to a session whose state carries
+    ``user_location``; :meth:`before_agent` (installed on LocationAgent) then
+    waits for it, writes ``location_data`` and skips the model call. Without
+    ``user_location`` the agent runs as before.
+    """
+
+    def __init__(self, lookup, workers: int = PREFETCH_WORKERS):
+        self.lookup = lookup
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="alertx-prefetch")
+        self.skipped = 0  # model turns saved
+        self.fallbacks = 0  # lookups that failed, so the agent ran instead
+
+    def start(self, location: dict):
+        return self._executor.submit(self._lookup, location["lat"], location["lon"])
+
+    def _lookup(self, lat, lon):
+        with span("prefetch.location"):
+            return self.lookup(lat, lon)
+
+    async def before_agent(self, callback_context):
+        location = callback_context.state.get("user_location")
+        if not location:
+            return None
+        with _pending_lock:
+            future = _pending.pop(callback_context.session.id, None)
+        try:
+            if future is None:  # e.g. a queued job: no request thread started it
+                future = self.start(location)
+            result = await asyncio.wait_for(asyncio.wrap_future(future), PREFETCH_TIMEOUT)
+        except Exception as e:
+            result = {"error": str(e)}
+        if "error" in result:
+            print(f"Location prefetch failed ({result['error']}); running {callback_context.agent_name}")
+            self.fallbacks += 1
+            return None
+
+        location_data = json.dumps({"user_location": location, **result})
+        callback_context.state["location_data"] = location_data
+        self.skipped += 1
+        return Content(role="model", parts=[Part(text=location_data)])
+
+    def stats(self) -> dict:
+        return {"skipped": self.skipped, "fallbacks": self.fallbacks, "pending": len(_pending)}
+
+
+def bind(session_id: str, future):
+    with _pending_lock:
+        _pending[session_id] = future
+
+
+def discard(session_id: str):
+    """Drop a lookup the run never consumed (cached replay, error, client gone)."""
+    with _pending_lock:
+        future = _pending.pop(session_id, None)
+    if future is not None:
+        future.cancel()
@@ -0,0 +1,57 @@
+import numpy as np
+
+from placecache import EARTH_RADIUS_KM
+
+
+def haversine_km_batch(lat: float, lon: float, lats, lons) -> np.ndarray:
+    """Great-circle distances (km) from one point to arrays of points, in one pass."""
+    lat1 = np.radians(lat)
+    lat2 = np.radians(np.asarray(lats, dtype=np.float64))
+    dlat = lat2 - lat1
+    dlon = np.radians(np.asarray(lons, dtype=np.float64) - lon)
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def _nearest_k(indices: np.ndarray, distances: np.ndarray, k: int) -> np.ndarray:
+    """Positions from ``indices`` of the k smallest distances, nearest first."""
+    if k < len(indices):
+        indices = indices[np.argpartition(distances[indices], k - 1)[:k]]
+    return indices[np.argsort(distances[indices], kind="stable")]
+
+
+def rank_nearest(places, lat: float, lon: float, k: int, group_key: str = None):
+    """Attach ``distance_km`` to each place and keep the k nearest.
+
+    Args:
+        places: List of place dicts carrying ``lat`` and ``lon``. Places without
+            coordinates cannot be ranked and are dropped.
+        lat, lon: Reference point (the incident location).
+        k: How many places to keep, overall or per group.
+        group_key: If given, keep the k nearest per distinct ``place[group_key]``
+            (e.g. ``"type"`` for per-amenity ranking).
+
+    Returns:
+        A new list of place dicts sorted by distance, nearest first.
+    """
+    places = [p for p in places if p.get("lat") is not None and p.get("lon") is not None]
+    if not places or k <= 0:
+        return []
+
+    lats = np.fromiter((p["lat"] for p in places), dtype=np.float64, count=len(places))
+    lons = np.fromiter((p["lon"] for p in places), dtype=np.float64, count=len(places))
+    distances = haversine_km_batch(lat, lon, lats, lons)
+    groups = None if group_key is None else [p.get(group_key) for p in places]
+    selected = nearest_indices(distances, k, groups)
+    return [dict(places[i], distance_km=round(float(distances[i]), 2)) for i in selected]
+
+
+def nearest_indices(distances: np.ndarray, k: int, groups=None) -> np.ndarray:
+    """Positions of the k smallest ``distances`` (per distinct ``groups[i]`` if given), nearest first."""
+    if groups is None:
+        return _nearest_k(np.arange(len(distances)), distances, k)
+    members = {}
+    for i, group in enumerate(groups):
+        members.setdefault(group, []).append(i)
+    selected = np.concatenate([_nearest_k(np.asarray(m), distances, k) for m in members.values()])
+    return selected[np.argsort(distances[selected], kind="stable")]
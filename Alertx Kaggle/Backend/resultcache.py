@@ -0,0 +1,140 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# A cached run carries the facilities found around the reporter's GPS, so it only
+# replays for reports from about the same spot (3 decimals: ~110 m cells)
+LOCATION_DECIMALS = int(os.environ.get("ALERTX_RESULT_CACHE_LOCATION_DECIMALS", 3))
+
+
+def cache_scope(text: str = "", location: dict = None) -> str:
+    """What besides the video a cached run depends on: the request text and the rounded client GPS.
+
+    The text is compared case- and whitespace-insensitively.
+    """
+    canonical = " ".join((text or "").split()).casefold()
+    scope = hashlib.sha256(canonical.encode()).hexdigest()[:16]
+    if location:
+        scope += f"@{round(location['lat'], LOCATION_DECIMALS)},{round(location['lon'], LOCATION_DECIMALS)}"
+    return scope
+
+
+def _hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def _informative(frame_hashes, max_distance: int) -> list:
+    # Dark, blank or uniform frames hash to (nearly) all zeros or ones and would
+    # match any other such frame of any clip
+    return [h for h in frame_hashes or [] if max_distance < bin(h).count("1") < 64 - max_distance]
+
+
+class ResultCache:
+    """Bounded TTL/LRU cache of finished /analyze runs.
+
+    Tier 1 is keyed by the SHA-256 of the uploaded bytes. Tier 2 compares
+    perceptual frame hashes, so a re-encoded or trimmed copy of a clip still
+    hits: two videos match when enough of the new video's sampled frames are
+    within ``max_distance`` bits of some frame of a cached one. Near-uniform
+    frames are left out of that comparison. Both tiers only match entries of
+    the same ``scope`` (see :func:`cache_scope`).
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = 6 * 3600,
+                 max_distance: int = 10, min_match_ratio: float = 0.6):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.min_match_ratio = min_match_ratio
+        self._entries = OrderedDict()  # (scope, sha256) -> entry dict
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.perceptual_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, sha256: str, scope: str = ""):
+        """Exact lookup by content hash. Does not count a miss on its own."""
+        with self._lock:
+            entry = self._live((scope, sha256))
+            if entry is not None:
+                self.exact_hits += 1
+            return entry
+
+    def get_similar(self, frame_hashes, scope: str = ""):
+        """Perceptual lookup; counts the miss when nothing matches."""
+        frame_hashes = _informative(frame_hashes, self.max_distance)
+        with self._lock:
+            if frame_hashes:
+                needed = max(1, int(len(frame_hashes) * self.min_match_ratio + 0.5))
+                for key in list(self._entries):
+                    if key[0] != scope:
+                        continue
+                    entry = self._live(key, touch=False)
+                    if entry is None or not entry["frame_hashes"]:
+                        continue
+                    matched = sum(
+                        1 for h in frame_hashes
+                        if any(_hamming(h, c) <= self.max_distance for c in entry["frame_hashes"])
+                    )
+                    if matched >= needed:
+                        self._entries.move_to_end(key)
+                        self.perceptual_hits += 1
+                        return entry
+            self.misses += 1
+            return None
+
+    def put(self, sha256: str, frame_hashes, events, state, scope: str = ""):
+        with self._lock:
+            self._entries[(scope, sha256)] = {
+                "sha256": sha256,
+                "scope": scope,
+                "frame_hashes": _informative(frame_hashes, self.max_distance),
+                "events": list(events),
+                "state": dict(state),
+                "expires_at": time.monotonic() + self.ttl,
+            }
+            self._entries.move_to_end((scope, sha256))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self.exact_hits + self.perceptual_hits
+            total = hits + self.misses
+            return {
+                "exact_hits": self.exact_hits,
+                "perceptual_hits": self.perceptual_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": round(hits / total, 4) if total else 0.0,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+            }
+
+    def _live(self, key, touch=True):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry["expires_at"] <= time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            return None
+        if touch:
+            self._entries.move_to_end(key)
+        return entry
+
+
+RESULT_CACHE = ResultCache(
+    max_entries=int(os.environ.get("ALERTX_RESULT_CACHE_ENTRIES", 256)),
+    ttl=float(os.environ.get("ALERTX_RESULT_CACHE_TTL", 6 * 3600)),
+)
@@ -0,0 +1,70 @@
+import threading
+from contextlib import aclosing
+
+from tracing import annotate, count, trace_totals
+
+
+def has_media(message) -> bool:
+    """True if a user message carries video, images (keyframes) or a Files API reference."""
+    for part in (message.parts or []) if message else []:
+        if part.file_data:
+            return True
+        if part.inline_data and (part.inline_data.mime_type or "").startswith(("video/", "image/")):
+            return True
+    return False
+
+
+class Router:
+    """Deterministic routing in front of the ADK runners.
+
+    Messages with media go straight to ``pipeline_runner`` (the emergency
+    pipeline); text-only chat goes to ``chat_runner`` (the conversational
+    root agent). Both runners must share a session service and app name.
+    Duck-types the parts of :class:`google.adk.runners.Runner` that
+    ``analysis_events`` uses, so it can be passed wherever a runner is.
+
+    Savings per fast-path request are estimated from the same run's
+    ``VideoAnalyzer`` model call: it gets the identical user content, and
+    for a multimodal prompt the prefill of the media dominates both calls.
+    """
+
+    def __init__(self, chat_runner, pipeline_runner, reference_agent: str = "VideoAnalyzer"):
+        self.chat_runner = chat_runner
+        self.pipeline_runner = pipeline_runner
+        self.session_service = chat_runner.session_service
+        self.app_name = chat_runner.app_name
+        self.reference_stage = f"model.{reference_agent}"
+        self._lock = threading.Lock()
+        self._stats = {"fast_path": 0, "chat": 0, "saved_prompt_tokens": 0, "saved_ms": 0.0}
+
+    async def run_async(self, *, new_message, **kwargs):
+        fast = has_media(new_message)
+        runner = self.pipeline_runner if fast else self.chat_runner
+        route = "fast_path" if fast else "chat"
+        with self._lock:
+            self._stats[route] += 1
+        count("alertx_router_requests_total", route=route)
+
+        invocation_id = None
+        # aclosing: a client disconnect closing us must also cancel the inner run
+        async with aclosing(runner.run_async(new_message=new_message, **kwargs)) as events:
+            async for event in events:
+                invocation_id = invocation_id or event.invocation_id
+                yield event
+        if fast and invocation_id:
+            self._record_savings(invocation_id)
+
+    def _record_savings(self, invocation_id: str):
+        reference = trace_totals(invocation_id, self.reference_stage)
+        saved_tokens = int(reference.get("prompt_tokens", 0))
+        saved_ms = round(reference.get("ms", 0.0), 1)
+        annotate(invocation_id, "router.skipped_root_agent", saved_ms=saved_ms, saved_prompt_tokens=saved_tokens)
+        count("alertx_router_saved_prompt_tokens_total", saved_tokens)
+        count("alertx_router_saved_seconds_total", saved_ms / 1000)
+        with self._lock:
+            self._stats["saved_prompt_tokens"] += saved_tokens
+            self._stats["saved_ms"] += saved_ms
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
@@ -0,0 +1,71 @@
+import asyncio
+import os
+import queue
+import threading
+from contextlib import asynccontextmanager
+
+from dotenv import load_dotenv
+from google.adk.runners import Runner
+
+load_dotenv()
+
+RUNNER_POOL_SIZE = int(os.environ.get("ALERTX_RUNNER_POOL_SIZE", 4))
+
+
+class RunnerPool:
+    """Long-lived runners for one agent tree, checked out per request.
+
+    Runners are built once up front; ``checkout()`` hands one out and waits
+    (without blocking the event loop) while all ``size`` are busy, which also
+    caps concurrent runs. The queue is thread-safe, so callers that each
+    ``asyncio.run()`` on their own loop (Flask) can share the pool.
+
+    Model clients are not pre-built here: ADK caches them per event loop, and
+    those callers get a fresh loop per request.
+    """
+
+    def __init__(self, agent, app_name: str, session_service, size: int = RUNNER_POOL_SIZE):
+        self.app_name = app_name
+        self.session_service = session_service
+        self.size = size
+        self._idle = queue.Queue()
+        for _ in range(size):
+            self._idle.put(Runner(agent=agent, app_name=app_name, session_service=session_service))
+
+    @asynccontextmanager
+    async def checkout(self):
+        try:
+            runner = self._idle.get_nowait()
+        except queue.Empty:
+            runner = await self._wait()
+        try:
+            yield runner
+        finally:
+            self._idle.put(runner)
+
+    async def _wait(self):
+        # The waiting thread cannot be cancelled, so a caller that gives up marks the
+        # wait abandoned and whichever side holds the runner puts it back
+        lock = threading.Lock()
+        taken, abandoned = [], []
+
+        def take():
+            runner = self._idle.get()
+            with lock:
+                if abandoned:
+                    self._idle.put(runner)
+                else:
+                    taken.append(runner)
+            return runner
+
+        try:
+            return await asyncio.to_thread(take)
+        except asyncio.CancelledError:
+            with lock:
+                abandoned.append(True)
+                if taken:
+                    self._idle.put(taken.pop())
+            raise
+
+    def stats(self) -> dict:
+        return {"size": self.size, "idle": self._idle.qsize()}
@@ -0,0 +1,319 @@
+import json
+import os
+import re
+import threading
+
+from dotenv import load_dotenv
+from google.genai.types import Content, Part
+
+from tracing import count, span
+
+load_dotenv()
+
+# Model re-asks allowed per output when local repair cannot fix it (0 disables)
+SCHEMA_REASKS = int(os.environ.get("ALERTX_SCHEMA_REASKS", 1))
+
+# ==================== SCHEMAS ====================
+# Field spec: type is str | number | list | object | enum. "required" fields
+# without a usable value fail validation; others fall back to "default".
+# Enum "aliases" map lower-cased synonyms onto canonical values; a
+# non-"strict" enum keeps unknown values as given.
+PLACE = {
+    "name": {"type": "str", "default": "Unnamed Facility"},
+    "type": {"type": "str", "default": "unknown"},
+    "lat": {"type": "number", "default": None},
+    "lon": {"type": "number", "default": None},
+    "distance_km": {"type": "number", "default": None},
+}
+
+ACTION = {
+    "priority": {"type": "enum", "values": ["Immediate", "High", "Medium", "Low"], "default": "Immediate",
+                 "aliases": {"urgent": "Immediate", "critical": "Immediate", "now": "Immediate", "normal": "Medium"}},
+    "action": {"type": "str", "required": True},
+    "lead": {"type": "str", "default": ""},
+    "nearest": {"type": "str", "default": ""},
+}
+
+SCHEMAS = {
+    "video_analysis": {
+        "scene_description": {"type": "str", "default": ""},
+        "objects_detected": {"type": "list", "items": {"type": "str"}, "default": []},
+        "risk_level": {"type": "enum", "values": ["Severe", "High", "Medium", "Low"], "required": True, "strict": True,
+                       "aliases": {"critical": "Severe", "extreme": "Severe", "very high": "Severe",
+                                   "moderate": "Medium", "med": "Medium", "minor": "Low", "none": "Low"}},
+        "event_type": {"type": "enum", "values": ["Flood", "Fire", "Accident", "Landslide", "Other"], "default": "Other",
+                       "strict": True, "aliases": {"flooding": "Flood", "wildfire": "Fire", "blaze": "Fire",
+                                                   "collision": "Accident", "crash": "Accident", "mudslide": "Landslide"}},
+        "department": {"type": "enum", "default": "Municipal Corporation",
+                       "values": ["Fire Services", "Electricity Board", "Police", "Municipal Corporation"],
+                       "aliases": {"fire department": "Fire Services", "fire": "Fire Services",
+                                   "electricity": "Electricity Board", "police department": "Police"}},
+        "immediate_actions": {"type": "list", "items": {"type": "str"}, "default": []},
+    },
+    "location_data": {
+        "user_location": {"type": "object", "required": True, "fields": {
+            "lat": {"type": "number", "required": True},
+            "lon": {"type": "number", "required": True},
+        }},
+        "nearby_places": {"type": "list", "items": {"type": "object", "fields": PLACE}, "default": []},
+    },
+    "final_report": {
+        "alert_level": {"type": "enum", "values": ["RED", "ORANGE", "YELLOW", "GREEN"], "required": True, "strict": True,
+                        "aliases": {"amber": "ORANGE", "critical": "RED", "severe": "RED", "high": "ORANGE",
+                                    "medium": "YELLOW", "low": "GREEN"}},
+        "summary": {"type": "str", "required": True},
+        "threats": {"type": "list", "items": {"type": "str"}, "default": []},
+        "actions": {"type": "list", "items": {"type": "object", "fields": ACTION}, "default": []},
+    },
+}
+
+
+class SchemaError(ValueError):
+    pass
+
+
+# ==================== TEXT REPAIR ====================
+_FENCE = re.compile(r"^\s*```[a-zA-Z0-9_-]*\s*\n?(.*?)\n?\s*```\s*$", re.DOTALL)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_SMART_QUOTES = str.maketrans({"“": '"', "”": '"', "‘": "'", "’": "'"})
+
+
+def _outer_object(text: str):
+    start, end = text.find("{"), text.rfind("}")
+    return text[start:end + 1] if start != -1 and end > start else None
+
+
+def parse_json_text(text: str, fixes: list):
+    """Parse model text as a JSON object, fixing fences, prose around it, smart quotes and trailing commas."""
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    match = _FENCE.match(text)
+    if match:
+        text = match.group(1)
+        fixes.append("fence")
+    candidate = _outer_object(text)
+    if candidate is None:
+        raise SchemaError("no JSON object in output")
+    if candidate != text.strip():
+        fixes.append("extract")
+    for fix, transform in (("smart_quotes", lambda t: t.translate(_SMART_QUOTES)),
+                           ("trailing_comma", lambda t: _TRAILING_COMMA.sub(r"\1", t))):
+        try:
+            return json.loads(candidate)
+        except ValueError:
+            repaired = transform(candidate)
+            if repaired != candidate:
+                fixes.append(fix)
+                candidate = repaired
+    try:
+        return json.loads(candidate)
+    except ValueError as e:
+        raise SchemaError(f"invalid JSON: {e}") from None
+
+
+# ==================== VALUE REPAIR ====================
+def _coerce(spec: dict, value, path: str, fixes: list):
+    kind = spec["type"]
+    if kind == "str":
+        if isinstance(value, str):
+            return value
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            fixes.append("coerce")
+            return str(value)
+        if isinstance(value, list) and all(isinstance(v, str) for v in value):
+            fixes.append("coerce")
+            return "; ".join(value)
+        raise SchemaError(f"{path}: expected text")
+    if kind == "number":
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return value
+        if isinstance(value, str):
+            match = re.search(r"-?\d+(?:\.\d+)?", value)
+            if match:
+                fixes.append("coerce")
+                return float(match.group())
+        raise SchemaError(f"{path}: expected a number")
+    if kind == "enum":
+        if value in spec["values"]:
+            return value
+        if isinstance(value, str):
+            key = value.strip().lower()
+            for canonical in spec["values"]:
+                if canonical.lower() == key:
+                    fixes.append("enum")
+                    return canonical
+            alias = spec.get("aliases", {}).get(key)
+            if alias:
+                fixes.append("enum")
+                return alias
+            if not spec.get("strict"):
+                return value
+        raise SchemaError(f"{path}: {value!r} is not one of {spec['values']}")
+    if kind == "list":
+        if not isinstance(value, list):
+            fixes.append("coerce")
+            value = [value]
+        items = []
+        for i, item in enumerate(value):
+            try:
+                items.append(_coerce(spec["items"], item, f"{path}[{i}]", fixes))
+            except SchemaError:
+                fixes.append("drop_item")  # one bad entry should not sink the whole output
+        return items
+    if kind == "object":
+        if not isinstance(value, dict):
+            raise SchemaError(f"{path}: expected an object")
+        return _repair_fields(spec["fields"], value, path, fixes)
+    raise SchemaError(f"{path}: unknown type {kind}")
+
+
+def _repair_fields(fields: dict, data: dict, path: str, fixes: list) -> dict:
+    out = dict(data)  # unknown keys are kept
+    for name, spec in fields.items():
+        value = data.get(name)
+        where = f"{path}.{name}" if path else name
+        if value is None or value == "":
+            if spec.get("required"):
+                raise SchemaError(f"{where}: missing")
+            out[name] = spec.get("default")
+            if name not in data or out[name] != value:
+                fixes.append("default")
+            continue
+        out[name] = _coerce(spec, value, where, fixes)
+    return out
+
+
+def repair(output_key: str, text: str):
+    """``(data, fixes)`` for a model output; SchemaError when it cannot be repaired locally.
+
+    ``fixes`` lists what was changed (``fence``, ``trailing_comma``, ``enum``,
+    ``default``, ...); empty means the output was already valid.
+    """
+    fixes = []
+    data = parse_json_text(text, fixes)
+    if not isinstance(data, dict):
+        raise SchemaError("expected a JSON object")
+    return _repair_fields(SCHEMAS[output_key], data, "", fixes), fixes
+
+
+def schema_hint(output_key: str) -> str:
+    """Compact description of a schema for the re-ask prompt."""
+    def describe(spec):
+        if spec["type"] == "enum":
+            return "|".join(spec["values"])
+        if spec["type"] == "list":
+            return f"[{describe(spec['items'])}]"
+        if spec["type"] == "object":
+            return "{" + ", ".join(f'"{k}": {describe(v)}' for k, v in spec["fields"].items()) + "}"
+        return spec["type"]
+    return describe({"type": "object", "fields": SCHEMAS[output_key]})
+
+
+# ==================== ADK CALLBACKS ====================
+class SchemaGuard:
+    """Validates and repairs each agent's JSON before ``output_key`` publishes it.
+
+    Installed as an after_model callback on every agent whose ``output_key``
+    has a schema: valid output passes untouched, fixable output is replaced
+    in place with the repaired JSON, and only output that cannot be repaired
+    locally costs a model re-ask (up to ``reasks``), using the request
+    captured by the before_model callback. If that fails too the original
+    text is kept.
+    """
+
+    def __init__(self, reasks: int = SCHEMA_REASKS):
+        self.reasks = reasks
+        self._agents = {}  # agent name -> (agent, output_key)
+        self._requests = {}  # (invocation id, agent name) -> last LlmRequest
+        self._lock = threading.Lock()
+        self._stats = {"checked": 0, "valid": 0, "repaired": 0, "reasked": 0, "reask_fixed": 0, "failed": 0}
+        self._fixes = {}
+
+    def install(self, root_agent, output_keys=None):
+        """Guard every agent below ``root_agent`` whose output_key has a schema (or is in ``output_keys``)."""
+        from callbacks import add_callback, walk_agents
+
+        keys = set(SCHEMAS if output_keys is None else output_keys) & set(SCHEMAS)
+        for agent in walk_agents(root_agent):
+            if getattr(agent, "output_key", None) in keys:
+                self._agents[agent.name] = (agent, agent.output_key)
+                add_callback(agent, "before_model_callback", self.before_model)
+                add_callback(agent, "after_model_callback", self.after_model)
+        return root_agent
+
+    def before_model(self, callback_context, llm_request):
+        with self._lock:
+            self._requests[(callback_context.invocation_id, callback_context.agent_name)] = llm_request
+        return None
+
+    async def after_model(self, callback_context, llm_response):
+        if llm_response.partial or not llm_response.content or not llm_response.content.parts:
+            return None
+        parts = llm_response.content.parts
+        if any(p.function_call for p in parts):
+            return None  # a tool call turn; the JSON comes later
+        text = "".join(p.text for p in parts if p.text and not p.thought)
+        if not text.strip():
+            return None
+        name = callback_context.agent_name
+        agent, output_key = self._agents[name]
+        with self._lock:
+            request = self._requests.pop((callback_context.invocation_id, name), None)
+            self._stats["checked"] += 1
+
+        try:
+            data, fixes = repair(output_key, text)
+            outcome = "repaired" if fixes else "valid"
+        except SchemaError as e:
+            data, fixes, outcome = await self._reask(agent, output_key, request, text, str(e))
+        with self._lock:
+            self._stats[outcome] += 1
+            for fix in fixes:
+                self._fixes[fix] = self._fixes.get(fix, 0) + 1
+        count("alertx_schema_outputs_total", agent=name, outcome=outcome)
+        if outcome != "valid" and data is not None:
+            # Replaced in place (not returned) so later after_model callbacks, e.g. the
+            # LLM cache, still run and see the repaired output
+            llm_response.content = Content(role="model", parts=[Part(text=json.dumps(data, ensure_ascii=False))])
+        return None
+
+    async def _reask(self, agent, output_key, request, text, error):
+        if request is None or self.reasks <= 0:
+            print(f"{agent.name} output failed schema {output_key} ({error}); publishing as-is")
+            return None, [], "failed"
+        hint = schema_hint(output_key)
+        for _ in range(self.reasks):
+            with self._lock:
+                self._stats["reasked"] += 1
+            retry = request.model_copy(deep=True)
+            retry.contents.append(Content(role="model", parts=[Part(text=text)]))
+            retry.contents.append(Content(role="user", parts=[Part(text=(
+                f"Your reply is not valid JSON for the required schema ({error}). "
+                f"Reply again with only the JSON object, no markdown: {hint}"))]))
+            with span(f"model.{agent.name}.reask"):
+                text = ""
+                async for response in agent.canonical_model.generate_content_async(retry, stream=False):
+                    if response.content and response.content.parts:
+                        text = "".join(p.text for p in response.content.parts if p.text and not p.thought)
+            try:
+                data, fixes = repair(output_key, text)
+                return data, fixes, "reask_fixed"
+            except SchemaError as e:
+                error = str(e)
+        print(f"{agent.name} output still failed schema {output_key} after re-ask ({error}); publishing as-is")
+        return None, [], "failed"
+
+    def stats(self) -> dict:
+        with self._lock:
+            checked = self._stats["checked"]
+            return {
+                **self._stats,
+                "repair_rate": round(self._stats["repaired"] / checked, 4) if checked else 0.0,
+                "reask_rate": round(self._stats["reasked"] / checked, 4) if checked else 0.0,
+                "fixes": dict(self._fixes),
+            }
+
+
+SCHEMA_GUARD = SchemaGuard()
@@ -0,0 +1,217 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+from google.adk.sessions import InMemorySessionService
+from google.adk.sessions.sqlite_session_service import SqliteSessionService
+
+load_dotenv()
+
+# Budgets for the in-memory store; the SQLite store applies the TTL and count
+SESSION_MAX_ENTRIES = int(os.environ.get("ALERTX_SESSION_MAX_ENTRIES", 1000))
+SESSION_MAX_BYTES = int(os.environ.get("ALERTX_SESSION_MAX_MB", 256)) * 1024 * 1024
+SESSION_IDLE_TTL = float(os.environ.get("ALERTX_SESSION_TTL", 1800))
+# Path of a shared SQLite (WAL) session database; empty keeps sessions in RAM
+SESSION_DB = os.environ.get("ALERTX_SESSION_DB", "")
+
+
+def _json_bytes(value) -> int:
+    try:
+        return len(json.dumps(value, default=str))
+    except (TypeError, ValueError):
+        return len(str(value))
+
+
+def event_bytes(event) -> int:
+    """Cheap estimate of what an event keeps resident: text, media bytes, tool payloads, state delta."""
+    size = 256  # ids, timestamps, author, actions
+    if event.content and event.content.parts:
+        for part in event.content.parts:
+            if part.text:
+                size += len(part.text)
+            if part.inline_data and part.inline_data.data:
+                size += len(part.inline_data.data)
+            if part.function_call:
+                size += _json_bytes(part.function_call.args)
+            if part.function_response:
+                size += _json_bytes(part.function_response.response)
+    if event.actions and event.actions.state_delta:
+        size += _json_bytes(event.actions.state_delta)
+    return size
+
+
+class BoundedSessionService(InMemorySessionService):
+    """In-memory ADK sessions with an entry budget, a byte budget and an idle TTL.
+
+    Every create/get/append touches the session in an LRU order. Sessions idle
+    longer than ``idle_ttl`` are dropped first; then least recently used ones
+    until both budgets hold. The session touched last is never evicted, so a
+    single oversized run can still finish.
+    """
+
+    def __init__(self, max_entries: int = SESSION_MAX_ENTRIES, max_bytes: int = SESSION_MAX_BYTES,
+                 idle_ttl: float = SESSION_IDLE_TTL):
+        super().__init__()
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self._lru = OrderedDict()  # (app, user, session id) -> [last_access, bytes]
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"created": 0, "hits": 0, "misses": 0,
+                       "evicted_ttl": 0, "evicted_entries": 0, "evicted_bytes": 0, "bytes_freed": 0}
+        # Called with (app_name, user_id, session_id) for each evicted session,
+        # so per-session side stores (e.g. history.HISTORY) can be released too
+        self.evict_listeners = []
+
+    # ---------- bookkeeping ----------
+    def _touch(self, key, grow: int = 0):
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is None:
+                entry = self._lru[key] = [0.0, 0]
+            entry[0] = time.monotonic()
+            entry[1] += grow
+            self._bytes += grow
+            self._lru.move_to_end(key)
+
+    def _forget(self, key):
+        with self._lock:
+            entry = self._lru.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry[1]
+        return entry
+
+    async def _evict(self):
+        now = time.monotonic()
+        victims = []
+        with self._lock:
+            keys = list(self._lru)
+            for key in keys[:-1]:  # never the most recently touched
+                last_access, size = self._lru[key]
+                if now - last_access > self.idle_ttl:
+                    reason = "evicted_ttl"
+                elif len(self._lru) > self.max_entries:
+                    reason = "evicted_entries"
+                elif self._bytes > self.max_bytes:
+                    reason = "evicted_bytes"
+                else:
+                    break  # LRU order: everything after is newer
+                del self._lru[key]
+                self._bytes -= size
+                self._stats[reason] += 1
+                self._stats["bytes_freed"] += size
+                victims.append(key)
+        for app_name, user_id, session_id in victims:
+            await super().delete_session(app_name=app_name, user_id=user_id, session_id=session_id)
+            for listener in self.evict_listeners:
+                listener(app_name, user_id, session_id)
+
+    # ---------- BaseSessionService ----------
+    async def create_session(self, *, app_name, user_id, state=None, session_id=None):
+        session = await super().create_session(app_name=app_name, user_id=user_id, state=state, session_id=session_id)
+        with self._lock:
+            self._stats["created"] += 1
+        self._touch((app_name, user_id, session.id), _json_bytes(state or {}) + 512)
+        await self._evict()
+        return session
+
+    async def get_session(self, *, app_name, user_id, session_id, config=None):
+        session = await super().get_session(app_name=app_name, user_id=user_id, session_id=session_id, config=config)
+        with self._lock:
+            self._stats["hits" if session is not None else "misses"] += 1
+        if session is not None:
+            self._touch((app_name, user_id, session.id))
+        return session
+
+    async def delete_session(self, *, app_name, user_id, session_id):
+        await super().delete_session(app_name=app_name, user_id=user_id, session_id=session_id)
+        self._forget((app_name, user_id, session_id))
+
+    async def append_event(self, session, event):
+        event = await super().append_event(session, event)
+        if not event.partial:
+            self._touch((session.app_name, session.user_id, session.id), event_bytes(event))
+            await self._evict()
+        return event
+
+    async def sweep(self):
+        """Drop idle sessions now (eviction otherwise happens on the next write)."""
+        await self._evict()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "sessions": len(self._lru), "bytes": self._bytes,
+                    "max_entries": self.max_entries, "max_bytes": self.max_bytes, "idle_ttl": self.idle_ttl}
+
+
+class SharedSessionService(SqliteSessionService):
+    """ADK's SQLite session service in WAL mode, shared by every process on the host.
+
+    WAL lets worker processes read while another writes. Sessions idle longer
+    than ``idle_ttl`` and the oldest beyond ``max_entries`` are pruned (events
+    cascade) at most every ``prune_interval`` seconds, from create_session;
+    ``evict_listeners`` hear about each one, as with :class:`BoundedSessionService`.
+    """
+
+    def __init__(self, db_path: str, max_entries: int = SESSION_MAX_ENTRIES, idle_ttl: float = SESSION_IDLE_TTL,
+                 prune_interval: float = 60):
+        with sqlite3.connect(db_path) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")  # persistent for the database file
+        super().__init__(db_path)
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.idle_ttl = idle_ttl
+        self.prune_interval = prune_interval
+        self._last_prune = 0.0
+        self._stats = {"created": 0, "evicted_ttl": 0, "evicted_entries": 0}
+        self.evict_listeners = []
+
+    async def create_session(self, **kwargs):
+        if time.monotonic() - self._last_prune > self.prune_interval:
+            self._last_prune = time.monotonic()
+            await asyncio.to_thread(self.prune)
+        self._stats["created"] += 1
+        return await super().create_session(**kwargs)
+
+    def prune(self):
+        try:
+            with sqlite3.connect(self.db_path, timeout=10) as conn:
+                conn.execute("PRAGMA foreign_keys = ON")
+                expired = conn.execute("DELETE FROM sessions WHERE update_time < ? RETURNING app_name, user_id, id",
+                                       (time.time() - self.idle_ttl,)).fetchall()
+                surplus = conn.execute(
+                    "DELETE FROM sessions WHERE rowid IN (SELECT rowid FROM sessions "
+                    "ORDER BY update_time DESC LIMIT -1 OFFSET ?) RETURNING app_name, user_id, id",
+                    (self.max_entries,)).fetchall()
+        except sqlite3.OperationalError as e:
+            if "no such table" not in str(e):  # fresh database: ADK creates the schema on first use
+                print(f"Session prune skipped: {e}")
+            return
+        self._stats["evicted_ttl"] += len(expired)
+        self._stats["evicted_entries"] += len(surplus)
+        for app_name, user_id, session_id in expired + surplus:
+            for listener in self.evict_listeners:
+                listener(app_name, user_id, session_id)
+
+    def stats(self) -> dict:
+        sessions = 0
+        try:
+            with sqlite3.connect(self.db_path, timeout=10) as conn:
+                sessions = conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        except sqlite3.OperationalError:
+            pass
+        return {**self._stats, "sessions": sessions, "bytes": os.path.getsize(self.db_path),
+                "max_entries": self.max_entries, "idle_ttl": self.idle_ttl}
+
+
+def make_session_service():
+    """Session service for this process: shared SQLite when ALERTX_SESSION_DB is set, else bounded RAM."""
+    if SESSION_DB:
+        return SharedSessionService(SESSION_DB)
+    return BoundedSessionService()
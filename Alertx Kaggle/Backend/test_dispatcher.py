@@ -0,0 +1,152 @@
+import asyncio
+import types
+
+import httpx
+import pytest
+
+from dispatcher import AlertDispatcher
+from twilio_standin import start_standin
+
+ACCOUNT_SID = "AC00000000000000000000000000000000"
+FUTURE = 10 ** 10  # claim(now=...) far enough ahead that every backoff has passed
+
+
+@pytest.fixture
+def twilio():
+    server, url, behaviour = start_standin(latency_ms=1, account_sid=ACCOUNT_SID, auth_token="secret")
+    yield url, behaviour
+    server.shutdown()
+
+
+def make_dispatcher(tmp_path, url, **options):
+    options = {"routes": {"*": "+15550000001"}, "rate": "10/300", "batch": 10, "max_attempts": 3, **options}
+    return AlertDispatcher(db_path=str(tmp_path / "alerts.db"), api=url, account_sid=ACCOUNT_SID,
+                           auth_token="secret", from_number="+15559999999", **options)
+
+
+def send(dispatcher, now=None):
+    """Claim one batch and place it against the stand-in; returns the claimed alerts."""
+    async def run():
+        alerts = dispatcher.claim(now)
+        if alerts:
+            async with httpx.AsyncClient() as http:
+                await dispatcher.send_batch(http, alerts)
+        return alerts
+
+    return asyncio.run(run())
+
+
+def statuses(dispatcher) -> dict:
+    return dispatcher.stats()["queue"]
+
+
+# ==================== queueing ====================
+def test_red_calls_go_before_orange(tmp_path, twilio):
+    url, behaviour = twilio
+    dispatcher = make_dispatcher(tmp_path, url, batch=1)
+    dispatcher.enqueue("ORANGE", "wall cracked", ["+15550000001"], "a")
+    dispatcher.enqueue("RED", "building on fire", ["+15550000002"], "b")
+    assert [a["level"] for a in send(dispatcher)] == ["RED"]
+    assert [a["level"] for a in send(dispatcher)] == ["ORANGE"]
+    assert [c["to"] for c in behaviour.calls] == ["+15550000002", "+15550000001"]
+
+
+def test_same_incident_is_called_in_once_per_destination(tmp_path, twilio):
+    dispatcher = make_dispatcher(tmp_path, twilio[0])
+    first = dispatcher.enqueue("RED", "flood", ["+15550000001", "+15550000002"], "flood@12.97,77.59")
+    again = dispatcher.enqueue("RED", "flood again", ["+15550000001"], "flood@12.97,77.59")
+    assert [q["status"] for q in first] == ["queued", "queued"]
+    assert again == [{"id": first[0]["id"], "destination": "+15550000001", "status": "duplicate"}]
+    send(dispatcher)
+    assert len(twilio[1].calls) == 2
+
+
+def test_unknown_level_is_rejected(tmp_path, twilio):
+    with pytest.raises(ValueError):
+        make_dispatcher(tmp_path, twilio[0]).enqueue("PURPLE", "x", ["+15550000001"], "k")
+
+
+# ==================== rate limit ====================
+def test_rate_limit_defers_only_the_busy_destination(tmp_path, twilio):
+    url, behaviour = twilio
+    dispatcher = make_dispatcher(tmp_path, url, rate="2/300")
+    for i in range(3):
+        dispatcher.enqueue("RED", f"incident {i}", ["+15550000001"], f"busy-{i}")
+    dispatcher.enqueue("ORANGE", "elsewhere", ["+15550000002"], "quiet")
+    assert len(send(dispatcher)) == 3
+    assert send(dispatcher) == []
+    assert statuses(dispatcher) == {"sent": 3, "queued": 1}
+    assert dispatcher.stats()["rate_limit_deferrals"] >= 1
+    assert sorted(c["to"] for c in behaviour.calls) == ["+15550000001", "+15550000001", "+15550000002"]
+
+
+# ==================== retries ====================
+def test_server_errors_are_retried_until_the_call_goes_through(tmp_path, twilio):
+    url, behaviour = twilio
+    behaviour.fail_rate = 1.0
+    dispatcher = make_dispatcher(tmp_path, url)
+    dispatcher.enqueue("RED", "flood", ["+15550000001"], "k")
+    send(dispatcher)
+    assert statuses(dispatcher) == {"queued": 1}
+    assert send(dispatcher) == []  # backing off
+    behaviour.fail_rate = 0.0
+    assert [a["attempts"] for a in send(dispatcher, now=FUTURE)] == [2]
+    assert statuses(dispatcher) == {"sent": 1}
+    assert dispatcher.stats()["retried"] == 1
+    assert len(behaviour.calls) == 1
+
+
+def test_retries_stop_after_max_attempts(tmp_path, twilio):
+    url, behaviour = twilio
+    behaviour.fail_rate = 1.0
+    dispatcher = make_dispatcher(tmp_path, url, max_attempts=2)
+    dispatcher.enqueue("RED", "flood", ["+15550000001"], "k")
+    send(dispatcher)
+    send(dispatcher, now=FUTURE)
+    assert statuses(dispatcher) == {"failed": 1}
+    assert behaviour.requests == 2
+
+
+def test_client_errors_fail_without_retrying(tmp_path, twilio):
+    url, behaviour = twilio
+    dispatcher = make_dispatcher(tmp_path, url)
+    dispatcher.auth_token = "wrong"
+    dispatcher.enqueue("RED", "flood", ["+15550000001"], "k")
+    send(dispatcher)
+    assert statuses(dispatcher) == {"failed": 1}
+    assert behaviour.requests == 1
+
+
+def test_non_json_success_counts_as_sent(tmp_path):
+    dispatcher = make_dispatcher(tmp_path, "http://twilio.invalid")
+    dispatcher.enqueue("RED", "flood", ["+15550000001"], "k")
+
+    async def run():
+        transport = httpx.MockTransport(lambda request: httpx.Response(201, text="<html>queued</html>"))
+        async with httpx.AsyncClient(transport=transport) as http:
+            await dispatcher.send_batch(http, dispatcher.claim())
+
+    asyncio.run(run())
+    assert statuses(dispatcher) == {"sent": 1}
+
+
+# ==================== pipeline hook ====================
+def test_after_agent_speaks_the_scene_description(tmp_path, twilio):
+    url, behaviour = twilio
+    dispatcher = make_dispatcher(tmp_path, url)
+    state = {"video_analysis": '{"risk_level": "Severe", "event_type": "Flood", '
+                               '"scene_description": "Underpass flooded, car stuck"}',
+             "user_location": {"lat": 12.9716, "lon": 77.5946}}
+    dispatcher.after_agent(types.SimpleNamespace(state=state))
+    assert state["alert_dispatch"]["status"] == "queued"
+    send(dispatcher)
+    assert "Underpass flooded, car stuck" in behaviour.calls[0]["twiml"]
+    assert "RED" in behaviour.calls[0]["twiml"]
+
+
+def test_after_agent_skips_low_risk(tmp_path, twilio):
+    dispatcher = make_dispatcher(tmp_path, twilio[0])
+    state = {"video_analysis": {"risk_level": "Low", "scene_description": "puddle"}}
+    dispatcher.after_agent(types.SimpleNamespace(state=state))
+    assert state["alert_dispatch"] == {"status": "not_required", "alert_level": "GREEN"}
+    assert statuses(dispatcher) == {}
@@ -0,0 +1,58 @@
+import cv2
+import numpy as np
+import pytest
+
+import analysis
+import upload
+from keyframes import HASH_SAMPLES, extract_keyframes
+from upload import HashingUpload
+
+
+def write_video(path, frames):
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"MJPG"), 10, (64, 48))
+    for value in frames:
+        writer.write(np.full((48, 64, 3), value, np.uint8))
+    writer.release()
+    return str(path)
+
+
+def receive(path):
+    """The file as the upload handlers leave it: hashed, closed, in its own temp file."""
+    received = HashingUpload(max_bytes=10 * 1024 * 1024, suffix=".avi")
+    with open(path, "rb") as fh:
+        received.write(fh.read())
+    received.close()
+    return received
+
+
+# ==================== extract_keyframes ====================
+def test_changing_video_yields_keyframes(tmp_path):
+    path = write_video(tmp_path / "clip.avi", [0] * 10 + [200] * 10)
+    keyframes = extract_keyframes(path, "standard")
+    assert [round(ts, 1) for ts, _ in keyframes["frames"]] == [0.0, 1.0]
+    assert keyframes["sent_bytes"] == sum(len(jpeg) for _, jpeg in keyframes["frames"])
+
+
+def test_frame_hashes_come_from_the_same_pass(tmp_path):
+    path = write_video(tmp_path / "clip.avi", [0] * 10 + [200] * 30)
+    assert len(extract_keyframes(path)["hashes"]) == HASH_SAMPLES
+
+
+def test_video_without_frames_raises(tmp_path):
+    path = write_video(tmp_path / "empty.avi", [])
+    with pytest.raises(RuntimeError, match="No decodable frames"):
+        extract_keyframes(path)
+
+
+# ==================== prepare_video ====================
+def test_video_without_keyframes_is_sent_whole(tmp_path, monkeypatch):
+    monkeypatch.setattr(upload, "VIDEO_TRANSPORT", "inline")
+    received = receive(write_video(tmp_path / "empty.avi", []))
+    video = analysis.prepare_video(received, "video/x-msvideo", scope="empty")
+    try:
+        assert video["keyframes"] is None
+        [part] = video["parts"]
+        assert part.inline_data.mime_type == "video/x-msvideo"
+        assert part.inline_data.data == open(received.path, "rb").read()
+    finally:
+        analysis.cleanup_video(video)
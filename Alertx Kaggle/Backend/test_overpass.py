@@ -0,0 +1,169 @@
+import time
+
+import pytest
+
+from overpass import CircuitBreaker, OverpassClient, OverpassError, QueryRejected, RetryBudget
+from overpass_standin import start_standin
+
+QL = "[out:json];node(1,2,3,4);out;"
+RUNTIME_ERROR = "runtime error: Query timed out in \"query\" at line 1 after 25 seconds."
+
+
+@pytest.fixture
+def mirrors():
+    """Start stand-in mirrors on demand; returns ``start(**behaviour) -> (url, behaviour)``."""
+    servers = []
+
+    def start(**behaviour):
+        server, url, state = start_standin(**{"latency_ms": 1, **behaviour})
+        servers.append(server)
+        return url, state
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def make_client(*urls, **options):
+    """Until a mirror has latency samples, mirrors in the same state are tried in the order given."""
+    options = {"hedge_min_delay": 5, "timeout": 5, "failure_threshold": 2, "reset_after": 30, **options}
+    return OverpassClient(mirrors=list(urls), **options)
+
+
+def mirror(client, url):
+    return next(m for m in client.stats()["mirrors"] if m["url"] == url)
+
+
+# ==================== answers ====================
+def test_answer_carries_elements_and_mirror(mirrors):
+    url, state = mirrors()
+    data = make_client(url).query_sync(QL)
+    assert data["elements"]
+    assert data["_mirror"] == url
+    assert data["_bytes"] > 0
+    assert state.requests == 1
+
+
+def test_runtime_error_remark_is_retried_on_another_mirror(mirrors):
+    partial, partial_state = mirrors(remark=RUNTIME_ERROR)
+    good, good_state = mirrors()
+    client = make_client(partial, good)
+    data = client.query_sync(QL)
+    assert data["_mirror"] == good
+    assert (partial_state.requests, good_state.requests) == (1, 1)
+    assert mirror(client, partial)["failures"] == 1
+    assert client.stats()["retries"] == 1
+
+
+def test_runtime_error_remark_on_every_mirror_fails(mirrors):
+    url, _ = mirrors(remark=RUNTIME_ERROR)
+    with pytest.raises(OverpassError, match="runtime error"):
+        make_client(url).query_sync(QL)
+
+
+def test_other_remarks_are_accepted(mirrors):
+    url, _ = mirrors(remark="Note: results are only approximate")
+    assert make_client(url).query_sync(QL)["elements"]
+
+
+def test_rejected_query_is_not_retried(mirrors):
+    bad_query, state = mirrors(fail_rate=1.0, fail_status=400)
+    other, other_state = mirrors()
+    client = make_client(bad_query, other)
+    with pytest.raises(QueryRejected):
+        client.query_sync(QL)
+    assert other_state.requests == 0
+    assert mirror(client, bad_query)["state"] == "closed"
+
+
+# ==================== circuit breaker ====================
+def test_breaker_opens_after_consecutive_failures(mirrors):
+    url, state = mirrors(fail_rate=1.0)
+    client = make_client(url)
+    for _ in range(2):
+        with pytest.raises(OverpassError, match="HTTP 503"):
+            client.query_sync(QL)
+    assert mirror(client, url)["state"] == "open"
+    with pytest.raises(OverpassError, match="circuit open"):
+        client.query_sync(QL)
+    assert state.requests == 2  # the open breaker kept the third query away
+
+
+def test_half_open_probe_closes_the_breaker_on_success(mirrors):
+    url, state = mirrors(fail_rate=1.0)
+    client = make_client(url, reset_after=0.2)
+    for _ in range(2):
+        with pytest.raises(OverpassError):
+            client.query_sync(QL)
+    time.sleep(0.25)
+    assert mirror(client, url)["state"] == "half_open"
+    state.fail_rate = 0.0
+    assert client.query_sync(QL)["_mirror"] == url
+    assert mirror(client, url)["state"] == "closed"
+
+
+def test_half_open_probe_failure_reopens_the_breaker(mirrors):
+    url, state = mirrors(fail_rate=1.0)
+    client = make_client(url, reset_after=0.2)
+    for _ in range(2):
+        with pytest.raises(OverpassError):
+            client.query_sync(QL)
+    time.sleep(0.25)
+    with pytest.raises(OverpassError, match="HTTP 503"):
+        client.query_sync(QL)
+    assert mirror(client, url)["state"] == "open"
+    assert state.requests == 3
+
+
+def test_half_open_breaker_lets_one_probe_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_after=0)
+    breaker.failure()
+    assert breaker.state == "half_open"
+    assert breaker.allow() is True
+    assert breaker.allow() is False
+    breaker.release()  # the probe was cancelled without an outcome
+    assert breaker.allow() is True
+
+
+def test_open_mirror_is_skipped_for_a_healthy_one(mirrors):
+    down, down_state = mirrors(fail_rate=1.0)
+    up, _ = mirrors()
+    client = make_client(down, up, failure_threshold=1)
+    assert client.query_sync(QL)["_mirror"] == up  # retried after the failure
+    assert mirror(client, down)["state"] == "open"
+    for _ in range(3):
+        assert client.query_sync(QL)["_mirror"] == up
+    assert down_state.requests == 1
+
+
+# ==================== retry budget and hedging ====================
+def test_exhausted_budget_stops_retries(mirrors):
+    down, _ = mirrors(fail_rate=1.0)
+    up, up_state = mirrors()
+    client = make_client(down, up)
+    client.budget = RetryBudget(ratio=0, min_tokens=0)
+    with pytest.raises(OverpassError, match="HTTP 503"):
+        client.query_sync(QL)
+    assert up_state.requests == 0
+    assert client.stats()["budget_exhausted"] == 1
+
+
+def test_budget_refills_with_first_attempts():
+    budget = RetryBudget(ratio=0.5, min_tokens=0, max_tokens=1)
+    assert budget.withdraw() is False
+    budget.deposit()
+    budget.deposit()
+    budget.deposit()
+    assert budget.tokens == 1
+    assert budget.withdraw() is True
+
+
+def test_slow_primary_is_hedged(mirrors):
+    slow, _ = mirrors(latency_ms=1500)
+    fast, _ = mirrors(latency_ms=20)
+    client = make_client(slow, fast, hedge_min_delay=0.1)
+    started = time.monotonic()
+    assert client.query_sync(QL)["_mirror"] == fast
+    assert time.monotonic() - started < 1
+    stats = client.stats()
+    assert (stats["hedges"], stats["hedge_wins"]) == (1, 1)
@@ -0,0 +1,164 @@
+import json
+
+import pytest
+
+from schemas import SchemaError, _coerce, _repair_fields, parse_json_text, repair
+
+VALID_REPORT = {"alert_level": "RED", "summary": "Underpass flooded", "threats": [], "actions": []}
+
+
+# ==================== parse_json_text ====================
+def test_plain_json_needs_no_fixes():
+    fixes = []
+    assert parse_json_text('{"a": 1}', fixes) == {"a": 1}
+    assert fixes == []
+
+
+@pytest.mark.parametrize("text", [
+    '```json\n{"a": 1}\n```',
+    '```\n{"a": 1}\n```',
+    '  ```JSON\n{"a": 1}```  ',
+])
+def test_markdown_fence_is_stripped(text):
+    fixes = []
+    assert parse_json_text(text, fixes) == {"a": 1}
+    assert fixes == ["fence"]
+
+
+def test_object_is_extracted_from_prose():
+    fixes = []
+    assert parse_json_text('Here is the report: {"a": 1} Hope this helps!', fixes) == {"a": 1}
+    assert fixes == ["extract"]
+
+
+@pytest.mark.parametrize("text", ['{"a": [1, 2,], "b": 2,}', '{"a": [1, 2 ,\n],\n}'])
+def test_trailing_commas_are_removed(text):
+    fixes = []
+    assert parse_json_text(text, fixes)["a"] == [1, 2]
+    assert fixes == ["trailing_comma"]
+
+
+def test_smart_quotes_and_trailing_comma_inside_fence():
+    fixes = []
+    assert parse_json_text("```json\n{“a”: “b”,}\n```", fixes) == {"a": "b"}
+    assert fixes == ["fence", "smart_quotes", "trailing_comma"]
+
+
+@pytest.mark.parametrize("text", ["no json here", "{not: json at all", ""])
+def test_unparseable_text_raises(text):
+    with pytest.raises(SchemaError):
+        parse_json_text(text, [])
+
+
+# ==================== _coerce ====================
+ENUM = {"type": "enum", "values": ["Severe", "High"], "aliases": {"critical": "Severe"}, "strict": True}
+
+
+@pytest.mark.parametrize("value, expected", [("Severe", "Severe"), ("severe", "Severe"), (" HIGH ", "High"),
+                                             ("Critical", "Severe")])
+def test_enum_case_and_aliases(value, expected):
+    assert _coerce(ENUM, value, "risk", []) == expected
+
+
+def test_enum_fix_is_recorded_only_when_changed():
+    fixes = []
+    _coerce(ENUM, "Severe", "risk", fixes)
+    assert fixes == []
+    _coerce(ENUM, "critical", "risk", fixes)
+    assert fixes == ["enum"]
+
+
+def test_strict_enum_rejects_unknown_values():
+    with pytest.raises(SchemaError, match="risk"):
+        _coerce(ENUM, "apocalyptic", "risk", [])
+
+
+def test_loose_enum_keeps_unknown_values():
+    spec = {**ENUM, "strict": False}
+    assert _coerce(spec, "Coast Guard", "department", []) == "Coast Guard"
+
+
+@pytest.mark.parametrize("spec, value, expected", [
+    ({"type": "number"}, "1.5 km", 1.5),
+    ({"type": "number"}, "-3", -3.0),
+    ({"type": "str"}, 42, "42"),
+    ({"type": "str"}, ["a", "b"], "a; b"),
+    ({"type": "list", "items": {"type": "str"}}, "only one", ["only one"]),
+])
+def test_scalars_and_lists_are_coerced(spec, value, expected):
+    fixes = []
+    assert _coerce(spec, value, "x", fixes) == expected
+    assert "coerce" in fixes
+
+
+@pytest.mark.parametrize("spec, value", [({"type": "number"}, "far"), ({"type": "number"}, True),
+                                         ({"type": "str"}, {"a": 1}), ({"type": "object", "fields": {}}, [1])])
+def test_uncoercible_values_raise(spec, value):
+    with pytest.raises(SchemaError):
+        _coerce(spec, value, "x", [])
+
+
+def test_bad_list_items_are_dropped():
+    fixes = []
+    spec = {"type": "list", "items": {"type": "number"}}
+    assert _coerce(spec, [1, "2 km", "far", None], "d", fixes) == [1, 2.0]
+    assert fixes.count("drop_item") == 2
+
+
+# ==================== _repair_fields ====================
+FIELDS = {
+    "level": {"type": "enum", "values": ["RED", "GREEN"], "required": True, "strict": True},
+    "threats": {"type": "list", "items": {"type": "str"}, "default": []},
+    "lead": {"type": "str", "default": "unknown"},
+}
+
+
+def test_defaults_fill_missing_and_empty_fields():
+    fixes = []
+    out = _repair_fields(FIELDS, {"level": "RED", "lead": ""}, "", fixes)
+    assert out == {"level": "RED", "threats": [], "lead": "unknown"}
+    assert fixes == ["default", "default"]
+
+
+def test_unknown_keys_are_kept():
+    assert _repair_fields(FIELDS, {"level": "RED", "extra": 1}, "", [])["extra"] == 1
+
+
+@pytest.mark.parametrize("data", [{}, {"level": None}, {"level": ""}])
+def test_missing_required_field_fails(data):
+    with pytest.raises(SchemaError, match="level: missing"):
+        _repair_fields(FIELDS, data, "", [])
+
+
+def test_nested_required_field_reports_its_path():
+    fields = {"user_location": {"type": "object", "required": True, "fields": {
+        "lat": {"type": "number", "required": True}, "lon": {"type": "number", "required": True}}}}
+    with pytest.raises(SchemaError, match="user_location.lon: missing"):
+        _repair_fields(fields, {"user_location": {"lat": 1}}, "", [])
+
+
+# ==================== repair ====================
+def test_valid_output_has_no_fixes():
+    data, fixes = repair("final_report", json.dumps(VALID_REPORT))
+    assert data == VALID_REPORT
+    assert fixes == []
+
+
+def test_typical_model_output_is_repaired():
+    text = ('```json\n{"alert_level": "amber", "summary": "Tree on power line",'
+            ' "actions": [{"action": "Cut power", "priority": "urgent"}, {"priority": "Low"}],}\n```')
+    data, fixes = repair("final_report", text)
+    assert data["alert_level"] == "ORANGE"
+    assert data["threats"] == []
+    assert data["actions"] == [{"action": "Cut power", "priority": "Immediate", "lead": "", "nearest": ""}]
+    assert {"fence", "trailing_comma", "enum", "default", "drop_item"} <= set(fixes)
+
+
+def test_missing_alert_level_cannot_be_repaired():
+    with pytest.raises(SchemaError, match="alert_level: missing"):
+        repair("final_report", '{"summary": "Something happened"}')
+
+
+def test_non_object_output_is_rejected():
+    with pytest.raises(SchemaError, match="expected a JSON object"):
+        repair("final_report", "[1, 2]")
@@ -0,0 +1,252 @@
+import bisect
+import contextvars
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Send a `timing` SSE event at the end of each analysis unless the client opts in per request
+TIMING_EVENTS = os.environ.get("ALERTX_TIMING_EVENTS", "0") == "1"
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+QUANTILES = (0.5, 0.95, 0.99)
+RESERVOIR_SIZE = 2048  # most recent samples kept per stage for p50/p95/p99
+# Traces and open spans nobody collected (chat turns, errored runs, job workers
+# without timing) are dropped this long after they started
+TRACE_TTL_S = float(os.environ.get("ALERTX_TRACE_TTL_S", 600))
+SWEEP_INTERVAL_S = 60
+
+_lock = threading.Lock()
+_buckets = defaultdict(lambda: [0] * (len(BUCKETS) + 1))
+_sums = defaultdict(float)
+_recent = defaultdict(lambda: deque(maxlen=RESERVOIR_SIZE))
+_counters = defaultdict(float)  # (metric, labels tuple) -> value
+_stats_providers = {}
+
+# invocation id -> spans recorded for that run, collected by analysis_events
+_traces = defaultdict(list)
+_trace_started = {}  # invocation id -> monotonic time of its first span
+# (start time, attrs) of spans keyed by (invocation id, agent, ...) between before/after callbacks
+_open = {}
+_last_sweep = time.monotonic()
+# The trace (invocation id, or upload path while a video is prepared) the
+# current code runs for, so nested spans such as outbound HTTP attach to it
+current_trace = contextvars.ContextVar("alertx_trace", default=None)
+
+
+def observe(stage: str, seconds: float, trace_key: str = None, **attrs):
+    """Record one duration for ``stage`` (and for the trace of ``trace_key``, if given)."""
+    with _lock:
+        _buckets[stage][bisect.bisect_left(BUCKETS, seconds)] += 1
+        _sums[stage] += seconds
+        _recent[stage].append(seconds)
+        for name in ("bytes", "prompt_tokens", "completion_tokens"):
+            if attrs.get(name):
+                _counters[(f"alertx_stage_{name}_total", (("stage", stage),))] += attrs[name]
+        if trace_key:
+            _trace(trace_key).append({"stage": stage, "ms": round(seconds * 1000, 1), **attrs})
+
+
+def _trace(trace_key):
+    # caller holds the lock
+    if trace_key not in _trace_started:
+        _trace_started[trace_key] = time.monotonic()
+        _sweep()
+    return _traces[trace_key]
+
+
+def _sweep():
+    # caller holds the lock; at most every SWEEP_INTERVAL_S
+    global _last_sweep
+    now = time.monotonic()
+    if now - _last_sweep < SWEEP_INTERVAL_S:
+        return
+    _last_sweep = now
+    for key, started in list(_trace_started.items()):
+        if now - started > TRACE_TTL_S:
+            del _trace_started[key]
+            _traces.pop(key, None)
+    oldest = time.perf_counter() - TRACE_TTL_S
+    for key, (started, _) in list(_open.items()):
+        if started < oldest:
+            _open.pop(key, None)
+
+
+@contextmanager
+def span(stage: str, trace_key: str = None, **attrs):
+    """Time a block; the yielded dict can be filled with attributes (e.g. ``bytes``)."""
+    trace_key = trace_key or current_trace.get()
+    start = time.perf_counter()
+    try:
+        yield attrs
+    finally:
+        observe(stage, time.perf_counter() - start, trace_key, **attrs)
+
+
+def annotate(trace_key: str, stage: str, **attrs):
+    """Add a non-timing entry (e.g. estimated savings) to a trace; no histogram."""
+    if trace_key:
+        with _lock:
+            _trace(trace_key).append({"stage": stage, **attrs})
+
+
+def count(metric: str, value: float = 1, **labels):
+    """Increment a Prometheus counter ``metric`` (use a ``_total`` suffix)."""
+    with _lock:
+        _counters[(metric, tuple(sorted(labels.items())))] += value
+
+
+def trace_totals(trace_key: str, stage: str) -> dict:
+    """Sum of the numeric attributes of ``stage``'s spans in a trace, without consuming it."""
+    totals = defaultdict(float)
+    with _lock:
+        for entry in _traces.get(trace_key, []):
+            if entry["stage"] == stage:
+                for key, value in entry.items():
+                    if isinstance(value, (int, float)):
+                        totals[key] += value
+    return dict(totals)
+
+
+def pop_trace(trace_key: str) -> list:
+    with _lock:
+        _trace_started.pop(trace_key, None)
+        return _traces.pop(trace_key, [])
+
+
+def register_stats(prefix: str, provider):
+    """Expose a component's ``stats()`` dict as gauges on /metrics."""
+    _stats_providers[prefix] = provider
+
+
+# ==================== ADK CALLBACKS ====================
+def _start(key, **attrs):
+    _open[key] = (time.perf_counter(), attrs)
+
+
+def _finish(key, stage, trace_key, **attrs):
+    entry = _open.pop(key, None)
+    if entry is not None:
+        start, started_attrs = entry
+        observe(stage, time.perf_counter() - start, trace_key, **started_attrs, **attrs)
+
+
+def _before_agent(callback_context):
+    current_trace.set(callback_context.invocation_id)
+    _start(("agent", callback_context.invocation_id, callback_context.agent_name))
+
+
+def _after_agent(callback_context):
+    name = callback_context.agent_name
+    _finish(("agent", callback_context.invocation_id, name), f"agent.{name}", callback_context.invocation_id)
+
+
+def _payload_bytes(llm_request) -> int:
+    size = 0
+    for content in llm_request.contents or []:
+        for part in content.parts or []:
+            if part.text:
+                size += len(part.text.encode("utf-8"))
+            elif part.inline_data and part.inline_data.data:
+                size += len(part.inline_data.data)
+    return size
+
+
+def _before_model(callback_context, llm_request):
+    _start(("model", callback_context.invocation_id, callback_context.agent_name), bytes=_payload_bytes(llm_request))
+
+
+def _after_model(callback_context, llm_response):
+    if llm_response.partial:
+        return None
+    name = callback_context.agent_name
+    key = ("model", callback_context.invocation_id, name)
+    usage = llm_response.usage_metadata
+    _finish(key, f"model.{name}", callback_context.invocation_id,
+            prompt_tokens=(usage.prompt_token_count or 0) if usage else 0,
+            completion_tokens=(usage.candidates_token_count or 0) if usage else 0)
+    return None
+
+
+def _before_tool(tool, args, tool_context):
+    current_trace.set(tool_context.invocation_id)
+    _start(("tool", tool_context.invocation_id, tool_context.function_call_id))
+
+
+def _after_tool(tool, args, tool_context, tool_response):
+    _finish(("tool", tool_context.invocation_id, tool_context.function_call_id),
+            f"tool.{tool.name}", tool_context.invocation_id)
+    return None
+
+
+def instrument(root_agent):
+    """Attach span callbacks to every agent, model call and tool call under ``root_agent``."""
+    from callbacks import add_callback, walk_agents  # keeps this module free of ADK imports
+
+    for agent in walk_agents(root_agent):
+        add_callback(agent, "before_agent_callback", _before_agent)
+        add_callback(agent, "after_agent_callback", _after_agent)
+        add_callback(agent, "before_model_callback", _before_model)
+        add_callback(agent, "after_model_callback", _after_model)
+        add_callback(agent, "before_tool_callback", _before_tool)
+        add_callback(agent, "after_tool_callback", _after_tool)
+    return root_agent
+
+
+# ==================== PROMETHEUS ====================
+def _quantile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _labels(pairs) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    lines = [
+        "# HELP alertx_stage_seconds Latency of each pipeline stage (upload, agent, model, tool, http).",
+        "# TYPE alertx_stage_seconds histogram",
+    ]
+    with _lock:
+        stages = sorted(_buckets)
+        for stage in stages:
+            cumulative = 0
+            for bound, count in zip(BUCKETS + (float("inf"),), _buckets[stage]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"alertx_stage_seconds_bucket{_labels([('stage', stage), ('le', le)])} {cumulative}")
+            lines.append(f"alertx_stage_seconds_sum{_labels([('stage', stage)])} {_sums[stage]:.6f}")
+            lines.append(f"alertx_stage_seconds_count{_labels([('stage', stage)])} {cumulative}")
+
+        lines += [
+            f"# HELP alertx_stage_latency_seconds p50/p95/p99 over the last {RESERVOIR_SIZE} samples per stage.",
+            "# TYPE alertx_stage_latency_seconds summary",
+        ]
+        for stage in stages:
+            samples = list(_recent[stage])
+            for q in QUANTILES:
+                value = _quantile(samples, q)
+                lines.append(f"alertx_stage_latency_seconds{_labels([('stage', stage), ('quantile', q)])} {value:.6f}")
+
+        names = sorted({name for name, _ in _counters})
+        for name in names:
+            lines.append(f"# TYPE {name} counter")
+            for (metric, labels), value in sorted(_counters.items()):
+                if metric == name:
+                    lines.append(f"{metric}{_labels(labels)} {value:g}")
+
+    for prefix, provider in sorted(_stats_providers.items()):
+        for key, value in sorted(provider().items()):
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines.append(f"# TYPE {prefix}_{key} gauge")
+                lines.append(f"{prefix}_{key} {value}")
+    return "\n".join(lines) + "\n"
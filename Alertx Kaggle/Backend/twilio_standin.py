@@ -0,0 +1,117 @@
+"""Local stand-in for Twilio's Calls API, with injectable latency and failures.
+
+    python twilio_standin.py --port 8201 --latency-ms 150 --fail-rate 0.1 --fail-status 503
+
+Accepts ``POST /2010-04-01/Accounts/<sid>/Calls.json`` with HTTP basic auth
+and records every call it is asked to place, so the alert dispatcher can be
+exercised without a Twilio account or real phone calls:
+
+    ALERTX_TWILIO_API=http://127.0.0.1:8201 TWILIO_ACCOUNT_SID=AC123 TWILIO_AUTH_TOKEN=x \\
+    TWILIO_FROM_NUMBER=+15550000000 ALERTX_ALERT_ROUTES="*=+15550000001" python app.py
+"""
+import argparse
+import base64
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+_CALLS_PATH = re.compile(r"^/2010-04-01/Accounts/(?P<sid>[^/]+)/Calls\.json$")
+
+
+class Behaviour:
+    def __init__(self, latency_ms=100.0, fail_rate=0.0, fail_status=503, retry_after=None,
+                 account_sid="AC00000000000000000000000000000000", auth_token="standin"):
+        self.latency_ms = latency_ms
+        self.fail_rate = fail_rate
+        self.fail_status = fail_status
+        self.retry_after = retry_after
+        self.account_sid = account_sid
+        self.auth_token = auth_token
+        self.requests = 0
+        self.calls = []  # accepted calls: {"sid", "to", "from", "twiml", "at"}
+        self.lock = threading.Lock()
+
+
+def _handler(behaviour: Behaviour):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def _reply(self, status: int, payload: dict, headers: dict = None):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            try:
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def do_POST(self):
+            form = parse_qs(self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode("utf-8"))
+            with behaviour.lock:
+                behaviour.requests += 1
+            match = _CALLS_PATH.match(self.path)
+            if not match:
+                return self._reply(404, {"code": 20404, "message": "The requested resource was not found"})
+            expected = base64.b64encode(f"{behaviour.account_sid}:{behaviour.auth_token}".encode()).decode()
+            if match["sid"] != behaviour.account_sid or self.headers.get("Authorization") != f"Basic {expected}":
+                return self._reply(401, {"code": 20003, "message": "Authenticate"})
+            if not form.get("To") or not form.get("From") or not (form.get("Twiml") or form.get("Url")):
+                return self._reply(400, {"code": 21201, "message": "To, From and Twiml or Url are required"})
+            time.sleep(behaviour.latency_ms * random.uniform(0.8, 1.2) / 1000)
+            if random.random() < behaviour.fail_rate:
+                headers = {"Retry-After": str(behaviour.retry_after)} if behaviour.retry_after else None
+                return self._reply(behaviour.fail_status, {"code": 20500, "message": "injected failure"}, headers)
+            call = {"sid": "CA" + uuid.uuid4().hex, "to": form["To"][0], "from": form["From"][0],
+                    "twiml": (form.get("Twiml") or form.get("Url"))[0], "at": time.time()}
+            with behaviour.lock:
+                behaviour.calls.append(call)
+            self._reply(201, {"sid": call["sid"], "to": call["to"], "from": call["from"], "status": "queued"})
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def start_standin(port: int = 0, **behaviour):
+    """Serve in a daemon thread; returns ``(server, url, behaviour)``. ``port=0`` picks a free port."""
+    state = Behaviour(**behaviour)
+    server = ThreadingHTTPServer(("127.0.0.1", port), _handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}", state
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8201)
+    parser.add_argument("--latency-ms", type=float, default=100)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--fail-status", type=int, default=503)
+    parser.add_argument("--account-sid", default="AC00000000000000000000000000000000")
+    parser.add_argument("--auth-token", default="standin")
+    args = parser.parse_args()
+    server, url, state = start_standin(args.port, latency_ms=args.latency_ms, fail_rate=args.fail_rate,
+                                       fail_status=args.fail_status, account_sid=args.account_sid,
+                                       auth_token=args.auth_token)
+    print(f"Twilio stand-in on {url} (account {args.account_sid}, token {args.auth_token})")
+    try:
+        while True:
+            time.sleep(10)
+            print(f"{len(state.calls)} calls placed, {state.requests} requests")
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
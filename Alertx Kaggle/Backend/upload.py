@@ -0,0 +1,217 @@
+import hashlib
+import mmap
+import os
+import tempfile
+import time
+
+from dotenv import load_dotenv
+from flask import Request
+from google import genai
+from google.genai.types import Blob, FileData, Part
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from tracing import observe, span
+
+load_dotenv()
+
+# Largest video we accept; checked against Content-Length up front and again
+# while the multipart body is streamed to disk.
+MAX_UPLOAD_BYTES = int(os.environ.get("ALERTX_MAX_UPLOAD_MB", 200)) * 1024 * 1024
+# "file_api" uploads the video to the Gemini Files API and sends a reference;
+# "inline" sends the bytes inside the request.
+VIDEO_TRANSPORT = os.environ.get("ALERTX_VIDEO_TRANSPORT", "file_api")
+FILE_API_POLL_SECONDS = 1.0
+FILE_API_MAX_WAIT_SECONDS = 120
+
+
+class HashingUpload:
+    """Temp file that hashes and counts every chunk Werkzeug streams into it.
+
+    The multipart parser writes the upload in bounded chunks, so the video is
+    on disk exactly once and never held in memory as a whole.
+    """
+
+    def __init__(self, max_bytes: int, suffix: str = ".mp4"):
+        self._fh = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
+        self.path = self._fh.name
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._sha256 = hashlib.sha256()
+        self.started_at = time.perf_counter()
+        self.elapsed = None  # seconds spent receiving, set on close()
+
+    def write(self, chunk) -> int:
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            self.discard()
+            raise RequestEntityTooLarge(f"Video exceeds {self.max_bytes // (1024 * 1024)} MB")
+        self._sha256.update(chunk)
+        return self._fh.write(chunk)
+
+    @property
+    def sha256(self) -> str:
+        return self._sha256.hexdigest()
+
+    def close(self):
+        if self.elapsed is None:
+            self.elapsed = time.perf_counter() - self.started_at
+            observe("upload", self.elapsed, bytes=self.size)
+        self._fh.close()
+
+    def discard(self):
+        self._fh.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def __getattr__(self, name):
+        # read / seek / tell / flush / close used by Werkzeug's FileStorage
+        return getattr(self._fh, name)
+
+
+class UploadRequest(Request):
+    """Flask request whose file parts stream straight into :class:`HashingUpload`."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingUpload(MAX_UPLOAD_BYTES)
+
+
+_client = None
+
+
+def _genai_client():
+    global _client
+    if _client is None:
+        _client = genai.Client()
+    return _client
+
+
+def video_part(upload: HashingUpload, mime_type: str = "video/mp4"):
+    """Build the model ``Part`` for an uploaded video.
+
+    Returns ``(part, file_name)`` where ``file_name`` is the Files API handle to
+    delete after the run (None for inline transport).
+    """
+    if VIDEO_TRANSPORT == "file_api":
+        try:
+            client = _genai_client()
+            with span("http.files_api", bytes=upload.size):
+                uploaded = client.files.upload(file=upload.path, config={"mime_type": mime_type})
+                deadline = time.monotonic() + FILE_API_MAX_WAIT_SECONDS
+                while uploaded.state and uploaded.state.name == "PROCESSING" and time.monotonic() < deadline:
+                    time.sleep(FILE_API_POLL_SECONDS)
+                    uploaded = client.files.get(name=uploaded.name)
+            if uploaded.state and uploaded.state.name == "ACTIVE":
+                return Part(file_data=FileData(file_uri=uploaded.uri, mime_type=mime_type)), uploaded.name
+            print(f"Files API upload not ready ({uploaded.state}); sending video inline")
+        except Exception as e:
+            print(f"Files API upload failed ({e}); sending video inline")
+
+    # Inline fallback: one copy, taken straight from the page cache via mmap
+    data = b""
+    if upload.size:
+        with open(upload.path, "rb") as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            data = mm[:]
+    return Part(inline_data=Blob(mime_type=mime_type, data=data)), None
+
+
+def delete_remote_file(file_name):
+    if file_name:
+        try:
+            _genai_client().files.delete(name=file_name)
+        except Exception as e:
+            print(f"Could not delete uploaded file {file_name}: {e}")
+
+
+async def receive_form(request, file_field: str = "video", max_bytes: int = MAX_UPLOAD_BYTES,
+                       max_field_bytes: int = 1024 * 1024):
+    """Parse an ASGI (Starlette) multipart body in one pass, as it arrives.
+
+    Returns ``(fields, upload)``: the text fields, and the ``file_field`` file
+    as a closed :class:`HashingUpload` with ``filename`` and ``content_type``
+    set (None when absent or empty). File bytes go from the socket straight
+    into the upload, hashed on the way, and are written to disk once; other
+    file parts are dropped. Raises RequestEntityTooLarge once the file passes
+    ``max_bytes`` or the text fields ``max_field_bytes``, whatever
+    Content-Length claimed (chunked bodies have none), and ValueError for a
+    malformed body.
+    """
+    # Installed with Starlette's form support; only the ASGI server needs it
+    from python_multipart.multipart import MultipartParser, parse_options_header
+
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data":
+        form = await request.form()
+        return {key: value for key, value in form.items() if isinstance(value, str)}, None
+    if not params.get(b"boundary"):
+        raise ValueError("multipart body without a boundary")
+
+    fields = {}
+    upload = None
+    part = {}  # the part being parsed: headers, then name / target
+    field_bytes = 0
+
+    def on_part_begin():
+        part.clear()
+        part["headers"] = {}
+        part["header"] = [b"", b""]
+
+    def on_header_field(data, start, end):
+        part["header"][0] += data[start:end]
+
+    def on_header_value(data, start, end):
+        part["header"][1] += data[start:end]
+
+    def on_header_end():
+        name, value = part["header"]
+        part["headers"][name.strip().lower()] = value.strip()
+        part["header"] = [b"", b""]
+
+    def on_headers_finished():
+        nonlocal upload
+        _, disposition = parse_options_header(part["headers"].get(b"content-disposition", b""))
+        name = disposition.get(b"name", b"").decode("utf-8", "replace")
+        filename = disposition.get(b"filename")
+        part["name"] = name
+        if filename is None:
+            part["target"] = bytearray()
+        elif name == file_field and upload is None:
+            upload = part["target"] = HashingUpload(max_bytes)
+            upload.filename = filename.decode("utf-8", "replace")
+            upload.content_type = part["headers"].get(b"content-type", b"").decode("latin-1")
+        else:
+            part["target"] = None
+
+    def on_part_data(data, start, end):
+        nonlocal field_bytes
+        target = part["target"]
+        if isinstance(target, bytearray):
+            field_bytes += end - start
+            if field_bytes > max_field_bytes:
+                raise RequestEntityTooLarge("Form fields too large")
+            target += data[start:end]
+        elif target is not None:
+            target.write(data[start:end])
+
+    def on_part_end():
+        if isinstance(part.get("target"), bytearray):
+            fields[part["name"]] = part["target"].decode("utf-8", "replace")
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin, "on_header_field": on_header_field, "on_header_value": on_header_value,
+        "on_header_end": on_header_end, "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data, "on_part_end": on_part_end,
+    })
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+        parser.finalize()
+    except BaseException:
+        if upload is not None:
+            upload.discard()
+        raise
+    if upload is not None:
+        upload.close()
+        if not upload.filename or not upload.size:  # empty file field
+            upload.discard()
+            upload = None
+    return fields, upload